@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import argparse, sys
+from lost import settings
+
+
+settings.DEBUG = False
+settings.TERMINAL_MODE = 'logistics'
+settings.TERMINAL_NAME = 'Benchmark'
+settings.TERMINAL_PASSWORD = "vf6r4cnf3 password for testing only, don't use!"
+settings.SERVER_ADDRESS = ('built-in', 38007)
+settings.SERVER_URL = '/stempeluhr/event/submit/'
+
+
+from benchmarks.bench_backlog import bench_backlog_10k, bench_backlog_100k
+from benchmarks.bench_network import bench_post_stamp_event
+from benchmarks.bench_terminal import bench_notify_observers
+from benchmarks.bench_threads import bench_thread_queue_dispatch
+from benchmarks.runner import compare, load_report, run_benchmarks, save_report
+from lost.server import start_testserver
+
+
+# The results depend on the machine, so record the baseline on the same machine, e.g.
+# before a change, see docs/program-design.md:
+#
+# python bench.py --output baseline.json
+# python bench.py --baseline baseline.json
+
+parser = argparse.ArgumentParser(description="Measures the hot paths of LoST.")
+parser.add_argument('--quick', action='store_true', help="skip the slow benchmarks, e.g. with 100k backlog entries")
+parser.add_argument('--output', default=None, help="write the results to this JSON file")
+parser.add_argument('--baseline', default=None, help="compare the results to those in this JSON file")
+parser.add_argument('--tolerance', type=float, default=0.2, help="the relative change that counts as a regression")
+args = parser.parse_args()
+
+benchmarks = [
+    bench_post_stamp_event,
+    bench_backlog_10k,
+    bench_thread_queue_dispatch,
+    bench_notify_observers,
+]
+if not args.quick:
+    benchmarks.insert(2, bench_backlog_100k)
+
+httpd = start_testserver(settings.SERVER_ADDRESS[1])
+try:
+    report = run_benchmarks(benchmarks)
+finally:
+    httpd.shutdown()
+    httpd.server_close()
+
+if args.output:
+    save_report(report, args.output)
+
+if args.baseline:
+    regressions = compare(report, load_report(args.baseline), args.tolerance)
+    for name, base_value, value, change in regressions:
+        print(f"REGRESSION: {name}: {base_value:.3f} -> {value:.3f} ({change:+.0%} worse)")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions compared to {args.baseline}.")
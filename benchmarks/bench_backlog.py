@@ -0,0 +1,60 @@
+from pathlib import Path
+import json, tempfile, time
+
+from lost.backlog import Backlog
+from benchmarks.runner import throughput_result
+
+
+BATCH_SIZE = 50
+USER_INPUT_JSON = json.dumps({
+    'smartcard_id': "04 1A 2B 3C 4D 5E 6F",
+    'terminal_ts': "2022-04-02 18:12:00",
+    'backlog_count': 1,
+    'event_id': "0123456789abcdef0123456789abcdef",
+    'department': "Logistics",
+    'pause': 30,
+})
+
+
+def insert_and_replay(num_entries):
+    """
+    Fills a backlog with `num_entries` entries, one commit each as in `on_server_reply()`,
+    then replays it in batches as the `DrainScheduler` does, but without the network.
+    """
+    path = Path(tempfile.gettempdir()) / "tmp_LoST_bench_backlog.sqlite3"
+    path.unlink(missing_ok=True)
+    backlog = Backlog(str(path), 'grouped')
+
+    time_started = time.monotonic()
+    for nr in range(num_entries):
+        backlog.append(USER_INPUT_JSON)
+        backlog.sync()
+    backlog.flush()
+    insert_seconds = time.monotonic() - time_started
+
+    time_started = time.monotonic()
+    now = time.time()
+    while len(backlog) > 0:
+        entries = backlog.get_available(BATCH_SIZE, now)
+        seqs = [seq for seq, time_added, user_input_json in entries]
+        backlog.lease(seqs, now + 60.0)
+        for seq in seqs:
+            backlog.ack(seq)
+        backlog.sync()
+    backlog.flush()
+    replay_seconds = time.monotonic() - time_started
+
+    backlog.close()
+    path.unlink(missing_ok=True)
+
+    results = throughput_result(f"backlog.insert_{num_entries // 1000}k", num_entries, insert_seconds)
+    results.update(throughput_result(f"backlog.replay_{num_entries // 1000}k", num_entries, replay_seconds))
+    return results
+
+
+def bench_backlog_10k():
+    return insert_and_replay(10000)
+
+
+def bench_backlog_100k():
+    return insert_and_replay(100000)
@@ -0,0 +1,31 @@
+import time
+
+from lost.network_handler import post_stamp_event, SessionPool
+from benchmarks.runner import latency_results
+
+
+NUM_REQUESTS = 200
+
+
+def round_trips(session_pool):
+    durations = []
+
+    for nr in range(NUM_REQUESTS):
+        user_input = {'smartcard_id': f"bench-{nr}", 'terminal_ts': "2022-04-02 18:12:00", 'backlog_count': 0}
+        time_started = time.monotonic()
+        user_input, result, network_error = post_stamp_event(user_input, session_pool)
+        durations.append(time.monotonic() - time_started)
+        assert network_error is None, network_error
+
+    return durations
+
+
+def bench_post_stamp_event():
+    """The round-trip time of `post_stamp_event()` to the built-in server, with and without pooling."""
+    results = latency_results("post_stamp_event.unpooled", round_trips(None))
+
+    session_pool = SessionPool()
+    results.update(latency_results("post_stamp_event.pooled", round_trips(session_pool)))
+    session_pool.close()
+
+    return results
@@ -0,0 +1,34 @@
+import time
+
+from lost.modes.office_terminal import Terminal
+from lost.scheduler import Scheduler
+from benchmarks.runner import result
+
+
+NUM_NOTIFICATIONS = 2000
+
+
+class NullObserver:
+
+    def update_to_model(self, terminal, changed):
+        pass
+
+
+def bench_notify_observers():
+    """The cost of a setter of the terminal, including `notify_observers()`, with N observers."""
+    results = {}
+
+    for num_observers in (1, 10, 100):
+        terminal = Terminal(Scheduler())
+        for nr in range(num_observers):
+            terminal.add_observer(NullObserver())
+        terminal.notify_observers()
+
+        time_started = time.perf_counter()
+        for nr in range(NUM_NOTIFICATIONS):
+            terminal.set_pause(nr % 2 * 30)
+        seconds = time.perf_counter() - time_started
+
+        results[f"notify_observers.{num_observers}_observers.us"] = result(seconds / NUM_NOTIFICATIONS * 1e6, "us", "lower")
+
+    return results
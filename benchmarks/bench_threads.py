@@ -0,0 +1,37 @@
+import select, threading, time
+
+from lost.main_connector import MainConnector
+from lost.thread_tools import thread_queue
+from benchmarks.runner import latency_results
+
+
+NUM_ITEMS = 2000
+
+
+def bench_thread_queue_dispatch():
+    """
+    The time from putting a callback into the `thread_queue` in a worker thread until
+    the `MainConnector` has dispatched it in the main thread, as woken up by the pipe.
+    """
+    assert thread_queue.empty()
+    main_con = MainConnector()
+    durations = []
+
+    def on_item(time_put):
+        durations.append(time.monotonic() - time_put)
+
+    def produce():
+        for nr in range(NUM_ITEMS):
+            thread_queue.put((on_item, (time.monotonic(),)))
+            # Give the main thread time to handle each item on its own.
+            time.sleep(0.0005)
+
+    thread = threading.Thread(target=produce)
+    thread.start()
+
+    while len(durations) < NUM_ITEMS:
+        select.select([thread_queue.fileno()], [], [], 1.0)
+        main_con.on_thread_queue_wakeup()
+
+    thread.join()
+    return latency_results("thread_queue.dispatch", durations)
@@ -0,0 +1,84 @@
+import json
+import platform
+import time
+
+from lost.common import get_percentile
+
+
+def latency_results(name, durations):
+    """Returns the p50 and p99 results in milliseconds for the given durations in seconds."""
+    durations = sorted(durations)
+    return {
+        f"{name}.p50_ms": result(get_percentile(durations, 50) * 1000.0, "ms", "lower"),
+        f"{name}.p99_ms": result(get_percentile(durations, 99) * 1000.0, "ms", "lower"),
+    }
+
+
+def throughput_result(name, count, seconds):
+    return {f"{name}.per_s": result(count / seconds, "1/s", "higher")}
+
+
+def result(value, unit, better):
+    assert better in ('lower', 'higher')
+    return {'value': round(value, 6), 'unit': unit, 'better': better}
+
+
+def run_benchmarks(benchmarks, log=print):
+    """
+    Runs the given benchmark functions, each of which returns a dict of results by name,
+    and returns the report with all results.
+    """
+    results = {}
+
+    for bench in benchmarks:
+        log(f"{bench.__module__}.{bench.__name__} ...")
+        time_started = time.monotonic()
+        bench_results = bench()
+        for name, res in bench_results.items():
+            log(f"    {name:48} {res['value']:14.3f} {res['unit']}")
+        log(f"    ({time.monotonic() - time_started:.1f} s)")
+        results.update(bench_results)
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Compares the results of the report to those of the baseline report.
+
+    Returns the list of regressions, i.e. the results that are worse than in the baseline
+    by more than `tolerance` (relative), as `(name, baseline value, value, change)` tuples.
+    Results that are not in both reports are ignored.
+    """
+    regressions = []
+
+    for name, res in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or base['value'] == 0:
+            continue
+
+        change = (res['value'] - base['value']) / base['value']
+        if res['better'] == 'higher':
+            change = -change
+
+        if change > tolerance:
+            regressions.append((name, base['value'], res['value'], change))
+
+    return regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
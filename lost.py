@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 import logging
-import queue
 
 from lost import settings
+from lost.event_store import EventStore
+from lost.log_tools import setup_logger
+from lost.main_connector import MainConnector
+from lost.metrics import start_metrics_server
 from lost.network_handler import NetworkHandler
+from lost.scheduler import scheduler
 from lost.server import start_testserver
 from lost.sm_card import SmartcardMonitor
-from lost.thread_tools import thread_queue
+from lost.tracing import tracer
 
 
 if settings.TERMINAL_MODE == 'logistics':
@@ -19,63 +23,15 @@ else:
     assert False, "Unknown terminal mode."
 
 
-def setup_logger(logger):
-    log_level = logging.DEBUG if settings.DEBUG else logging.INFO
-    logger.setLevel(log_level)
-
-    c_handler = logging.StreamHandler()
-    f_handler = logging.FileHandler(settings.LOGFILE_PATH)
-
-    c_handler.setLevel(log_level)
-    f_handler.setLevel(log_level)
-
-    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)s: %(message)s')
-    c_handler.setFormatter(formatter)
-    f_handler.setFormatter(formatter)
-
-    logger.addHandler(c_handler)
-    logger.addHandler(f_handler)
-
-
 logger = logging.getLogger("lost")
-setup_logger(logger)
-
+log_writer = setup_logger(logger)
 
-class MainConnector:
-    """This class helps with things that occur in one place but belong in another."""
+# Older settings files don't have the `TRACES_PATH`.
+tracer.export_path = getattr(settings, 'TRACES_PATH', None)
 
-    def __init__(self):
-        self.sc_mon = None
-
-    def _check_thread_queue(self):
-        """
-        Checks if a thread has put something into the `thread_queue`.
-
-        When a thread has experienced an event that it wants to pass to the main thread,
-        for example when a smartcard has been read or a server reply been received, it put
-        a callback into the queue for us the pick up and process here, as in the main
-        thread we are free to update the terminal, the GUI and any other state.
-        """
-        for count in range(5):
-            try:
-                callback, args = thread_queue.get(block=False)
-            except queue.Empty:
-                break
-            callback(*args)
-
-    def on_clock_tick(self):
-        """
-        This function accounts for resources that must be periodically updated.
-
-        The timers for periodic clock ticks happen to be kept in and driven by the GUI.
-        As we also need them for non-GUI related tasks, we have the GUI periodically call
-        this function (in the main thread) where we forward the clock ticks as needed.
-        """
-        # Check for events from other threads, e.g. smartcard reads or server replies.
-        self._check_thread_queue()
-
-    def simulate_smartcard_input(self, smartcard_id):
-        self.sc_mon.on_smartcard_input(smartcard_id, True)
+# Older settings files don't have the `METRICS_PORT`.
+metrics_port = getattr(settings, 'METRICS_PORT', None)
+metrics_httpd = start_metrics_server(metrics_port, scheduler=scheduler) if metrics_port else None
 
 
 terminal = Terminal()
@@ -91,7 +47,9 @@ sc_mon = SmartcardMonitor(terminal, network_handler)
 
 # The terminal could have numerous additional observers. Examples include:
 # LED lights on the Raspberry Pi, LED lights on the smartcard reader, audio
-# signals, state loggers, door openers, etc.
+# signals, state loggers, door openers, etc. Unlike the GUI, they should be
+# wrapped in an `AsyncObserver`, so that they cannot freeze the GUI, e.g.
+# `terminal.add_observer(AsyncObserver(door_opener))`.
 terminal.add_observer(root_window)
 
 # Initial setup of the observers (the GUI).
@@ -99,18 +57,30 @@ terminal.notify_observers()
 
 # The main connector must know the pieces to connect.
 main_con.sc_mon = sc_mon
+main_con.network_handlers.append(network_handler)
 
 USE_SERVER = (settings.SERVER_ADDRESS[0] == 'built-in')
 if USE_SERVER:
-    httpd = start_testserver(settings.SERVER_ADDRESS[1])
+    # Older settings files don't have the `EVENT_STORE_PATH`.
+    event_store_path = getattr(settings, 'EVENT_STORE_PATH', None)
+    event_store = EventStore(event_store_path) if event_store_path else None
+    httpd = start_testserver(settings.SERVER_ADDRESS[1], event_store=event_store)
 
 root_window.mainloop()
 
 if USE_SERVER:
     httpd.shutdown()
     httpd.server_close()
+    if event_store:
+        event_store.close()
+
+if metrics_httpd:
+    metrics_httpd.shutdown()
+    metrics_httpd.server_close()
 
 main_con.sc_mon = None
+main_con.network_handlers.clear()
 terminal.clear_observers()
 sc_mon.shutdown()
 network_handler.shutdown()
+log_writer.stop()
@@ -0,0 +1,230 @@
+import logging
+import os
+import sqlite3
+
+from lost.clock import system_clock
+
+
+logger = logging.getLogger("lost.backlog")
+MAX_LOSS_WINDOW = 5.0
+MAX_UNFLUSHED = 50
+
+
+class Backlog:
+    """
+    The persistent store for user input that could not be sent to the Lori server.
+
+    The entries are kept in an SQLite database, each with a unique sequence number that
+    is strictly increasing in the order in which the entries were added. (Contrary to
+    keys that are derived from the time, sequence numbers never collide and are not
+    affected by changes of the system clock.) Thus, the entries can be replayed in the
+    order in which they were originally made, and the oldest or newest entry is found
+    by a lookup in the primary key index rather than by a scan of the entire backlog.
+
+    The number of entries is counted once when the backlog is opened and then kept up
+    to date, so that `len()` is cheap as well.
+
+    Entries that are being re-sent to the server are not removed from the backlog before
+    the server has acknowledged them: Instead, they are *leased* until a given time. While
+    the lease lasts, `get_available()` doesn't return them again, so that several entries
+    can be re-sent concurrently without duplicates. When the reply has arrived, the entry
+    is either removed with `ack()` or made available again with `release()`. If neither
+    happens, e.g. because the reply got lost, the lease eventually expires. As no request
+    of an earlier run of the program can still be in flight, leases are kept in memory
+    only: If the program crashes, all entries are available again after the restart.
+
+    As with the `dbm` module that was used for the backlog before, changes must be
+    committed explicitly by calling `sync()`. How this works depends on `durability`:
+
+      - 'full'     Each `sync()` waits until the changes are physically written to
+                   disk. This is safe, but on SD cards, it takes tens of milliseconds
+                   each time and wears the card.
+      - 'grouped'  Each `sync()` appends the changes to SQLite's write-ahead log, but
+                   without waiting for the disk. The log is flushed to disk only every
+                   `max_unflushed` commits or at the latest `max_loss_window` seconds
+                   after the first unflushed commit (see `on_clock_tick()`).
+
+    In both modes, the committed changes survive a crash of this program: The
+    write-ahead log is our crash-safe journal, which SQLite replays when the backlog is
+    opened again. Only in 'grouped' mode, a power loss or crash of the operating system
+    can lose the changes of at most the last `max_loss_window` seconds.
+    """
+
+    def __init__(self, path, durability='full', max_loss_window=MAX_LOSS_WINDOW, max_unflushed=MAX_UNFLUSHED, clock=None):
+        assert durability in ('full', 'grouped')
+        self.path = path
+        self.clock = clock or system_clock
+        self.durability = durability
+        self.max_loss_window = max_loss_window
+        self.max_unflushed = max_unflushed
+        self.num_unflushed = 0
+        self.time_first_unflushed = None
+        self.leases = {}
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL" if durability == 'full' else "PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS backlog ("
+            "    seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "    time_added REAL NOT NULL,"
+            "    user_input TEXT NOT NULL"
+            ")"
+        )
+        self.db.commit()
+        self.count = self.db.execute("SELECT COUNT(*) FROM backlog").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def sync(self):
+        self.db.commit()
+
+        if self.durability == 'full':
+            return
+
+        if self.num_unflushed == 0:
+            self.time_first_unflushed = self.clock.time()
+        self.num_unflushed += 1
+
+        if self.num_unflushed >= self.max_unflushed:
+            self.flush()
+
+    def flush(self):
+        """Makes sure that all committed changes are physically written to disk."""
+        self.db.commit()
+        if self.durability == 'grouped':
+            # With `synchronous=NORMAL`, the write-ahead log is synced to disk before
+            # the checkpoint and the database file after it.
+            self.db.execute("PRAGMA wal_checkpoint(FULL)")
+        self.num_unflushed = 0
+        self.time_first_unflushed = None
+
+    def on_clock_tick(self):
+        """Flushes the committed changes if the first of them is about to exceed the loss window."""
+        if self.num_unflushed == 0:
+            return
+
+        if self.clock.time() - self.time_first_unflushed >= self.max_loss_window:
+            self.flush()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, user_input_json, time_added=None):
+        """Adds a new entry at the end of the backlog and returns its sequence number."""
+        if time_added is None:
+            time_added = self.clock.time()
+
+        cursor = self.db.execute(
+            "INSERT INTO backlog (time_added, user_input) VALUES (?, ?)",
+            (time_added, user_input_json),
+        )
+        self.count += 1
+        return cursor.lastrowid
+
+    def remove(self, seq):
+        self.leases.pop(seq, None)
+        cursor = self.db.execute("DELETE FROM backlog WHERE seq = ?", (seq,))
+        self.count -= cursor.rowcount
+
+    def _expire_leases(self, now):
+        for seq in [seq for seq, until in self.leases.items() if until <= now]:
+            logger.warning(f"The lease of backlog entry {seq} has expired.")
+            del self.leases[seq]
+
+    def num_available(self, now=None):
+        """Returns the number of entries that are not leased."""
+        self._expire_leases(self.clock.time() if now is None else now)
+        return self.count - len(self.leases)
+
+    def get_available(self, n, now=None):
+        """Returns a list of `(seq, time_added, user_input_json)` of the `n` oldest entries that are not leased."""
+        self._expire_leases(self.clock.time() if now is None else now)
+        rows = self.first_n(n + len(self.leases))
+        return [row for row in rows if row[0] not in self.leases][:n]
+
+    def lease(self, seqs, until):
+        for seq in seqs:
+            self.leases[seq] = until
+
+    def ack(self, seq):
+        """The leased entry has been successfully processed and is removed."""
+        self.remove(seq)
+
+    def release(self, seq, user_input_json=None):
+        """The leased entry could not be processed and is made available again, optionally with new contents."""
+        self.leases.pop(seq, None)
+        if user_input_json is not None:
+            self.update(seq, user_input_json)
+
+    def update(self, seq, user_input_json):
+        """Replaces the contents of the entry, keeping its place in the backlog."""
+        self.db.execute("UPDATE backlog SET user_input = ? WHERE seq = ?", (user_input_json, seq))
+
+    def first(self):
+        """Returns `(seq, time_added, user_input_json)` of the oldest entry or `None`."""
+        return self.db.execute(
+            "SELECT seq, time_added, user_input FROM backlog ORDER BY seq LIMIT 1"
+        ).fetchone()
+
+    def first_n(self, n):
+        """Returns a list of `(seq, time_added, user_input_json)` of the `n` oldest entries."""
+        return self.db.execute(
+            "SELECT seq, time_added, user_input FROM backlog ORDER BY seq LIMIT ?", (n,)
+        ).fetchall()
+
+    def last(self):
+        """Returns `(seq, time_added, user_input_json)` of the newest entry or `None`."""
+        return self.db.execute(
+            "SELECT seq, time_added, user_input FROM backlog ORDER BY seq DESC LIMIT 1"
+        ).fetchone()
+
+    def get_oldest_age(self, now=None):
+        """Returns the number of seconds since the oldest entry was added, or 0 if the backlog is empty."""
+        entry = self.first()
+        if entry is None:
+            return 0.0
+
+        if now is None:
+            now = self.clock.time()
+
+        return max(now - entry[1], 0.0)
+
+    def import_dbm(self, dbm_path):
+        """
+        Imports the entries of a backlog file that was written with the `dbm.gnu` module
+        by earlier versions of this program. On success, the old file is renamed so that
+        it is not imported again.
+
+        The keys in the old files are the times at which the entries were added, so we
+        use them to restore the original order as well as possible.
+        """
+        try:
+            import dbm.gnu
+        except ImportError as e:
+            logger.error(f"Cannot import the old backlog file {dbm_path}: {e}")
+            return 0
+
+        old_backlog = dbm.gnu.open(dbm_path, 'r')
+        entries = []
+
+        key = old_backlog.firstkey()
+        while key is not None:
+            try:
+                time_added = float(key.decode())
+            except ValueError:
+                time_added = self.clock.time()
+            entries.append((time_added, old_backlog[key].decode()))
+            key = old_backlog.nextkey(key)
+
+        old_backlog.close()
+
+        for time_added, user_input_json in sorted(entries, key=lambda e: e[0]):
+            self.append(user_input_json, time_added)
+
+        self.flush()
+        os.rename(dbm_path, f"{dbm_path}.migrated")
+        logger.info(f"Imported {len(entries)} entries from the old backlog file {dbm_path}.")
+        return len(entries)
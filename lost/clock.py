@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import time
+
+from lost.common import get_datetime_now, get_time_time
+from lost.scheduler import Scheduler
+
+
+class SystemClock:
+    """
+    The clock of the system, as used by the `NetworkHandler` and the `Backlog` by default.
+
+    `monotonic()` is for measuring durations and for the `Scheduler`, `time()` and `now()`
+    are for timestamps. The latter honor the fake times of `lost.common`.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return get_time_time()
+
+    def now(self):
+        return get_datetime_now()
+
+
+system_clock = SystemClock()
+
+
+class VirtualClock:
+    """
+    A clock for tests that stands still until it is advanced.
+
+    The clock comes with a `scheduler` of its own. Pass it to the terminal, the GUI and
+    the `MainConnector`'s clock ticks, and pass the clock itself to the `NetworkHandler`:
+    Then `advance()` steps from one deadline of the scheduler to the next and runs the
+    tasks that are due, just as the real time would, but without waiting. This way, hours
+    of timeouts, clock ticks and backlog draining are simulated in milliseconds.
+
+    Work that is done in other threads does not wait for the virtual clock, though: Use
+    the `InlineWorkerPool` so that the requests are sent right away.
+    """
+
+    def __init__(self, start=datetime(2022, 4, 2, 8, 0, 0)):
+        self.start = start
+        self.start_time = start.timestamp()
+        self.elapsed = 0.0
+        self.scheduler = Scheduler(clock=self.monotonic)
+
+    def monotonic(self):
+        return self.elapsed
+
+    def time(self):
+        return self.start_time + self.elapsed
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def advance(self, seconds):
+        """Advances the clock by `seconds`, running the tasks of the scheduler when they are due."""
+        time_end = self.elapsed + seconds
+
+        while True:
+            deadline = self.scheduler.get_next_deadline()
+            if deadline is None or deadline > time_end:
+                break
+
+            self.elapsed = max(self.elapsed, deadline)
+            self.scheduler.run_due()
+
+        self.elapsed = time_end
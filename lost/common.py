@@ -1,9 +1,12 @@
 from datetime import date, datetime
+import math
 import time
+import uuid
 
 
 FAKE_DATETIME_FOR_TESTS = None
 FAKE_TIMETIME_FOR_TESTS = None
+FAKE_EVENT_IDS_FOR_TESTS = None     # an iterator that yields the event IDs
 
 
 def get_date_today():
@@ -25,3 +28,20 @@ def get_time_time():
         return FAKE_TIMETIME_FOR_TESTS
 
     return time.time()
+
+
+def get_event_id():
+    """Returns a new, globally unique ID for a stamp event."""
+    if FAKE_EVENT_IDS_FOR_TESTS is not None:
+        return next(FAKE_EVENT_IDS_FOR_TESTS)
+
+    return uuid.uuid4().hex
+
+
+def get_percentile(sorted_values, p):
+    """Returns the `p`-th percentile of the sorted values with the nearest-rank method, or `None` if there are none."""
+    if not sorted_values:
+        return None
+
+    rank = max(math.ceil(p / 100.0 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
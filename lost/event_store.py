@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+MAX_PAGE_SIZE = 1000
+
+
+class EventStore:
+    """
+    The persistent store for the stamp events that the built-in server has received.
+
+    When the built-in server stands in for the Lori server, e.g. during an outage of the
+    WAN, the events must not get lost. They are appended to an SQLite database in WAL
+    mode, in which readers don't block the writer: Appending is cheap, as the events are
+    only ever inserted at the end of the table, and each request is a single transaction,
+    no matter how many events it holds (see `add_many()`).
+
+    The events are indexed by their event ID, so that an event that a client re-sends is
+    stored only once, and by smartcard ID and by timestamp for the queries. `query()`
+    returns the events in pages, with the sequence number of the last event of a page as
+    the key for the next page. Unlike an offset, this is quick for pages deep into the
+    table and not thrown off by events that are added in the meantime.
+
+    The request handlers of the server run in several threads, so the writing and the
+    reading connection are each protected by a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.write_lock = threading.Lock()
+        self.read_lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "    seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "    event_id TEXT UNIQUE,"
+            "    smartcard_id TEXT,"
+            "    terminal_name TEXT,"
+            "    terminal_ts TEXT,"
+            "    time_received REAL NOT NULL,"
+            "    data TEXT NOT NULL"
+            ")"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_smartcard_id ON events (smartcard_id, seq)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS events_terminal_ts ON events (terminal_ts)")
+        self.db.commit()
+
+        self.db_read = sqlite3.connect(path, check_same_thread=False)
+
+    def close(self):
+        with self.write_lock, self.read_lock:
+            self.db_read.close()
+            self.db.close()
+
+    def add(self, event):
+        return self.add_many([event])
+
+    def add_many(self, events):
+        """
+        Stores the given events in a single transaction and returns the number of events
+        that were new. Events with an event ID that is already known are skipped.
+        """
+        now = time.time()
+        rows = []
+
+        for event in events:
+            # Never keep the terminal's password.
+            data = {key: value for key, value in event.items() if key != 'terminal_pwd'}
+            rows.append((
+                event.get('event_id') or None,
+                event.get('smartcard_id'),
+                event.get('terminal_name'),
+                event.get('terminal_ts'),
+                now,
+                json.dumps(data),
+            ))
+
+        with self.write_lock:
+            with self.db:
+                cursor = self.db.executemany(
+                    "INSERT OR IGNORE INTO events (event_id, smartcard_id, terminal_name, terminal_ts, time_received, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                return cursor.rowcount
+
+    def query(self, smartcard_id=None, since=None, until=None, after=0, limit=100):
+        """
+        Returns the events that match the given criteria and the `after` key of the next
+        page, or `None` if this is the last page.
+
+        `since` and `until` are compared to the terminal timestamps, e.g. '2022-04-02' or
+        '2022-04-02 18:12:00'. `until` is exclusive.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conditions = ["seq > ?"]
+        params = [after]
+
+        if smartcard_id is not None:
+            conditions.append("smartcard_id = ?")
+            params.append(smartcard_id)
+        if since is not None:
+            conditions.append("terminal_ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("terminal_ts < ?")
+            params.append(until)
+
+        # Fetch one more than requested in order to learn if there is a next page.
+        sql = f"SELECT seq, time_received, data FROM events WHERE {' AND '.join(conditions)} ORDER BY seq LIMIT ?"
+        params.append(limit + 1)
+
+        with self.read_lock:
+            rows = self.db_read.execute(sql, params).fetchall()
+
+        events = [dict(json.loads(data), seq=seq, time_received=time_received) for seq, time_received, data in rows[:limit]]
+        next_after = events[-1]['seq'] if len(rows) > limit else None
+        return events, next_after
+
+    def __len__(self):
+        with self.read_lock:
+            return self.db_read.execute("SELECT COUNT(*) FROM events").fetchone()[0]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import logging
+
+from lost import settings
+from lost.headless import HeadlessLoop
+from lost.log_tools import setup_logger
+from lost.main_connector import MainConnector
+from lost.metrics import start_metrics_server
+from lost.modes.gateway_terminal import GatewayTerminalMixin
+from lost.network_handler import NetworkHandler
+from lost.scheduler import scheduler
+from lost.server import start_testserver
+from lost.sm_card import GatewayMonitor
+
+
+if settings.TERMINAL_MODE == 'logistics':
+    from lost.modes.logistics_terminal import Terminal
+elif settings.TERMINAL_MODE == 'office':
+    from lost.modes.office_terminal import Terminal
+else:
+    assert False, "Unknown terminal mode."
+
+
+class GatewayTerminal(GatewayTerminalMixin, Terminal):
+    """The terminal of one of the smartcard readers of the gateway."""
+
+
+def main():
+    """
+    Runs LoST in gateway mode: without a display, but with several smartcard readers,
+    each of which is served by a terminal of its own, see `GatewayMonitor`.
+    """
+    log_writer = setup_logger(logging.getLogger("lost"))
+
+    httpd = None
+    if settings.SERVER_ADDRESS[0] == 'built-in':
+        httpd = start_testserver(settings.SERVER_ADDRESS[1])
+
+    # Older settings files don't have the `METRICS_PORT`.
+    metrics_port = getattr(settings, 'METRICS_PORT', None)
+    metrics_httpd = start_metrics_server(metrics_port, scheduler=scheduler) if metrics_port else None
+
+    main_con = MainConnector()
+    # The network handler is shared by all terminals, which pass themselves along with each event.
+    network_handler = NetworkHandler(None)
+    sc_mon = GatewayMonitor(GatewayTerminal, network_handler)
+    main_con.sc_mon = sc_mon
+    main_con.network_handlers.append(network_handler)
+
+    try:
+        HeadlessLoop(main_con).run()
+    except KeyboardInterrupt:
+        pass
+
+    if httpd:
+        httpd.shutdown()
+        httpd.server_close()
+
+    if metrics_httpd:
+        metrics_httpd.shutdown()
+        metrics_httpd.server_close()
+
+    main_con.sc_mon = None
+    main_con.network_handlers.clear()
+    sc_mon.shutdown()
+    network_handler.shutdown()
+    log_writer.stop()
+
+
+if __name__ == '__main__':
+    main()
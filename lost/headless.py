@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+import argparse
+import logging
+from pathlib import Path
+import random
+import select
+import time
+
+from lost.main_connector import MainConnector
+from lost.network_handler import NetworkHandler
+from lost.scheduler import scheduler as default_scheduler
+from lost.thread_tools import thread_queue, WorkerPool
+from lost.tracing import tracer
+
+
+logger = logging.getLogger("lost.headless")
+
+# Without a wakeup pipe, e.g. on Windows, the `thread_queue` is polled at this interval.
+POLL_INTERVAL = 0.1
+
+
+class HeadlessLoop:
+    """
+    An event loop that drives the program without a display.
+
+    This is the counterpart of Tk's `mainloop()` in the `RootWindow`: It runs the tasks of
+    the `scheduler`, among them the periodic clock ticks of the `MainConnector`, and has
+    the main connector dispatch the items of the `thread_queue` as soon as a thread has
+    put them. In between, it sleeps in `select()` until either the next task is due or
+    the wakeup pipe of the `thread_queue` becomes readable.
+    """
+
+    def __init__(self, main_con, scheduler=None, tick_interval=1.0):
+        self.main_con = main_con
+        self.scheduler = scheduler or default_scheduler
+        self.tick_interval = tick_interval
+        self.is_running = False
+
+    def stop(self):
+        """Makes `run()` return. To be called in the main thread, e.g. by a scheduled task."""
+        self.is_running = False
+
+    def run(self, duration=None):
+        """Runs the loop until `stop()` is called or, if given, for `duration` seconds."""
+        clock = self.scheduler.clock
+        time_end = clock() + duration if duration is not None else None
+        fd = thread_queue.fileno()
+
+        tick_task = self.scheduler.add_periodic("HeadlessLoop.drive_main_connector", self.tick_interval, self.main_con.on_clock_tick)
+        self.is_running = True
+
+        try:
+            while self.is_running:
+                now = clock()
+                if time_end is not None and now >= time_end:
+                    break
+
+                deadline = self.scheduler.get_next_deadline()
+                if time_end is not None:
+                    deadline = time_end if deadline is None else min(deadline, time_end)
+                timeout = None if deadline is None else max(deadline - now, 0.0)
+
+                if fd is None:
+                    time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+                    self.main_con.on_thread_queue_wakeup()
+                else:
+                    readable, _, _ = select.select([fd], [], [], timeout)
+                    if readable:
+                        self.main_con.on_thread_queue_wakeup()
+
+                self.scheduler.run_due()
+        finally:
+            self.is_running = False
+            self.scheduler.cancel(tick_task)
+
+
+class VirtualTerminal:
+    """
+    A terminal with a network handler of its own, but without GUI or smartcard reader.
+
+    `tap()` simulates the reading of a smartcard, just as the `SmartcardMonitor` would
+    handle it, and `dismiss()` simulates the user returning to the welcome screen.
+    """
+
+    def __init__(self, terminal, network_handler):
+        self.terminal = terminal
+        self.network_handler = network_handler
+        self.num_taps = 0
+        self.num_ignored = 0
+
+    def tap(self, smartcard_id):
+        """Returns `False` if the terminal was not expecting a smartcard."""
+        trace_id = tracer.start()
+
+        if not self.terminal.is_expecting_smartcard():
+            tracer.discard(trace_id)
+            self.num_ignored += 1
+            return False
+
+        self.network_handler.send_to_Lori(smartcard_id, trace_id)
+        self.terminal.on_server_post_sent()
+        self.num_taps += 1
+        return True
+
+    def dismiss(self):
+        self.terminal.set_state_welcome()
+
+
+class Fleet:
+    """
+    Hosts many virtual terminals in one process, e.g. for load-testing the Lori server.
+
+    Each terminal has its own `NetworkHandler` with its own backlog file in `backlog_dir`
+    and its own connections, just like a real terminal. As hundreds of terminals with
+    their own worker threads would be too many threads, they share a single `WorkerPool`.
+    All terminals are driven by a single `HeadlessLoop`.
+    """
+
+    def __init__(self, terminal_class, num_terminals, backlog_dir, num_workers=16, scheduler=None):
+        self.scheduler = scheduler or default_scheduler
+        self.worker_pool = WorkerPool(num_workers=num_workers, max_queued=max(16, num_terminals), name="network")
+        self.main_con = MainConnector()
+        self.loop = HeadlessLoop(self.main_con, self.scheduler)
+        self.terminals = []
+
+        Path(backlog_dir).mkdir(parents=True, exist_ok=True)
+
+        for nr in range(num_terminals):
+            terminal = terminal_class(self.scheduler)
+            network_handler = NetworkHandler(
+                terminal,
+                backlog_path=str(Path(backlog_dir) / f"backlog-{nr:04}.sqlite3"),
+                worker_pool=self.worker_pool,
+                old_backlog_path=None,
+            )
+            self.main_con.network_handlers.append(network_handler)
+            self.terminals.append(VirtualTerminal(terminal, network_handler))
+
+    def get_backlog_size(self):
+        return sum(len(vt.network_handler.backlog) for vt in self.terminals)
+
+    def shutdown(self):
+        # Let the pending requests finish and handle their replies before the backlogs are closed.
+        self.worker_pool.shutdown()
+        self.main_con.on_thread_queue_wakeup()
+
+        self.main_con.network_handlers.clear()
+        for vt in self.terminals:
+            vt.network_handler.shutdown()
+
+
+def start_random_taps(fleet, mean_interval, num_cards=1000):
+    """Has each terminal of the fleet read a random smartcard every `mean_interval` seconds on average."""
+
+    def tap(vt):
+        vt.dismiss()
+        vt.tap(f"{random.randrange(num_cards):08X}")
+        # Nobody can tap a real terminal more often than this, see the throttling in `send_to_Lori()`.
+        delay = max(random.expovariate(1.0 / mean_interval), 1.0)
+        fleet.scheduler.add_oneshot("tap", delay, lambda: tap(vt))
+
+    for vt in fleet.terminals:
+        fleet.scheduler.add_oneshot("tap", random.uniform(0.0, mean_interval), lambda vt=vt: tap(vt))
+
+
+def main():
+    from lost import settings
+    from lost.server import start_testserver
+
+    parser = argparse.ArgumentParser(description="Runs many virtual terminals without a display.")
+    parser.add_argument('--terminals', type=int, default=100, help="the number of virtual terminals")
+    parser.add_argument('--duration', type=float, default=60.0, help="the run time in seconds")
+    parser.add_argument('--tap-interval', type=float, default=30.0, help="the mean time in seconds between taps at each terminal")
+    parser.add_argument('--workers', type=int, default=16, help="the number of network worker threads")
+    parser.add_argument('--backlog-dir', default='headless-backlogs', help="the directory of the backlog files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+
+    if settings.TERMINAL_MODE == 'logistics':
+        from lost.modes.logistics_terminal import Terminal
+    else:
+        from lost.modes.office_terminal import Terminal
+
+    httpd = None
+    if settings.SERVER_ADDRESS[0] == 'built-in':
+        httpd = start_testserver(settings.SERVER_ADDRESS[1])
+
+    fleet = Fleet(Terminal, args.terminals, args.backlog_dir, num_workers=args.workers)
+    start_random_taps(fleet, args.tap_interval)
+    fleet.loop.run(args.duration)
+    fleet.shutdown()
+
+    if httpd:
+        httpd.shutdown()
+        httpd.server_close()
+
+    total = tracer.get_report()['stages'].get('total', {})
+    print(f"taps: {sum(vt.num_taps for vt in fleet.terminals)}, ignored: {sum(vt.num_ignored for vt in fleet.terminals)}")
+    print(f"round trips: {total.get('count', 0)}, mean: {total.get('mean_ms', 0.0)} ms, max: {total.get('max_ms', 0.0)} ms")
+    print(f"backlog entries: {fleet.get_backlog_size()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+import argparse
+from collections import Counter
+import json
+import queue
+import random
+import time
+
+from lost import settings
+from lost.common import get_datetime_now, get_event_id, get_percentile
+from lost.network_handler import get_error_class, post_stamp_event, SessionPool
+from lost.thread_tools import thread_queue, WorkerPool
+
+
+class LoadProfile:
+    """
+    When which of the simulated terminals is tapped.
+
+    In the course of a shift, the taps are rare and spread evenly: Each terminal is
+    tapped `base_rate` times per minute on average, at random times. At shift change
+    though, everybody comes and goes at about the same time. Therefore, at each of the
+    offsets in `bursts` (in seconds since the start of the run), each terminal is tapped
+    `burst_taps` more times within `burst_width` seconds, most of them early on.
+    """
+
+    def __init__(self, num_terminals=50, duration=60.0, base_rate=1.0, bursts=(), burst_taps=20, burst_width=60.0, seed=None):
+        self.num_terminals = num_terminals
+        self.duration = duration
+        self.base_rate = base_rate
+        self.bursts = bursts
+        self.burst_taps = burst_taps
+        self.burst_width = burst_width
+        self.seed = seed
+
+    def get_arrivals(self):
+        """Returns the list of `(offset, terminal_nr)` tuples of all taps, sorted by offset."""
+        rnd = random.Random(self.seed)
+        arrivals = []
+
+        for terminal_nr in range(self.num_terminals):
+            if self.base_rate > 0:
+                offset = rnd.expovariate(self.base_rate / 60.0)
+                while offset < self.duration:
+                    arrivals.append((offset, terminal_nr))
+                    offset += rnd.expovariate(self.base_rate / 60.0)
+
+            for burst in self.bursts:
+                for nr in range(self.burst_taps):
+                    offset = rnd.triangular(burst, burst + self.burst_width, burst + self.burst_width / 4)
+                    if offset < self.duration:
+                        arrivals.append((offset, terminal_nr))
+
+        arrivals.sort()
+        return arrivals
+
+
+class LoadReport:
+    """
+    The results of a load generator run.
+
+    The round-trip time is the time that `post_stamp_event()` took. The response time is
+    the time from when the tap was scheduled until the reply was received: If the server
+    or the load generator cannot keep up, the taps queue up and this is much longer than
+    the round-trip time, just as users would have to wait at real terminals.
+
+    Each failed tap would have been put into the backlog of its terminal, to be re-sent
+    when the server is reachable again.
+    """
+
+    def __init__(self, num_terminals):
+        self.num_terminals = num_terminals
+        self.num_scheduled = 0
+        self.num_ok = 0
+        self.round_trips = []
+        self.response_times = []
+        self.errors = Counter()
+        self.backlogs = Counter()
+        self.duration = 0.0
+
+    def add(self, terminal_nr, network_error, time_scheduled, time_started, time_finished):
+        self.round_trips.append(time_finished - time_started)
+        self.response_times.append(time_finished - time_scheduled)
+
+        if network_error:
+            self.errors[get_error_class(network_error)] += 1
+            self.backlogs[terminal_nr] += 1
+        else:
+            self.num_ok += 1
+
+    def add_rejected(self, terminal_nr):
+        self.errors['Rejected'] += 1
+        self.backlogs[terminal_nr] += 1
+
+    def as_dict(self):
+        def ms(seconds):
+            return round(seconds * 1000.0, 3) if seconds is not None else None
+
+        round_trips = sorted(self.round_trips)
+        response_times = sorted(self.response_times)
+        num_done = self.num_ok + sum(self.errors.values())
+
+        return {
+            'terminals': self.num_terminals,
+            'scheduled': self.num_scheduled,
+            'ok': self.num_ok,
+            'duration_s': round(self.duration, 3),
+            'throughput_per_s': round(num_done / self.duration, 3) if self.duration else 0.0,
+            'round_trip_ms': {f"p{p}": ms(get_percentile(round_trips, p)) for p in (50, 95, 99)},
+            'response_time_ms': {f"p{p}": ms(get_percentile(response_times, p)) for p in (50, 95, 99)},
+            'errors': dict(self.errors),
+            'backlog': {
+                'entries': sum(self.backlogs.values()),
+                'terminals': len(self.backlogs),
+                'max_per_terminal': max(self.backlogs.values(), default=0),
+            },
+        }
+
+
+def timed_post_stamp_event(terminal_nr, user_input, session_pool, timeout, time_scheduled):
+    time_started = time.monotonic()
+    user_input, result, network_error = post_stamp_event(user_input, session_pool, timeout)
+    return terminal_nr, network_error, time_scheduled, time_started, time.monotonic()
+
+
+class LoadGenerator:
+    """
+    Sends the taps of a `LoadProfile` to the Lori server, as a fleet of terminals would.
+
+    The taps are sent with the same payload as `NetworkHandler.send_to_Lori()` to the
+    server at `settings.SERVER_URL`, by `concurrency` worker threads. With `pooling`,
+    the workers share a `SessionPool` with one keep-alive connection each, otherwise
+    each request establishes a new connection.
+
+    The taps are submitted at their scheduled times, no matter if the earlier ones have
+    been answered yet, so that a slow server shows in the response times rather than
+    in fewer taps.
+    """
+
+    def __init__(self, profile, concurrency=8, pooling=True, timeout=None):
+        self.profile = profile
+        self.concurrency = concurrency
+        self.pooling = pooling
+        self.timeout = timeout
+        self.report = None
+
+    def make_user_input(self, terminal_nr):
+        return {
+            'smartcard_id': f"LOADGEN-{terminal_nr:04}-{random.randrange(1000):03}",
+            'terminal_ts': str(get_datetime_now()),
+            'backlog_count': 0,
+            'event_id': get_event_id(),
+            'reader': f"loadgen-{terminal_nr:04}",
+        }
+
+    def run(self):
+        arrivals = self.profile.get_arrivals()
+        self.report = LoadReport(self.profile.num_terminals)
+        self.report.num_scheduled = len(arrivals)
+
+        session_pool = SessionPool(pool_size=self.concurrency) if self.pooling else None
+        worker_pool = WorkerPool(num_workers=self.concurrency, max_queued=max(len(arrivals), 1), name="loadgen")
+        time_start = time.monotonic()
+
+        for offset, terminal_nr in arrivals:
+            time_scheduled = time_start + offset
+            self._collect(time_scheduled)
+
+            args = (terminal_nr, self.make_user_input(terminal_nr), session_pool, self.timeout, time_scheduled)
+            on_error = lambda message, terminal_nr=terminal_nr, time_scheduled=time_scheduled: \
+                (terminal_nr, message, time_scheduled, time.monotonic(), time.monotonic())
+            if not worker_pool.submit(timed_post_stamp_event, args, self.report.add, on_error):
+                self.report.add_rejected(terminal_nr)
+
+        worker_pool.shutdown()
+        self._collect(None)
+        self.report.duration = time.monotonic() - time_start
+
+        if session_pool:
+            session_pool.close()
+
+        return self.report
+
+    def _collect(self, time_until):
+        """Passes the results to the report until `time_until`, or all available results if `None`."""
+        while True:
+            timeout = None if time_until is None else time_until - time.monotonic()
+            try:
+                if timeout is None:
+                    callback, args = thread_queue.get(block=False)
+                elif timeout > 0:
+                    callback, args = thread_queue.get(timeout=timeout)
+                else:
+                    break
+            except queue.Empty:
+                break
+            callback(*args)
+
+
+def main():
+    from lost.server import start_testserver
+
+    parser = argparse.ArgumentParser(description="Sends the taps of a fleet of terminals to the Lori server and reports the latencies.")
+    parser.add_argument('--terminals', type=int, default=50, help="the number of simulated terminals")
+    parser.add_argument('--duration', type=float, default=60.0, help="the run time in seconds")
+    parser.add_argument('--rate', type=float, default=1.0, help="the taps per terminal and minute outside of bursts")
+    parser.add_argument('--burst', type=float, action='append', default=[], help="the start of a shift-change burst in seconds, can be repeated")
+    parser.add_argument('--burst-taps', type=int, default=20, help="the taps per terminal in each burst")
+    parser.add_argument('--burst-width', type=float, default=60.0, help="the duration of each burst in seconds")
+    parser.add_argument('--concurrency', type=int, default=8, help="the number of requests in flight at most")
+    parser.add_argument('--no-pooling', action='store_true', help="use a new connection for each request")
+    parser.add_argument('--timeout', type=float, default=None, help="the request timeout in seconds")
+    parser.add_argument('--seed', type=int, default=None, help="the seed for the random taps")
+    parser.add_argument('--json', default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    profile = LoadProfile(args.terminals, args.duration, args.rate, args.burst, args.burst_taps, args.burst_width, args.seed)
+    loadgen = LoadGenerator(profile, args.concurrency, not args.no_pooling, args.timeout)
+
+    httpd = None
+    if settings.SERVER_ADDRESS[0] == 'built-in':
+        httpd = start_testserver(settings.SERVER_ADDRESS[1])
+
+    report = loadgen.run().as_dict()
+
+    if httpd:
+        httpd.shutdown()
+        httpd.server_close()
+
+    print(json.dumps(report, indent=2))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+from lost import settings
+
+
+LOGFILE_MAX_BYTES = 10 * 1024 * 1024
+LOGFILE_MAX_AGE = 7 * 24 * 3600.0
+LOGFILE_BACKUP_COUNT = 10
+
+
+class RotatingGzipFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A log file handler that rotates the log file by size or by age and compresses the
+    old segments in the background.
+
+    The log file is rotated when it would exceed `max_bytes` or when it was started more
+    than `max_age` seconds ago, whichever comes first. Up to `backup_count` old segments
+    are kept as `lost.log.1.gz`, `lost.log.2.gz`, etc. The start time of the current
+    segment is kept in `lost.log.started`, so that it survives restarts of the program.
+
+    Contrary to the `FileHandler`, the records are not flushed to disk one by one, but
+    only when `flush_now()` is called. This is intended for use with the `QueuedLogWriter`,
+    which handles the records in batches and flushes each batch.
+    """
+
+    def __init__(self, filename, max_bytes=LOGFILE_MAX_BYTES, max_age=LOGFILE_MAX_AGE, backup_count=LOGFILE_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.max_age = max_age
+        self.started_filename = f"{self.baseFilename}.started"
+        self.time_started = self._get_time_started()
+        self.compress_thread = None
+
+    def _get_time_started(self):
+        """
+        Returns the time at which the current segment was started.
+
+        The segment may have been started by an earlier run of the program. Its start time
+        is kept in a small file next to the log file, because the modification time of the
+        log file only tells when the last record was written.
+        """
+        try:
+            if os.path.getsize(self.baseFilename):
+                with open(self.started_filename, 'r') as f:
+                    return float(f.read())
+        except (OSError, ValueError):
+            # The segment was started by a version of the program that didn't record
+            # the start time, so we count its age from now on.
+            pass
+
+        return self._start_segment()
+
+    def _start_segment(self):
+        time_started = time.time()
+        try:
+            with open(self.started_filename, 'w') as f:
+                f.write(repr(time_started))
+        except OSError:
+            pass
+        return time_started
+
+    def shouldRollover(self, record):
+        # Overrides the method in the parent class.
+        if self.max_age and time.time() - self.time_started >= self.max_age:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        # Overrides the method in the parent class.
+        # The renaming of the older segments by the parent class must not interfere
+        # with the compression of the previous segment.
+        if self.compress_thread:
+            self.compress_thread.join()
+
+        super().doRollover()
+        self.time_started = self._start_segment()
+
+    def rotation_filename(self, default_name):
+        # Overrides the method in the parent class.
+        return f"{default_name}.gz"
+
+    def rotate(self, source, dest):
+        # Overrides the method in the parent class.
+        if not os.path.exists(source):
+            return
+
+        # Renaming is quick, so the log file can be re-opened right away.
+        raw = f"{dest}.raw"
+        os.rename(source, raw)
+        self.compress_thread = threading.Thread(target=self._compress, args=(raw, dest), name="log-compress", daemon=True)
+        self.compress_thread.start()
+
+    @staticmethod
+    def _compress(raw, dest):
+        with open(raw, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(raw)
+
+    def flush(self):
+        # Overrides the method in the parent class, which is called for each record.
+        pass
+
+    def flush_now(self):
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        # Overrides the method in the parent class.
+        self.flush_now()
+        super().close()
+        if self.compress_thread:
+            self.compress_thread.join()
+
+
+class QueuedLogWriter:
+    """
+    Writes log records to the given handlers in a background thread.
+
+    The loggers only put the records into a queue (see `get_queue_handler()`), which never
+    blocks, so that logging doesn't delay the main thread with writes to the SD card.
+    The writer thread handles the queued records in batches of up to `max_batch` records
+    and flushes the handlers at most every `flush_interval` seconds. Errors are flushed
+    right away, so that they are not lost if the program crashes.
+    """
+
+    def __init__(self, handlers, flush_interval=1.0, max_batch=100):
+        self.handlers = handlers
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def get_queue_handler(self):
+        return logging.handlers.QueueHandler(self.queue)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Writes all queued records, then stops the writer thread."""
+        if self.thread is None:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+        for handler in self.handlers:
+            handler.close()
+
+    def _run(self):
+        time_last_flush = time.monotonic()
+        is_dirty = False
+
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval if is_dirty else None)
+            except queue.Empty:
+                # Nothing more to write for a while, so flush what we have.
+                self._flush()
+                time_last_flush = time.monotonic()
+                is_dirty = False
+                continue
+
+            batch = [record]
+            while record is not None and len(batch) < self.max_batch:
+                try:
+                    record = self.queue.get(block=False)
+                except queue.Empty:
+                    break
+                batch.append(record)
+
+            is_stopping = batch[-1] is None
+            if is_stopping:
+                batch.pop()
+
+            for record in batch:
+                self._handle(record)
+
+            is_dirty = is_dirty or bool(batch)
+            has_errors = any(record.levelno >= logging.ERROR for record in batch)
+
+            if is_stopping or has_errors or time.monotonic() - time_last_flush >= self.flush_interval:
+                self._flush()
+                time_last_flush = time.monotonic()
+                is_dirty = False
+
+            if is_stopping:
+                break
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _flush(self):
+        for handler in self.handlers:
+            if hasattr(handler, 'flush_now'):
+                handler.flush_now()
+            else:
+                handler.flush()
+
+
+def setup_logger(logger):
+    """
+    Sets up `logger` to log to the console and to the log file `settings.LOGFILE_PATH`
+    and returns the started `QueuedLogWriter`, which is to be stopped at program exit.
+    """
+    log_level = logging.DEBUG if settings.DEBUG else logging.INFO
+    logger.setLevel(log_level)
+
+    c_handler = logging.StreamHandler()
+    f_handler = RotatingGzipFileHandler(settings.LOGFILE_PATH)
+
+    c_handler.setLevel(log_level)
+    f_handler.setLevel(log_level)
+
+    formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)s: %(message)s')
+    c_handler.setFormatter(formatter)
+    f_handler.setFormatter(formatter)
+
+    # The handlers are run in a background thread, so that logging never blocks the
+    # main thread, see `QueuedLogWriter` for details.
+    log_writer = QueuedLogWriter([c_handler, f_handler])
+    logger.addHandler(log_writer.get_queue_handler())
+    log_writer.start()
+    return log_writer
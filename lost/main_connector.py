@@ -0,0 +1,70 @@
+import queue
+
+from lost.metrics import metrics
+from lost.thread_tools import thread_queue
+from lost.tracing import tracer
+
+
+class MainConnector:
+    """
+    This class helps with things that occur in one place but belong in another.
+
+    It dispatches the events that other threads have put into the `thread_queue` and
+    forwards the periodic clock ticks to the network handlers. It is driven either by
+    the GUI (see `RootWindow`) or, without a display, by the `HeadlessLoop`.
+    """
+
+    def __init__(self):
+        self.sc_mon = None
+        # There is one network handler per terminal, see `lost.headless` for many terminals.
+        self.network_handlers = []
+
+    def _check_thread_queue(self, max_count=5):
+        """
+        Checks if a thread has put something into the `thread_queue`.
+
+        When a thread has experienced an event that it wants to pass to the main thread,
+        for example when a smartcard has been read or a server reply been received, it put
+        a callback into the queue for us the pick up and process here, as in the main
+        thread we are free to update the terminal, the GUI and any other state.
+        """
+        count = 0
+        while max_count is None or count < max_count:
+            try:
+                callback, args = thread_queue.get(block=False)
+            except queue.Empty:
+                break
+            callback(*args)
+            count += 1
+
+    def on_thread_queue_wakeup(self):
+        """
+        This function is called by the GUI as soon as a thread has put something into
+        the `thread_queue`, see `WakeupQueue` for details.
+        """
+        thread_queue.clear_wakeup()
+        self._check_thread_queue(max_count=None)
+
+    def on_clock_tick(self):
+        """
+        This function accounts for resources that must be periodically updated.
+
+        The timers for periodic clock ticks are kept in the `scheduler`, which is driven
+        by the GUI or by the `HeadlessLoop`. They periodically call this function (in the
+        main thread) where we forward the clock ticks as needed.
+        """
+        # Check for events from other threads, e.g. smartcard reads or server replies.
+        metrics.set_gauge('lost_thread_queue_depth', thread_queue.qsize())
+        self._check_thread_queue()
+
+        for network_handler in self.network_handlers:
+            network_handler.on_clock_tick()
+
+        if self.network_handlers:
+            metrics.set_gauge('lost_backlog_entries', sum(len(nwh.backlog) for nwh in self.network_handlers))
+            metrics.set_gauge('lost_backlog_oldest_age_seconds', max(nwh.backlog.get_oldest_age() for nwh in self.network_handlers))
+
+        tracer.on_clock_tick()
+
+    def simulate_smartcard_input(self, smartcard_id):
+        self.sc_mon.on_smartcard_input(smartcard_id, True)
@@ -0,0 +1,161 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+from lost.tracing import BUCKET_BOUNDS_MS, Histogram
+
+
+logger = logging.getLogger("lost.metrics")
+
+METRICS_PATH = "/metrics"
+
+# The metrics that are exposed, with their Prometheus type and help text.
+METRICS = {
+    'lost_card_reads_total': ('counter', "The smartcards that were read, by result."),
+    'lost_throttled_drops_total': ('counter', "The smartcard events that send_to_Lori() dropped because they came too quickly."),
+    'lost_network_errors_total': ('counter', "The requests to the Lori server that failed, by type of error."),
+    'lost_live_send_seconds': ('histogram', "The time from sending live user input until its reply was handled, by outcome."),
+    'lost_main_loop_lag_seconds': ('histogram', "How late the main loop ran the tasks that were due."),
+    'lost_backlog_entries': ('gauge', "The number of entries in the backlog."),
+    'lost_backlog_oldest_age_seconds': ('gauge', "The age of the oldest entry in the backlog."),
+    'lost_thread_queue_depth': ('gauge', "The number of items in the thread queue at the last clock tick."),
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """
+    The counters, gauges and histograms that the metrics endpoint exposes.
+
+    Updating a metric must be cheap enough to do on every tap: A counter or gauge is an
+    entry in a dict, keyed by the metric name and its labels, and a histogram is a
+    `tracing.Histogram`. As some of the updates are made in worker threads, each update
+    takes the lock, which costs well below a microsecond when it is not contended.
+
+    Values that would be expensive to keep up to date all the time, e.g. the age of the
+    oldest backlog entry, are gauges that the `MainConnector` sets at each clock tick.
+    The endpoint's thread never touches the terminal or the backlog, but only renders
+    the values that were collected here.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, labels=None, amount=1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, seconds, labels=None):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(seconds)
+
+    def get(self, name, labels=None):
+        """Returns the value of a counter or gauge, or the number of observations of a histogram."""
+        key = self._key(name, labels)
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key].count
+            return self.counters.get(key, self.gauges.get(key, 0))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+        with self.lock:
+            samples = {**self.counters, **self.gauges}
+            histograms = {key: (list(h.counts), h.count, h.total) for key, h in self.histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind != 'histogram':
+                for (sample_name, labels), value in sorted(samples.items()):
+                    if sample_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+
+            for (sample_name, labels), (counts, count, total) in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKET_BOUNDS_MS, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound / 1000.0),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        # Overrides the method in the parent class: The endpoint is scraped every few
+        # seconds, which would flood the output.
+        pass
+
+    def log_error(self, *args):
+        # Overrides the method in the parent class, see `log_request()`.
+        pass
+
+
+def start_metrics_server(port, address='localhost', scheduler=None, registry=None):
+    """
+    Starts the metrics endpoint in a background thread and returns its server.
+
+    The endpoint serves the metrics of `registry`, by default the global `metrics`, at
+    `METRICS_PATH`. It is bound to `address`, by default only to the local host. If the
+    `scheduler` of the main loop is given, how late it runs its tasks is observed as the
+    main loop lag.
+    """
+    httpd = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = registry or metrics
+
+    if scheduler:
+        scheduler.on_lag = lambda lag: httpd.metrics.observe('lost_main_loop_lag_seconds', lag)
+
+    thread = threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True)
+    thread.start()
+
+    logger.info(f"Serving the metrics at http://{address}:{port}{METRICS_PATH}")
+    return httpd
+
+
+metrics = Metrics()
@@ -1,5 +1,7 @@
 from enum import Enum
-import time
+from types import SimpleNamespace
+from lost.observers import call_observer, SYNC_OBSERVER_BUDGET
+from lost.scheduler import scheduler as default_scheduler
 
 
 class BaseTerminal:
@@ -13,31 +15,111 @@ class BaseTerminal:
     sensors etc. are possible as well.
 
     Changes in the state of the terminal are communicated to all interested parties
-    (the views) that have registered themselves as observers of the terminal.
+    (the views) that have registered themselves as observers of the terminal. Only the
+    fields whose values have actually changed are communicated: The setters of child
+    classes set the fields with `_update()`, which keeps track of the changes, and then
+    call `notify_observers()`. If a `defer_hook` is set, e.g. Tk's `after_idle()`, the
+    notifications are deferred and coalesced, so that the observers are notified at most
+    once per turn of the event loop, no matter how many setters have been called.
+
+    The observers are called one after another in the main thread, and each is expected
+    to finish within its time budget (see `add_observer()`). Observers that are slow,
+    e.g. because they drive hardware, should be wrapped in an `AsyncObserver`, which runs
+    them in a worker thread of their own.
+
+    States can time out, e.g. a half-finished user input returns to the welcome screen
+    after a while. Instead of polling the terminal, entering a state arms a single
+    one-shot task with the scheduler (see `state_timeouts`), and user actions re-arm it
+    (see `action_timeout`). When the deadline is due, `on_timeout()` is called. Nothing
+    runs in states without a timeout, e.g. in an idle welcome screen.
 
     Some of the methods are intended for user code that is oblivious of the concrete
     terminal class it is dealing with, for example the `SmartcardMonitor` or the
     `NetworkHandler`. Child classes are expected to override these methods.
     """
 
-    def __init__(self):
+    # The timeouts in seconds of the states, keyed by state. `None` means no timeout.
+    state_timeouts = {}
+    # The timeout in seconds that a user action re-arms in the current state.
+    action_timeout = None
+    # In gateway mode, the name of the smartcard reader that this terminal belongs to.
+    reader_name = None
+
+    def __init__(self, scheduler=None):
         self._observers = []
         self._is_updating = False
-
-    def add_observer(self, obs):
-        self._observers.append(obs)
+        self._changed = set()
+        self._fields = set()
+        self._is_notify_pending = False
+        self.defer_hook = None
+        self.scheduler = scheduler or default_scheduler
+        self.timeout_task = None
+
+    def add_observer(self, obs, budget=SYNC_OBSERVER_BUDGET):
+        """
+        Adds an observer of the terminal. If its `update_to_model()` takes longer than
+        `budget` seconds, a warning is logged.
+        """
+        self._observers.append((obs, budget))
 
     def clear_observers(self):
         self._observers.clear()
 
+    def _update(self, **fields):
+        """Sets the given fields, keeping track of those whose values have changed."""
+        for name, value in fields.items():
+            if name not in self.__dict__ or self.__dict__[name] != value:
+                setattr(self, name, value)
+                self._changed.add(name)
+                self._fields.add(name)
+
+    def get_snapshot(self):
+        """Returns a copy of the fields of the terminal, e.g. for use in another thread."""
+        return SimpleNamespace(**{name: getattr(self, name) for name in self._fields})
+
     def notify_observers(self):
+        """
+        Calls `update_to_model(terminal, changed)` of all observers, where `changed` is
+        the set of the names of the fields that have changed since the last notification.
+        """
+        if self.defer_hook is None:
+            self._flush_changes()
+        elif not self._is_notify_pending:
+            self._is_notify_pending = True
+            self.defer_hook(self._flush_changes)
+
+    def _flush_changes(self):
+        self._is_notify_pending = False
+        if not self._changed:
+            return
+
+        changed = frozenset(self._changed)
+        self._changed.clear()
+
         # Make sure that we don't accidentally enter infinite recursion.
         assert not self._is_updating
         self._is_updating = True
-        for obs in self._observers:
-            obs.update_to_model(self)
+        for obs, budget in self._observers:
+            call_observer(obs, self, changed, budget)
         self._is_updating = False
 
+    def _arm_timeout(self, timeout):
+        """Replaces the pending timeout, if any, with one that is due in `timeout` seconds."""
+        if self.timeout_task is not None:
+            self.scheduler.cancel(self.timeout_task)
+            self.timeout_task = None
+
+        if timeout is not None:
+            self.timeout_task = self.scheduler.add_oneshot("Terminal.on_timeout", timeout, self._on_deadline)
+
+    def _on_deadline(self):
+        self.timeout_task = None
+        self.on_timeout()
+
+    def on_timeout(self):
+        # Child classes may override this method.
+        self.set_state_welcome()
+
     def get_user_input(self):
         # Child classes are expected to override this method!
         return {}
@@ -61,7 +143,3 @@ class BaseTerminal:
     def on_server_reply_received(self, reply):
         # Child classes are expected to override this method!
         pass
-
-    def on_clock_tick(self):
-        # Child classes are expected to override this method!
-        pass
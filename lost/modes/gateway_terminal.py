@@ -0,0 +1,26 @@
+# Without a display, nobody reads the server's reply, so the terminals of the gateway
+# return to the welcome state soon.
+GATEWAY_STATE_TIMEOUT = 2.0
+
+
+class GatewayTerminalMixin:
+    """
+    Adapts a terminal for gateway mode, where it serves one of several smartcard readers
+    and has no display, see `GatewayMonitor`. For example:
+
+        class GatewayTerminal(GatewayTerminalMixin, Terminal):
+            pass
+
+    At a busy loading dock, the next worker may tap the card right after the previous
+    one, while the terminal is still waiting for the server's reply or "displaying" it.
+    As nobody would notice that the card was ignored, the terminal accepts smartcards in
+    all states rather than only in those that expect user input.
+    """
+
+    def __init__(self, scheduler=None):
+        super().__init__(scheduler)
+        self.state_timeouts = {state: GATEWAY_STATE_TIMEOUT for state in self.state_timeouts}
+
+    def is_expecting_smartcard(self):
+        # Overrides the method in the parent class.
+        return True
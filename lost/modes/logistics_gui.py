@@ -4,16 +4,21 @@ from tkinter import *
 # from tkinter import ttk
 
 from lost.modes.logistics_terminal import State
-from lost.widgets import adjust_wraplength, cp, fp, DisplayServerReplyFrame, PauseButtonsRow, SystemPanelFrame, TitleBar, TouchButton, WaitForServerFrame
+from lost.widgets import adjust_wraplength, cp, fp, is_changed, DisplayServerReplyFrame, PauseButtonsRow, SystemPanelFrame, TitleBar, TouchButton, WaitForServerFrame
+from lost.scheduler import scheduler as default_scheduler, TkDriver
+from lost.thread_tools import thread_queue
+from lost.tracing import tracer
 
 
 class RootWindow(Tk):
 
-    def __init__(self, terminal, main_con, *args, **kwargs):
+    def __init__(self, terminal, main_con, *args, scheduler=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.terminal = terminal
         self.main_con = main_con
+        # The timers of all frames and widgets, see `winfo_toplevel()`.
+        self.scheduler = scheduler or default_scheduler
 
         self.title("LoST - Lori Stempeluhr Terminal")
 
@@ -76,14 +81,57 @@ class RootWindow(Tk):
         self.active_frame = None
 
         self.bind('<Configure>', self.on_resize)
-        self.drive_main_connector()
-        self.drive_terminal_clock()
+        self.watch_thread_queue()
+        # Coalesce the notifications of the terminal to one per turn of the event loop.
+        self.terminal.defer_hook = self.after_idle
+
+        # Tk redraws the widgets in idle callbacks that were scheduled when the widgets
+        # were changed. Therefore, a trace that is completed in an idle callback that is
+        # scheduled after the change includes the time for the redraw. As the widgets are
+        # only changed in the idle callback of the terminal's notification, we must wait
+        # for one more round of idle callbacks.
+        tracer.render_hook = lambda func: self.after_idle(self.after_idle, func)
+
+        # The tasks of the hidden frames don't need to run.
+        for frame in self.get_frames():
+            self.scheduler.suspend(frame)
+
+        # All timers of the program are run by the scheduler.
+        self.scheduler_driver = TkDriver(self, self.scheduler)
+        # If the `thread_queue` is watched, the clock ticks are only a fallback for
+        # picking up its items.
+        self.scheduler.add_periodic("RootWindow.drive_main_connector", 1.0 if self.is_watching_thread_queue else 0.1, self.drive_main_connector)
+
+    def get_frames(self):
+        return (
+            self.frame_Welcome,
+            self.frame_Arbeitsanfang,
+            self.frame_Arbeitsende,
+            self.frame_WaitForServer,
+            self.frame_DisplayServerReply,
+            self.frame_SystemPanel,
+        )
 
     def on_resize(self, event):
         if event.widget == self:
             # print(event)
             fp.resize(event.height)
 
+    def watch_thread_queue(self):
+        """
+        Have Tk wake us up as soon as a thread has put something into the `thread_queue`.
+
+        This is much quicker than polling the queue and lets the program sleep while
+        there is nothing to do. File handlers are not available on all platforms though,
+        e.g. not on Windows, where we fall back to polling.
+        """
+        self.is_watching_thread_queue = False
+        fd = thread_queue.fileno()
+
+        if fd is not None and hasattr(self.tk, 'createfilehandler'):
+            self.tk.createfilehandler(fd, READABLE, lambda fd, mask: self.main_con.on_thread_queue_wakeup())
+            self.is_watching_thread_queue = True
+
     def drive_main_connector(self):
         """
         Forward clock tick events to the main connector.
@@ -93,14 +141,8 @@ class RootWindow(Tk):
         them to the main connector that will further distribute them.
         """
         self.main_con.on_clock_tick()
-        self.after(100, self.drive_main_connector)
 
-    def drive_terminal_clock(self):
-        if self.terminal is not None:
-            self.terminal.on_clock_tick()
-        self.after(500, self.drive_terminal_clock)
-
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
         #print("update_to_model")
         #print(f"{terminal.state = }")
         next_frame = self.frame_Welcome
@@ -116,7 +158,11 @@ class RootWindow(Tk):
             next_frame = self.frame_SystemPanel
 
         if hasattr(next_frame, "update_to_model"):
-            next_frame.update_to_model(terminal)
+            if next_frame != self.active_frame or is_changed(changed, 'state'):
+                # The frame was hidden or the state was entered anew, so it must be fully updated.
+                next_frame.update_to_model(terminal)
+            else:
+                next_frame.update_to_model(terminal, changed)
 
         if self.active_frame == next_frame:
             return
@@ -124,8 +170,10 @@ class RootWindow(Tk):
         #print("Setting new frame!")
         if self.active_frame is not None:
             self.active_frame.pack_forget()
+            self.scheduler.suspend(self.active_frame)
 
         self.active_frame = next_frame
+        self.scheduler.resume(self.active_frame)
         self.active_frame.pack(side=TOP, fill=BOTH, expand=True) #, padx=3, pady=3)
 
 
@@ -173,7 +221,7 @@ class WelcomeFrame(Frame):
         ende_button = TouchButton(buttons_row, text="Ende", command=self.on_click_Arbeitsende)
         ende_button.grid(row=0, column=3, sticky="NESW")
 
-        self.update_clock()
+        self.winfo_toplevel().scheduler.add_periodic("WelcomeFrame.update_clock", 1.0, self.update_clock, group=self)
 
     def on_click_Arbeitsanfang(self):
         self.winfo_toplevel().terminal.set_state(State.ENTER_START_OF_WORK_DETAILS)
@@ -186,7 +234,6 @@ class WelcomeFrame(Frame):
         # https://stackoverflow.com/questions/985505/locale-date-formatting-in-python
         self.time_label.config(text=format_datetime(now, 'HH:mm', locale='de_DE'))
         self.date_label.config(text=format_datetime(now, 'EEEE, d. MMMM', locale='de_DE'))  # Mittwoch, 5. August
-        self.after(1000, self.update_clock)
 
 
 class ArbeitsanfangFrame(Frame):
@@ -230,7 +277,10 @@ class ArbeitsanfangFrame(Frame):
         self.jetzt_button = TouchButton(buttons_row, text="» jetzt «", command=self.on_click_Anfang_Jetzt)
         self.jetzt_button.grid(row=0, column=3, sticky="NESW")
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
+        if not is_changed(changed, 'sow_type'):
+            return
+
         self.schicht_button.set_active(terminal.sow_type == 'schicht')
         self.jetzt_button.set_active(terminal.sow_type == 'jetzt')
 
@@ -274,7 +324,10 @@ class DepartmentButtonsGrid(Frame):
                 btn.bind('<Button-1>', self.on_LMB_click)
                 self.buttons.append(btn)
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
+        if not is_changed(changed, 'department'):
+            return
+
         for btn in self.buttons:
             btn.set_active(btn.cget('text') == terminal.department)
 
@@ -323,17 +376,19 @@ class ArbeitsendeFrame(Frame):
         self.pause_buttons = PauseButtonsRow(self)
         self.pause_buttons.grid(row=8, column=0, sticky="NESW")
 
-    def update_to_model(self, terminal):
-        dept_str = "Bereich"
-        if terminal.department is not None:
-            dept_str += f" {terminal.department}"
+    def update_to_model(self, terminal, changed=None):
+        if is_changed(changed, 'department'):
+            dept_str = "Bereich"
+            if terminal.department is not None:
+                dept_str += f" {terminal.department}"
 
-        self.dept_label.config(text=dept_str)
-        self.dept_grid.update_to_model(terminal)
+            self.dept_label.config(text=dept_str)
+            self.dept_grid.update_to_model(terminal)
 
-        p_str = "Pause"
-        if terminal.pause is not None:
-            p_str += f" {terminal.pause // 60}:{terminal.pause % 60:02}"
+        if is_changed(changed, 'pause'):
+            p_str = "Pause"
+            if terminal.pause is not None:
+                p_str += f" {terminal.pause // 60}:{terminal.pause % 60:02}"
 
-        self.pause_label.config(text=p_str)
-        self.pause_buttons.update_to_model(terminal)
+            self.pause_label.config(text=p_str)
+            self.pause_buttons.update_to_model(terminal)
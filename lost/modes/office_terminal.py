@@ -1,5 +1,4 @@
 from enum import Enum
-from lost.common import get_time_time
 from lost.modes.base_terminal import BaseTerminal
 
 
@@ -17,19 +16,23 @@ USER_INPUT_STATES = (
     State.SYSTEM_PANEL,
 )
 
+# After this many seconds without user action, the terminal returns to the welcome screen.
+IDLE_TIMEOUT = 30.0
+
 
 class Terminal(BaseTerminal):
     """This class represents a terminal for office personnel."""
 
-    def __init__(self):
-        super().__init__()
+    state_timeouts = {state: IDLE_TIMEOUT for state in State if state != State.WELCOME}
+    action_timeout = IDLE_TIMEOUT
+
+    def __init__(self, scheduler=None):
+        super().__init__(scheduler)
         self._set_state(State.WELCOME)
 
     def _set_state(self, state):
-        self.state = state
-        self.pause = None
-        self.time_last_action = get_time_time()
-        self.last_server_reply = None
+        self._update(state=state, pause=None, last_server_reply=None)
+        self._arm_timeout(self.state_timeouts.get(state))
 
     def get_user_input(self):
         # Overrides the method in the parent class.
@@ -54,8 +57,8 @@ class Terminal(BaseTerminal):
         self.notify_observers()
 
     def set_pause(self, pause):
-        self.pause = pause
-        self.time_last_action = get_time_time()
+        self._update(pause=pause)
+        self._arm_timeout(self.action_timeout)
         self.notify_observers()
 
     def is_expecting_smartcard(self):
@@ -69,12 +72,5 @@ class Terminal(BaseTerminal):
     def on_server_reply_received(self, reply):
         # Overrides the method in the parent class.
         self._set_state(State.DISPLAY_SERVER_REPLY)
-        self.last_server_reply = reply
+        self._update(last_server_reply=reply)
         self.notify_observers()
-
-    def on_clock_tick(self):
-        # Overrides the method in the parent class.
-        time_idle = get_time_time() - self.time_last_action
-        if time_idle > 30.0:
-            self._set_state(State.WELCOME)
-            self.notify_observers()
@@ -1,25 +1,381 @@
-import dbm.gnu
+from collections import deque
+import functools
 import json
 import logging
+import os
+import random
 import requests
+import threading
+import time
 
 from lost import settings
-from lost.common import get_datetime_now, get_time_time
-from lost.thread_tools import start_thread
+from lost.backlog import Backlog, MAX_LOSS_WINDOW
+from lost.clock import system_clock
+from lost.common import get_event_id, get_percentile, get_time_time
+from lost.metrics import metrics
+from lost.thread_tools import thread_queue, WorkerPool
+from lost.tracing import traced, tracer
 
 
 logger = logging.getLogger("lost.network")
-REQUEST_TIMEOUT = 8.0
+REQUEST_TIMEOUT = 8.0           # the default and the maximum timeout for live requests
+MIN_REQUEST_TIMEOUT = 2.0
+CONNECT_TIMEOUT = 3.0
+REPLAY_TIMEOUT = 30.0           # the timeout for re-sending the backlog
+LEASE_DURATION = 60.0
+POOL_SIZE = 4
+POOL_IDLE_TIMEOUT = 60.0
+
+
+class SessionPool:
+    """
+    A keep-alive connection pool that is shared by all threads that send requests to Lori.
+
+    Without it, each request would establish a new TCP connection to the server, which
+    on a slow wireless network costs much more than the request itself. The pool keeps
+    a single `requests.Session` whose adapter holds up to `pool_size` open connections.
+    If the pool is not used for `idle_timeout` seconds, the session and its connections
+    are discarded and a fresh one is created on the next use: This way, we don't try to
+    re-use connections that the server or a NAT router has long dropped.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.session = None
+        self.time_last_used = 0
+
+    def _new_session(self):
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=False,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get_session(self):
+        """Returns the shared session. This method can be called from any thread."""
+        with self.lock:
+            now = get_time_time()
+            if self.session is not None and now - self.time_last_used > self.idle_timeout:
+                logger.debug("SessionPool: Closing the idle session.")
+                self.session.close()
+                self.session = None
+
+            if self.session is None:
+                self.session = self._new_session()
+
+            self.time_last_used = now
+            return self.session
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+class CircuitBreaker:
+    """
+    Keeps track of the health of the connection to the Lori server.
+
+    As long as requests succeed, the breaker is "closed" and all requests are sent. After
+    `failure_threshold` consecutive failures, the breaker "opens": No requests are sent
+    until a backoff time has elapsed, so that e.g. a user at the terminal doesn't have to
+    wait for a timeout that is bound to happen anyway. The backoff time starts with
+    `base_backoff` and doubles with each further failure up to `max_backoff`. It is
+    randomly varied by up to +/- `jitter` (a fraction) so that many terminals that lost
+    the connection at the same time don't all try again at the same time.
+
+    When the backoff time has elapsed, the breaker is "half-open": A single request is
+    let through as a probe. If it succeeds, the breaker closes again, if it fails, the
+    breaker re-opens with the next longer backoff time.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=2, base_backoff=10.0, max_backoff=300.0, jitter=0.2):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.state = CircuitBreaker.CLOSED
+        self.num_failures = 0
+        self.time_next_attempt = 0
+        self.is_probing = False
+
+    def get_backoff(self):
+        exponent = max(self.num_failures - 1, 0)
+        backoff = min(self.base_backoff * 2**exponent, self.max_backoff)
+        return backoff * (1.0 + self.jitter * random.uniform(-1.0, 1.0))
+
+    def allow_request(self, now):
+        """Returns whether a request should be sent now. Must be followed by `record_success()` or `record_failure()`."""
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+
+        if self.state == CircuitBreaker.OPEN:
+            if now < self.time_next_attempt:
+                return False
+            self.state = CircuitBreaker.HALF_OPEN
+            self.is_probing = False
+
+        # The breaker is half-open: Let a single probe request through.
+        if self.is_probing:
+            return False
+
+        self.is_probing = True
+        return True
+
+    def record_success(self):
+        if self.state != CircuitBreaker.CLOSED:
+            logger.info("CircuitBreaker: The connection to Lori is working again.")
+
+        self.state = CircuitBreaker.CLOSED
+        self.num_failures = 0
+        self.is_probing = False
+
+    def record_cancelled(self):
+        """
+        The request that was let through was not sent after all, e.g. because the worker
+        pool was full. This says nothing about the server, but if the request was the
+        probe, the next one must be let through.
+        """
+        self.is_probing = False
+
+    def record_failure(self, now):
+        self.num_failures += 1
+        self.is_probing = False
+        backoff = self.get_backoff()
+        self.time_next_attempt = now + backoff
+
+        if self.state == CircuitBreaker.HALF_OPEN or self.num_failures >= self.failure_threshold:
+            if self.state != CircuitBreaker.OPEN:
+                logger.warning(f"CircuitBreaker: {self.num_failures} failures, not sending anything for {backoff:.1f} s.")
+            self.state = CircuitBreaker.OPEN
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the last `window` successful requests to the Lori server.
+
+    From this distribution, the timeouts for live requests are derived: While a person
+    is waiting at the terminal, we don't want to wait for a server that is down for
+    longer than it normally takes it to reply. Thus, the read timeout is the 99th
+    percentile of the recent latencies plus `margin` seconds, but not less than
+    `min_timeout` and not more than `max_timeout`. Until `min_samples` latencies are
+    known, `max_timeout` is used.
+
+    Requests that time out or fail are not recorded: A slow server that keeps hitting
+    the timeout is thus only detected by the failures, which is fine, as these requests
+    end up in the backlog, which is re-sent with much longer timeouts.
+
+    The latencies are recorded in the worker threads, so access is protected by a lock.
+    """
+
+    def __init__(self, window=100, margin=1.0, min_timeout=MIN_REQUEST_TIMEOUT, max_timeout=REQUEST_TIMEOUT, min_samples=10):
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def get_percentile(self, p):
+        """Returns the `p`-th percentile of the recorded latencies, or `None` if there are none."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+        return get_percentile(latencies, p)
+
+    def get_timeouts(self):
+        """Returns the `(connect, read)` timeouts for a live request."""
+        with self.lock:
+            num_samples = len(self.latencies)
+
+        if num_samples < self.min_samples:
+            read_timeout = self.max_timeout
+        else:
+            read_timeout = self.get_percentile(99) + self.margin
+            read_timeout = min(max(read_timeout, self.min_timeout), self.max_timeout)
+
+        return min(CONNECT_TIMEOUT, read_timeout), read_timeout
+
+
+class DrainScheduler:
+    """
+    Catches up with the backlog in the background.
+
+    The scheduler is driven by the periodic clock ticks and by the replies to the re-sent
+    backlog entries: While the server keeps answering, up to `burst_size` requests are
+    sent concurrently, and each reply immediately makes room for the next one. Unless the
+    server is known not to support them, each request is a batch of up to `batch_size`
+    entries (see `post_stamp_events()`). Draining
+    pauses while live user input is being sent, so that the user who is attending the
+    terminal doesn't have to wait for the backlog, and while the circuit breaker of the
+    network handler considers the server to be unreachable.
+
+    A reply that has not arrived within `LEASE_DURATION`, e.g. because a worker thread
+    hung, is given up on, so that a single lost reply cannot stop the draining for good.
+    By then, the leases of its entries have expired, so that they are re-sent.
+
+    At the end of each run, the number of re-sent entries and the throughput are logged.
+    """
+
+    def __init__(self, network_handler, burst_size=2, batch_size=50):
+        self.nwh = network_handler
+        self.burst_size = burst_size
+        self.batch_size = batch_size
+        self.num_in_flight = 0
+        # The times by which the replies to the requests in flight are expected.
+        self.deadlines = deque()
+        self.time_run_started = None
+        self.num_run_drained = 0
+        self.num_total_drained = 0
+
+    def drain(self):
+        """Re-sends as many backlog entries as the burst size currently allows."""
+        self.expire_lost_replies(self.nwh.clock.time())
+
+        if self.nwh.num_live_in_flight > 0:
+            return
+
+        while self.num_in_flight < self.burst_size and self.nwh.backlog.num_available() > 0:
+            if self.nwh.batch_supported is not False and self.nwh.backlog.num_available() > 1:
+                sent = self.nwh.catch_up_backlog_batch(self.batch_size)
+            else:
+                sent = self.nwh.catch_up_backlog()
+
+            if not sent:
+                break
+
+    def on_replay_sent(self, now):
+        if self.time_run_started is None:
+            self.time_run_started = now
+            self.num_run_drained = 0
+
+        self.deadlines.append(now + LEASE_DURATION)
+        self.num_in_flight = len(self.deadlines)
+
+    def on_replay_done(self, now, success, num_entries=1):
+        if self.deadlines:
+            # The replies don't necessarily come in order, but only their number matters.
+            self.deadlines.popleft()
+        self.num_in_flight = len(self.deadlines)
+
+        if success:
+            self.num_run_drained += num_entries
+            self.num_total_drained += num_entries
+
+        if self.time_run_started is not None and self.num_in_flight == 0:
+            if not success or len(self.nwh.backlog) == 0:
+                self._end_run(now)
+
+        if success:
+            self.drain()
+
+    def expire_lost_replies(self, now):
+        num_lost = 0
+        while self.deadlines and self.deadlines[0] <= now:
+            self.deadlines.popleft()
+            num_lost += 1
+
+        if num_lost == 0:
+            return
+
+        logger.warning(f"DrainScheduler: Giving up on {num_lost} overdue replies, their backlog entries will be re-sent.")
+        self.num_in_flight = len(self.deadlines)
+        if self.time_run_started is not None and self.num_in_flight == 0:
+            self._end_run(now)
+
+    def _end_run(self, now):
+        duration = now - self.time_run_started
+        rate = self.num_run_drained / duration if duration > 0 else float(self.num_run_drained)
+        logger.info(
+            f"DrainScheduler: Re-sent {self.num_run_drained} backlog entries in {duration:.1f} s "
+            f"({rate:.2f} entries/s), {len(self.nwh.backlog)} entries remaining."
+        )
+        self.time_run_started = None
 
 
-def post_stamp_event(user_input):
-    """Sends the smartcard details in a POST request to the server."""
+def get_server_url(path):
     SERVER_NAME = settings.SERVER_ADDRESS[0]
     SERVER_PORT = settings.SERVER_ADDRESS[1]
 
     if SERVER_NAME == 'built-in':
         SERVER_NAME = 'localhost'
 
+    return f"http://{SERVER_NAME}:{SERVER_PORT}{path}"
+
+
+def get_batch_path():
+    """Returns the URL path for submitting batches, e.g. '/submit-batch/' for '/submit/'."""
+    return settings.SERVER_URL.rstrip('/') + '-batch/'
+
+
+def get_error_class(network_error):
+    """
+    Returns the class of a network error as reported by `post_stamp_event()` or
+    `post_stamp_events()`, e.g. 'ConnectionError', 'Timeout', 'JSONDecodeError' or
+    'HTTP 500'.
+    """
+    if network_error.startswith("The HTTP status response code was "):
+        return f"HTTP {network_error.split()[6].rstrip(',')}"
+    return network_error.split(':', 1)[0]
+
+
+def post_with_redirects(http, url, timeout=None, **kwargs):
+    if timeout is None:
+        timeout = REQUEST_TIMEOUT
+
+    r = http.post(
+        url,
+        **kwargs,
+        timeout=timeout,
+        allow_redirects=False,
+        verify=False,
+    )
+
+    # With `allow_redirects=True`, Requests turns POST requests that are
+    # redirected automatically into GET requests when following them:
+    #   - https://github.com/psf/requests/issues/3107
+    #   - https://github.com/psf/requests/issues/5494
+    # Therefore, we must implement POST-redirects ourselves.
+    count = 5
+    while count > 0 and r.status_code in (301, 302, 307, 308):
+        count -= 1
+        r = http.post(
+            r.headers['Location'],
+            **kwargs,
+            timeout=timeout,
+            allow_redirects=False,
+            verify=False,
+        )
+
+    return r
+
+
+def post_stamp_event(user_input, session_pool=None, timeout=None, latency_tracker=None):
+    """
+    Sends the smartcard details in a POST request to the server.
+
+    If a `session_pool` is given, the request is sent over one of its keep-alive
+    connections. Otherwise, a new connection is established just for this request.
+
+    `timeout` is passed to Requests, i.e. it is either a number or a `(connect, read)`
+    tuple. It defaults to `REQUEST_TIMEOUT`. If a `latency_tracker` is given, the time
+    of a successful round-trip is recorded in it.
+    """
     data = user_input.copy()
     data.update(
         {
@@ -28,30 +384,11 @@ def post_stamp_event(user_input):
         }
     )
 
-    try:
-        r = requests.post(
-            f"http://{SERVER_NAME}:{SERVER_PORT}{settings.SERVER_URL}",
-            data=data,
-            timeout=REQUEST_TIMEOUT,
-            allow_redirects=False,
-            verify=False,
-        )
+    http = session_pool.get_session() if session_pool else requests
+    time_started = time.monotonic()
 
-        # With `allow_redirects=True`, Requests turns POST requests that are
-        # redirected automatically into GET requests when following them:
-        #   - https://github.com/psf/requests/issues/3107
-        #   - https://github.com/psf/requests/issues/5494
-        # Therefore, we must implement POST-redirects ourselves.
-        count = 5
-        while count > 0 and r.status_code in (301, 302, 307, 308):
-            count -= 1
-            r = requests.post(
-                r.headers['Location'],
-                data=data,
-                timeout=REQUEST_TIMEOUT,
-                allow_redirects=False,
-                verify=False,
-            )
+    try:
+        r = post_with_redirects(http, get_server_url(settings.SERVER_URL), timeout, data=data)
 
     except requests.exceptions.ConnectionError as e:
         return user_input, {}, f"ConnectionError: {e}"
@@ -70,100 +407,442 @@ def post_stamp_event(user_input):
     except requests.exceptions.JSONDecodeError as e:
         return user_input, {}, f"JSONDecodeError: {e}"
 
+    if latency_tracker:
+        latency_tracker.record(time.monotonic() - time_started)
+
     # The results of this thread are passed as parameters to the callback
     # in the main thread.
     return user_input, json_dict, None
 
 
+def post_stamp_events(user_inputs, session_pool=None, timeout=None):
+    """
+    Sends the details of several smartcard events in a single POST request to the server.
+
+    The events are submitted as a JSON document of the form
+
+        {"terminal_name": ..., "terminal_pwd": ..., "events": [user_input, ...]}
+
+    to the batch URL (see `get_batch_path()`). The server is expected to reply with a
+    JSON document `{"results": [result, ...]}` with one result per event, in the same
+    order. A result of `null` means that the event was not processed.
+
+    Returns the tuple `(user_inputs, results, network_error, batch_unsupported)`, where
+    `batch_unsupported` is `True` if the server indicated that it doesn't support batches,
+    in which case the events should be submitted one by one with `post_stamp_event()`.
+
+    `timeout` is used as with `post_stamp_event()`.
+    """
+    data = {
+        'terminal_name': settings.TERMINAL_NAME,
+        'terminal_pwd': settings.TERMINAL_PASSWORD,
+        'events': user_inputs,
+    }
+
+    http = session_pool.get_session() if session_pool else requests
+
+    try:
+        r = post_with_redirects(http, get_server_url(get_batch_path()), timeout, json=data)
+
+    except requests.exceptions.ConnectionError as e:
+        return user_inputs, [], f"ConnectionError: {e}", False
+
+    except requests.exceptions.Timeout as e:
+        return user_inputs, [], f"Timeout: {e}", False
+
+    except requests.exceptions.RequestException as e:
+        return user_inputs, [], f"RequestException: {e}", False
+
+    if r.status_code in (404, 405, 501):
+        return user_inputs, [], f"The server does not support batches (HTTP status {r.status_code}).", True
+
+    if r.status_code != 200:
+        return user_inputs, [], f"The HTTP status response code was {r.status_code}, expected 200 (OK).", False
+
+    try:
+        results = r.json()['results']
+    except requests.exceptions.JSONDecodeError as e:
+        return user_inputs, [], f"JSONDecodeError: {e}", False
+    except (KeyError, TypeError) as e:
+        return user_inputs, [], f"Invalid batch reply: {e!r}", False
+
+    if not isinstance(results, list) or len(results) != len(user_inputs):
+        return user_inputs, [], f"Invalid batch reply: expected {len(user_inputs)} results.", False
+
+    return user_inputs, results, None, False
+
+
 class NetworkHandler:
 
-    def __init__(self, terminal, backlog_path='backlog.db'):
-        # TODO: Can we employ connection pooling?
+    def __init__(self, terminal, backlog_path='backlog.sqlite3', pool_size=POOL_SIZE, pool_idle_timeout=POOL_IDLE_TIMEOUT, worker_pool=None, old_backlog_path='backlog.db', backlog_durability='grouped', backlog_max_loss_window=MAX_LOSS_WINDOW, clock=None):
         self.terminal = terminal
-        self.backlog = dbm.gnu.open(backlog_path, 'cs')
+        # The source of the timestamps and of the time for throttling and backing off.
+        self.clock = clock or system_clock
+        self.session_pool = SessionPool(pool_size, pool_idle_timeout)
+        # If no worker pool is given, we create and own one.
+        self.owns_worker_pool = worker_pool is None
+        self.worker_pool = worker_pool or WorkerPool(num_workers=4, max_queued=16, name="network")
+        self.backlog = Backlog(backlog_path, backlog_durability, backlog_max_loss_window, clock=self.clock)
+        if old_backlog_path and os.path.exists(old_backlog_path):
+            # Earlier versions of this program kept the backlog in a `dbm.gnu` file.
+            self.backlog.import_dbm(old_backlog_path)
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.drainer = DrainScheduler(self)
+        # Whether the server supports batches is unknown until we tried.
+        self.batch_supported = None
+        self.num_live_in_flight = 0
         self.time_next_backlog = 0
-        self.time_last_sending = 0
+        # Keyed by terminal, as in gateway mode several terminals share this handler.
+        self.time_last_sending = {}
+        # The time at which each live user input was sent and the user input itself, keyed
+        # by event ID, so that it can be backlogged if the reply gets lost.
+        self.live_in_flight = {}
+        # The event IDs of the live user input that was backlogged by `expire_live_requests()`.
+        # If their replies still arrive, they are ignored.
+        self.expired_live = set()
 
     def shutdown(self):
         # TODO: Should use a context manager instead!
         # See https://realpython.com/python-with-statement/
+        if self.owns_worker_pool:
+            self.worker_pool.shutdown()
+        self.session_pool.close()
         self.backlog.close()
 
-    def send_to_Lori(self, smartcard_id):
+    def on_clock_tick(self):
+        """Called periodically in the main thread."""
+        self.backlog.on_clock_tick()
+        self.expire_live_requests()
+        self.drainer.drain()
+
+    def expire_live_requests(self):
+        """
+        Puts the live user input whose reply has not arrived within `LEASE_DURATION` into
+        the backlog, e.g. if a worker thread hung. Otherwise, the lost reply would keep the
+        `DrainScheduler` paused for good. The event ID stays the same, so if the server has
+        received the user input after all, it ignores the second copy.
+        """
+        now = self.clock.monotonic()
+        expired = [event_id for event_id, (time_sent, _) in self.live_in_flight.items() if now - time_sent >= LEASE_DURATION]
+
+        for event_id in expired:
+            time_sent, user_input = self.live_in_flight.pop(event_id)
+            self.expired_live.add(event_id)
+            self.num_live_in_flight = max(self.num_live_in_flight - 1, 0)
+            self.breaker.record_cancelled()
+
+            # The worker thread may still hold the original `user_input`, so store a copy.
+            user_input_json = json.dumps(dict(user_input, backlog_count=user_input['backlog_count'] + 1))
+            seq = self.backlog.append(user_input_json, self.clock.time())
+            logger.warning(f"NetworkHandler: The reply to event {event_id} is overdue, putting it into the backlog.")
+            logger.info(f"    --> backlog[{seq}] = '{user_input_json}'")
+
+        if expired:
+            self.backlog.sync()
+
+    def send_to_Lori(self, smartcard_id, trace_id=None, terminal=None):
+        """
+        Sends the smartcard details and the user input in the terminal to the server.
+
+        `trace_id` is the ID of the `Tracer` trace that was started when the smartcard
+        was read, or `None`.
+
+        `terminal` is the terminal at which the smartcard was read, by default the
+        terminal of this handler. In gateway mode, the handler is shared by several
+        terminals, see `GatewayMonitor`.
+        """
+        terminal = terminal or self.terminal
+
         # This should never kick in, but let's throttle the number of network
         # transmissions and simultaneous threads anyway.
-        now = get_time_time()
-        if now - self.time_last_sending < 0.5:
+        now = self.clock.time()
+        time_last_sending = self.time_last_sending.get(terminal, 0)
+        if now - time_last_sending < 0.5:
             logger.error(f"send_to_Lori(): Throttling network transmissions, dropping {smartcard_id = }!")
-            logger.error(f"    {self.time_last_sending = }, {now = }")
+            logger.error(f"    {time_last_sending = }, {now = }")
+            metrics.inc('lost_throttled_drops_total')
+            tracer.discard(trace_id)
             return
-        self.time_last_sending = now
+        self.time_last_sending[terminal] = now
 
         user_input = {
             'smartcard_id': smartcard_id,
-            'terminal_ts': str(get_datetime_now()),   # local timestamp
+            'terminal_ts': str(self.clock.now()),   # local timestamp
             'backlog_count': 0,
+            # The event ID stays the same in all attempts to send this event, so
+            # that the server can recognize and ignore duplicates.
+            'event_id': get_event_id(),
         }
 
+        if terminal.reader_name:
+            # Tell the server which of the readers of the gateway the smartcard was read at.
+            user_input['reader'] = terminal.reader_name
+
         # Add the user input that was made in the terminal.
-        user_input.update(self.terminal.get_user_input())
+        user_input.update(terminal.get_user_input())
 
         logger.info(f"send_to_Lori():")
         logger.info(f"    {user_input = }")
 
-        start_thread(post_stamp_event, (user_input,), self.on_server_reply)
+        callback = self.on_server_reply
+        if trace_id or terminal is not self.terminal:
+            callback = functools.partial(self.on_server_reply, trace_id=trace_id, terminal=terminal)
+        tracer.mark(trace_id, 'submit')
 
-    def catch_up_backlog(self):
-        """If there is anything in the backlog, try to file it now."""
-        now = get_time_time()
-        if now < self.time_next_backlog:
+        if not self.breaker.allow_request(now):
+            # The server is known to be unreachable. Rather than having the user wait for
+            # the inevitable timeout, put the user input into the backlog right away.
+            network_error = f"CircuitBreaker: Not sending, the last {self.breaker.num_failures} attempts failed."
+            thread_queue.put((callback, (user_input, {}, network_error, False)))
             return
 
-        # It is unclear in which order the keys are returned, for details see:
-        # https://docs.python.org/3/library/dbm.html#module-dbm.gnu
-        unique_id = self.backlog.firstkey()
+        self.num_live_in_flight += 1
+        self.live_in_flight[user_input['event_id']] = (self.clock.monotonic(), user_input)
+        self._submit_post(user_input, callback, trace_id=trace_id)
+
+    def catch_up_backlog(self):
+        """
+        If there is anything in the backlog, try to file it now.
+
+        Returns `True` if an entry of the backlog was re-sent. Normally, this method is
+        called by the `DrainScheduler`.
+        """
+        now = self.clock.time()
+        if now < self.time_next_backlog:
+            return False
 
-        if unique_id is None:
+        if len(self.backlog) == 0:
             # The backlog is empty. Unless something else happens that overrides this,
             # only try again much later.
             logger.info(f"catch_up_backlog(): The backlog is empty.")
             self.time_next_backlog = now + 24 * 3600
-            return
+            return False
 
-        user_input_json = self.backlog[unique_id]
-        del self.backlog[unique_id]
-        self.backlog.sync()
+        entries = self.backlog.get_available(1, now)
+        if not entries:
+            # All entries are currently being re-sent.
+            return False
+
+        seq, time_added, user_input_json = entries[0]
 
         try:
             user_input = json.loads(user_input_json)
         except json.JSONDecodeError as e:
             logger.error(f"catch_up_backlog(): Invalid JSON in backlog: {e}")
-            logger.error(f"    backlog['{unique_id.decode()}'] = '{user_input_json.decode()}'")
+            logger.error(f"    backlog[{seq}] = '{user_input_json}'")
+            self.backlog.remove(seq)
+            self.backlog.sync()
             self.time_next_backlog = now + 1
-            return
+            return False
+
+        self._ensure_event_id(seq, user_input)
+
+        # The interruption of network connectivity that caused the original transmission
+        # to fail might still persist. If so, the circuit breaker lets only occasional
+        # probes through, at increasing intervals.
+        if not self.breaker.allow_request(now):
+            self.time_next_backlog = self.breaker.time_next_attempt
+            return False
 
-        # Actually re-send old user input from the backlog.
-        # Note that the interruption of network connectivity that caused the original
-        # transmission to fail might still persist and thus cause new transmissions to
-        # fail as well. Therefore, don't send items in the backlog in an overly quick
-        # succession: They would just get reinserted.
-        self.time_next_backlog = now + 2*REQUEST_TIMEOUT
+        # Actually re-send old user input from the backlog. The entry is only removed
+        # from the backlog when the server has acknowledged it, see `on_server_reply()`.
+        self.backlog.lease([seq], now + LEASE_DURATION)
 
         logger.info(f"catch_up_backlog():")
         logger.info(f"    {user_input = }")
 
-        start_thread(post_stamp_event, (user_input,), self.on_server_reply)
+        self.drainer.on_replay_sent(now)
+        # Nobody is waiting for this reply, so we can afford to wait for a slow server.
+        self._submit_post(user_input, functools.partial(self.on_server_reply, backlog_seq=seq), REPLAY_TIMEOUT)
+        return True
 
-    def on_server_reply(self, user_input, result, network_error):
+    def catch_up_backlog_batch(self, max_entries):
+        """
+        Like `catch_up_backlog()`, but re-sends up to `max_entries` entries of the backlog
+        in a single request. Returns `True` if a batch was sent.
+        """
+        now = self.clock.time()
+        if now < self.time_next_backlog:
+            return False
+
+        seqs = []
+        user_inputs = []
+
+        for seq, time_added, user_input_json in self.backlog.get_available(max_entries, now):
+            try:
+                user_input = json.loads(user_input_json)
+            except json.JSONDecodeError as e:
+                logger.error(f"catch_up_backlog_batch(): Invalid JSON in backlog: {e}")
+                logger.error(f"    backlog[{seq}] = '{user_input_json}'")
+                self.backlog.remove(seq)
+                continue
+
+            self._ensure_event_id(seq, user_input)
+            user_inputs.append(user_input)
+            seqs.append(seq)
+
+        if not user_inputs:
+            self.backlog.sync()
+            return False
+
+        if not self.breaker.allow_request(now):
+            self.backlog.sync()
+            self.time_next_backlog = self.breaker.time_next_attempt
+            return False
+
+        self.backlog.sync()
+        self.backlog.lease(seqs, now + LEASE_DURATION)
+
+        logger.info(f"catch_up_backlog_batch(): Re-sending {len(user_inputs)} entries.")
+
+        self.drainer.on_replay_sent(now)
+        callback = functools.partial(self.on_batch_reply, seqs)
+        on_error = lambda message: (user_inputs, [], message, False, False)
+        if not self.worker_pool.submit(post_stamp_events, (user_inputs, self.session_pool, REPLAY_TIMEOUT), callback, on_error):
+            thread_queue.put((callback, (user_inputs, [], "WorkerPool: Too many pending requests.", False, False)))
+        return True
+
+    def _ensure_event_id(self, seq, user_input):
+        """
+        Entries that were added to the backlog by earlier versions of this program have
+        no event ID. Give them one now, and store it so that it is kept in all further
+        attempts.
+        """
+        if 'event_id' not in user_input:
+            user_input['event_id'] = get_event_id()
+            self.backlog.update(seq, json.dumps(user_input))
+            self.backlog.sync()
+
+    def on_batch_reply(self, seqs, user_inputs, results, network_error, batch_unsupported, was_sent=True):
+        """
+        A thread that was running `post_stamp_events()` has finished with a reply or an error.
+
+        `seqs` are the sequence numbers of the leased backlog entries in `user_inputs`.
+        `was_sent` is `False` if the batch failed locally, e.g. because the worker pool was
+        full, see `on_server_reply()`.
+        """
+        logger.info(f"on_batch_reply():")
+        logger.info(f"    {len(user_inputs)} entries, {network_error = }")
+
+        now = self.clock.time()
+
+        if batch_unsupported:
+            # The server is reachable, but we must re-send the entries one by one.
+            logger.warning("on_batch_reply(): The server does not support batches, re-sending single entries.")
+            self.batch_supported = False
+            self.breaker.record_success()
+            for seq in seqs:
+                self.backlog.release(seq)
+            self.drainer.on_replay_done(now, True, 0)
+            return
+
+        if not was_sent:
+            self.breaker.record_cancelled()
+            results = [None] * len(user_inputs)
+        elif network_error:
+            self.breaker.record_failure(now)
+            metrics.inc('lost_network_errors_total', {'type': get_error_class(network_error)})
+            results = [None] * len(user_inputs)
+        else:
+            self.batch_supported = True
+            self.breaker.record_success()
+
+        num_failed = 0
+        for seq, user_input, result in zip(seqs, user_inputs, results):
+            if result is None:
+                # The entry was not processed, so it stays in the backlog.
+                num_failed += 1
+                user_input['backlog_count'] += 1
+                self.backlog.release(seq, json.dumps(user_input))
+            else:
+                self.backlog.ack(seq)
+
+        self.backlog.sync()
+        if num_failed:
+            logger.info(f"    --> {num_failed} entries remain in the backlog")
+
+        if network_error:
+            self.time_next_backlog = self.breaker.time_next_attempt
+
+        self.drainer.on_replay_done(now, not network_error, len(user_inputs) - num_failed)
+
+    def _submit_post(self, user_input, callback=None, timeout=None, trace_id=None):
+        """
+        Has `post_stamp_event()` run in a worker thread, by default with `on_server_reply()`
+        as the callback and with the timeouts for live requests.
+
+        Only the latencies of live requests are recorded: The timeouts of the replays are
+        much longer, and their latencies would stretch the timeouts of the live requests.
+        """
+        callback = callback or self.on_server_reply
+        latency_tracker = None
+        if timeout is None:
+            timeout = self.latency.get_timeouts()
+            latency_tracker = self.latency
+        action = traced(trace_id, post_stamp_event)
+        # If the action raises or is dropped, the reply is handled like a network error,
+        # but as the request never reached the server, not as a failure of the connection.
+        on_error = lambda message: (user_input, {}, message, False)
+        if self.worker_pool.submit(action, (user_input, self.session_pool, timeout, latency_tracker), callback, on_error):
+            return
+
+        # All workers are busy and the queue is full. Handle this like a network error
+        # so that the user input gets into the backlog. The reply is passed through the
+        # `thread_queue` (rather than calling `on_server_reply()` directly) so that the
+        # caller can finish its own work before the terminal is updated.
+        thread_queue.put((callback, (user_input, {}, "WorkerPool: Too many pending requests.", False)))
+
+    def on_server_reply(self, user_input, result, network_error, was_sent=True, backlog_seq=None, trace_id=None, terminal=None):
         """
         A thread that was running `requests.post()` has finished with a reply or an error.
+
+        `was_sent` is `False` if the user input was not sent in the first place, e.g.
+        because the circuit breaker was open or the worker pool was full. Such errors are
+        not counted as failures of the connection.
+
+        `backlog_seq` is the sequence number of the leased backlog entry if the user input
+        was re-sent from the backlog.
+
+        `trace_id` is the ID of the `Tracer` trace of live user input, or `None`.
+
+        `terminal` is the terminal that the live user input was made at, by default the
+        terminal of this handler.
         """
+        tracer.mark(trace_id, 'reply_queue')
         logger.info(f"on_server_reply():")
         logger.info(f"    {user_input = }")
         logger.info(f"    {network_error = }")
         logger.info(f"    {result = }")
 
+        if backlog_seq is None and user_input.get('event_id') in self.expired_live:
+            # The user input was put into the backlog when its reply was overdue, and the
+            # request was given up as cancelled. The backlog entry takes care of it now.
+            self.expired_live.discard(user_input['event_id'])
+            logger.info(f"    --> ignoring the late reply, event {user_input['event_id']} is in the backlog")
+            tracer.discard(trace_id)
+            return
+
         was_backlogged = (user_input['backlog_count'] > 0)
+        now = self.clock.time()
+
+        # Live user input that was submitted and re-sent backlog entries have been let
+        # through by the circuit breaker, unlike live user input that it held back.
+        time_sent, _ = self.live_in_flight.pop(user_input.get('event_id'), (None, None))
+        was_let_through = time_sent is not None or backlog_seq is not None
+
+        if was_sent:
+            if network_error:
+                self.breaker.record_failure(now)
+                metrics.inc('lost_network_errors_total', {'type': get_error_class(network_error)})
+            else:
+                self.breaker.record_success()
+
+            if time_sent is not None:
+                outcome = 'error' if network_error else 'ok'
+                metrics.observe('lost_live_send_seconds', self.clock.monotonic() - time_sent, {'outcome': outcome})
+        elif was_let_through:
+            self.breaker.record_cancelled()
 
         if network_error:
             # Something went wrong with the network transmission. For example, the network
@@ -178,14 +857,16 @@ class NetworkHandler:
 
             user_input['backlog_count'] += 1
 
-            now = get_time_time()
-            unique_id = str(now)
             user_input_json = json.dumps(user_input)
-            logger.info(f"    --> backlog['{unique_id}'] = '{user_input_json}'")
-
-            self.backlog[unique_id] = user_input_json
+            if backlog_seq is None:
+                seq = self.backlog.append(user_input_json, now)
+            else:
+                # Keep the entry in its place in the backlog.
+                seq = backlog_seq
+                self.backlog.release(seq, user_input_json)
             self.backlog.sync()
-            self.time_next_backlog = now + 300.0
+            logger.info(f"    --> backlog[{seq}] = '{user_input_json}'")
+            self.time_next_backlog = self.breaker.time_next_attempt
 
             result = {
                 'errors': [
@@ -196,11 +877,27 @@ class NetworkHandler:
                 'detail_info': network_error,
             }
 
+        elif backlog_seq is not None:
+            # The server has received the entry, so it can finally be removed from the backlog.
+            self.backlog.ack(backlog_seq)
+            self.backlog.sync()
+
         if was_backlogged:
             # This is the reply to user input that was re-sent from the backlog.
             # No matter if it was now a success or another failure: the user has long left
             # and no one is watching the terminal's screen, so don't bother updating it.
             logger.info(f"    --> not updating the terminal")
+            self.drainer.on_replay_done(now, not network_error)
             return
 
-        self.terminal.on_server_reply_received(result)
+        if time_sent is not None:
+            self.num_live_in_flight = max(self.num_live_in_flight - 1, 0)
+
+        (terminal or self.terminal).on_server_reply_received(result)
+        tracer.mark(trace_id, 'terminal')
+        tracer.finish(trace_id, wait_for_render=True)
+
+        if not network_error and len(self.backlog) > 0:
+            # The connection works (again), so start catching up with the backlog now.
+            self.time_next_backlog = now
+            self.drainer.drain()
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger("lost.observers")
+
+# The time in seconds that an observer may take to update to the model, see `call_observer()`.
+# Observers that are called in the main thread must be quick, or they freeze the GUI.
+SYNC_OBSERVER_BUDGET = 0.05
+ASYNC_OBSERVER_BUDGET = 0.5
+
+
+def get_observer_name(obs):
+    return getattr(obs, 'name', None) or type(obs).__name__
+
+
+def call_observer(obs, terminal, changed, budget, name=None):
+    """
+    Calls `obs.update_to_model(terminal, changed)` and logs a warning if the call took
+    longer than `budget` seconds. Returns the duration of the call.
+    """
+    time_started = time.monotonic()
+    obs.update_to_model(terminal, changed)
+    duration = time.monotonic() - time_started
+
+    if budget is not None and duration > budget:
+        logger.warning(f"Observer {name or get_observer_name(obs)} took {duration * 1000.0:.1f} ms, exceeding its budget of {budget * 1000.0:.1f} ms.")
+
+    return duration
+
+
+def merge_changed(a, b):
+    # `None` means that all fields are to be considered as changed.
+    if a is None or b is None:
+        return None
+    return a | b
+
+
+class AsyncObserver:
+    """
+    Runs another observer of the terminal in a worker thread of its own.
+
+    The GUI must be updated in the main thread, but other observers, e.g. LEDs or a
+    buzzer at the GPIO pins, a door opener or a state logger, may be slow, and must not
+    freeze the GUI. Wrapped in an `AsyncObserver`, their `update_to_model()` is called
+    in the worker thread instead.
+
+    The queue to the worker holds only the latest state of the terminal: If the wrapped
+    observer is still busy with an earlier state when the terminal changes again, the
+    pending state is replaced by the new one and the sets of changed fields are merged.
+    Thus, a slow observer skips intermediate states, but never falls further behind than
+    one update, and always ends with the current state.
+
+    As the terminal is modified in the main thread, the wrapped observer is not passed
+    the terminal itself, but a snapshot of its fields (see `BaseTerminal.get_snapshot()`).
+    """
+
+    def __init__(self, observer, budget=ASYNC_OBSERVER_BUDGET, name=None):
+        self.observer = observer
+        self.budget = budget
+        self.name = name or get_observer_name(observer)
+        self.cond = threading.Condition()
+        self.pending = None
+        self.is_stopping = False
+        self.num_updates = 0
+        self.num_coalesced = 0
+
+        self.thread = threading.Thread(target=self._run, name=f"observer-{self.name}", daemon=True)
+        self.thread.start()
+
+    def update_to_model(self, terminal, changed=None):
+        snapshot = terminal.get_snapshot()
+
+        with self.cond:
+            if self.pending is not None:
+                changed = merge_changed(self.pending[1], changed)
+                self.num_coalesced += 1
+            self.pending = (snapshot, changed)
+            self.cond.notify()
+
+    def stop(self, wait=True):
+        """Lets the worker finish the pending update, then stops it."""
+        with self.cond:
+            self.is_stopping = True
+            self.cond.notify()
+
+        if wait:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.is_stopping:
+                    self.cond.wait()
+
+                if self.pending is None:
+                    break
+
+                snapshot, changed = self.pending
+                self.pending = None
+
+            try:
+                call_observer(self.observer, snapshot, changed, self.budget, self.name)
+            except Exception:
+                # An exception must not end the worker thread.
+                logger.exception(f"AsyncObserver: {self.name} raised an exception.")
+
+            self.num_updates += 1
@@ -0,0 +1,205 @@
+from collections import deque
+import heapq
+import itertools
+import logging
+import math
+import time
+
+
+logger = logging.getLogger("lost.scheduler")
+STATS_WINDOW = 60.0
+
+
+class Task:
+    """A periodic or one-shot task of the `Scheduler`."""
+
+    def __init__(self, name, func, interval, group):
+        self.name = name
+        self.func = func
+        self.interval = interval    # `None` for one-shot tasks
+        self.group = group
+        self.deadline = None
+        self.is_cancelled = False
+        self.is_suspended = False
+
+
+class Scheduler:
+    """
+    A single place for all timers of the program.
+
+    Instead of each widget or subsystem running its own `after()` loop, they register
+    periodic or one-shot tasks here. The tasks are kept in a heap ordered by their next
+    deadline, so that a single timer suffices to wake up the program when the earliest
+    task is due (see `TkDriver`). Tasks that are due at the same time share the wakeup.
+
+    Tasks can be registered with a `group`, e.g. the frame that they update. While a
+    group is suspended, e.g. because the frame is hidden, its tasks are not run. When the
+    group is resumed, its periodic tasks run right away and then continue as before.
+
+    For each task name, the number of runs in the last minute is kept, so that we can
+    see how many wakeups each subscriber costs.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+        self.suspended_groups = set()
+        self.suspended_tasks = []
+        self.run_times = {}
+        self.wakeup_times = deque()
+
+        # Called whenever the earliest deadline may have changed, see `TkDriver`.
+        self.on_change = None
+        # Called at each wakeup with how late the earliest due task is run, e.g. for the metrics.
+        self.on_lag = None
+
+    def add_periodic(self, name, interval, func, group=None, run_now=True):
+        """Has `func()` run every `interval` seconds, by default starting right away."""
+        task = Task(name, func, interval, group)
+        self._schedule(task, self.clock() if run_now else self.clock() + interval)
+        return task
+
+    def add_oneshot(self, name, delay, func, group=None):
+        """Has `func()` run once after `delay` seconds."""
+        task = Task(name, func, None, group)
+        self._schedule(task, self.clock() + delay)
+        return task
+
+    def cancel(self, task):
+        # The task is only removed from the heap when it is due.
+        task.is_cancelled = True
+
+    def suspend(self, group):
+        self.suspended_groups.add(group)
+
+    def resume(self, group):
+        if group not in self.suspended_groups:
+            return
+
+        self.suspended_groups.discard(group)
+        now = self.clock()
+
+        for task in [task for task in self.suspended_tasks if task.group == group]:
+            self.suspended_tasks.remove(task)
+            task.is_suspended = False
+            if not task.is_cancelled:
+                self._schedule(task, now)
+
+    def get_next_deadline(self):
+        """Returns the deadline of the earliest task, or `None` if there are no tasks."""
+        while self.heap and self.heap[0][2].is_cancelled:
+            heapq.heappop(self.heap)
+
+        return self.heap[0][0] if self.heap else None
+
+    def run_due(self):
+        """Runs all tasks that are due. Returns the number of tasks that were run."""
+        now = self.clock()
+        count = 0
+
+        if self.on_lag:
+            deadline = self.get_next_deadline()
+            if deadline is not None and deadline <= now:
+                self.on_lag(now - deadline)
+
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, task = heapq.heappop(self.heap)
+
+            if task.is_cancelled:
+                continue
+
+            if task.group in self.suspended_groups:
+                task.is_suspended = True
+                self.suspended_tasks.append(task)
+                continue
+
+            if task.interval is not None:
+                # Schedule the next run before this one, as `func()` might cancel the task.
+                # If we fell behind, e.g. because the system was busy, skip the missed runs.
+                next_deadline = deadline + task.interval
+                if next_deadline <= now:
+                    next_deadline += (math.floor((now - next_deadline) / task.interval) + 1) * task.interval
+                task.deadline = next_deadline
+                heapq.heappush(self.heap, (next_deadline, next(self.counter), task))
+
+            self._record_run(task.name, now)
+            count += 1
+
+            try:
+                task.func()
+            except Exception:
+                logger.exception(f"Scheduler: Task {task.name} raised an exception.")
+                if task.interval is not None:
+                    task.is_cancelled = True
+
+        if count:
+            self.wakeup_times.append(now)
+            self._expire_stats(now)
+
+        return count
+
+    def get_wakeups_per_minute(self):
+        """
+        Returns the total number of wakeups in the last minute and a dict with the
+        number of runs in the last minute for each task name.
+        """
+        self._expire_stats(self.clock())
+        return len(self.wakeup_times), {name: len(times) for name, times in self.run_times.items() if times}
+
+    def _schedule(self, task, deadline):
+        task.deadline = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), task))
+        if self.on_change:
+            self.on_change()
+
+    def _record_run(self, name, now):
+        self.run_times.setdefault(name, deque()).append(now)
+
+    def _expire_stats(self, now):
+        for times in itertools.chain((self.wakeup_times,), self.run_times.values()):
+            while times and times[0] <= now - STATS_WINDOW:
+                times.popleft()
+
+
+class TkDriver:
+    """
+    Drives a `Scheduler` with a single Tk timer.
+
+    The timer is always set for the earliest deadline of the scheduler, so that the
+    program sleeps while no task is due.
+    """
+
+    def __init__(self, widget, scheduler):
+        self.widget = widget
+        self.scheduler = scheduler
+        self.timer_id = None
+        self.timer_deadline = None
+
+        scheduler.on_change = self.update_timer
+        self.update_timer()
+
+    def update_timer(self):
+        deadline = self.scheduler.get_next_deadline()
+        if deadline == self.timer_deadline:
+            return
+
+        if self.timer_id is not None:
+            self.widget.after_cancel(self.timer_id)
+            self.timer_id = None
+
+        self.timer_deadline = deadline
+        if deadline is None:
+            return
+
+        delay_ms = max(math.ceil((deadline - self.scheduler.clock()) * 1000.0), 0)
+        self.timer_id = self.widget.after(delay_ms, self.on_timer)
+
+    def on_timer(self):
+        self.timer_id = None
+        self.timer_deadline = None
+        self.scheduler.run_due()
+        self.update_timer()
+
+
+scheduler = Scheduler()
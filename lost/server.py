@@ -1,12 +1,160 @@
 #!/usr/bin/env python
-import json, threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import argparse, json, math, random, threading, time
+from collections import Counter, OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from time import sleep
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, urlsplit
+
+from lost.event_store import EventStore
+
+
+class EventIndex:
+    """
+    Remembers the replies to the most recently processed stamp events by their event ID.
+
+    Clients re-send an event if they didn't get the reply to an earlier attempt, but the
+    server may well have processed the event before. Therefore, a known event is not
+    processed again, but the original reply is returned. In order to bound the memory
+    that is used, only the last `max_size` events are remembered.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.replies = OrderedDict()
+        self.num_duplicates = 0
+        # Used by the request handlers, which may run in several threads.
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.replies.clear()
+            self.num_duplicates = 0
+
+    def get_or_add(self, event_id, make_reply):
+        """
+        Returns the reply to the event with the given ID. If the event is not known,
+        `make_reply()` is called to process it and its result is returned and kept.
+        """
+        with self.lock:
+            if event_id in self.replies:
+                self.num_duplicates += 1
+                return self.replies[event_id]
+
+            reply = make_reply()
+            self.replies[event_id] = reply
+            if len(self.replies) > self.max_size:
+                self.replies.popitem(last=False)
+            return reply
+
+
+class FaultProfile:
+    """
+    Scripted faults with which the built-in server mimics a slow or failing Lori server.
+
+    This way, the behavior of the clients, e.g. the timeouts, the backlog and its recovery
+    or the connection pooling, can be examined locally and repeatably. All times are in
+    seconds since the server was started (see `start()`):
+
+      - `latency`      the delay of each reply, a dict like `{'distribution': 'fixed',
+                       'seconds': 0.1}`, `{'distribution': 'uniform', 'min': 0.05, 'max': 0.5}`
+                       or `{'distribution': 'lognormal', 'median': 0.1, 'sigma': 0.5}`,
+      - `outages`      a list of `[start, end]` windows in which connections are closed
+                       before the request is read, as if the server was unreachable,
+      - `drop_rate`    the probability that a request is processed, but the connection is
+                       then closed without a reply, like with the `/timeout/` path,
+      - `error_bursts` a list of `[start, end, status]` windows in which all requests are
+                       answered with the HTTP `status`, e.g. 503,
+      - `error_rate`   the probability that a request is answered with a 500 otherwise.
+
+    `counts` keeps the number of requests that were affected by each kind of fault.
+    """
+
+    def __init__(self, latency=None, outages=(), drop_rate=0.0, error_bursts=(), error_rate=0.0, seed=None, clock=time.monotonic):
+        self.latency = latency
+        self.outages = outages
+        self.drop_rate = drop_rate
+        self.error_bursts = error_bursts
+        self.error_rate = error_rate
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.time_started = clock()
+        self.counts = Counter()
+        # Used by the request handlers, which may run in several threads.
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def start(self):
+        self.time_started = self.clock()
+
+    def get_fault(self):
+        """
+        Returns the fault for the current request and the delay of its reply. The fault is
+        one of `None`, `'outage'`, `'drop'` or the HTTP status of an error reply.
+        """
+        with self.lock:
+            now = self.clock() - self.time_started
+            fault = None
+
+            if any(start <= now < end for start, end in self.outages):
+                fault = 'outage'
+            elif self.random.random() < self.drop_rate:
+                fault = 'drop'
+            else:
+                for start, end, status in self.error_bursts:
+                    if start <= now < end:
+                        fault = status
+                        break
+                else:
+                    if self.random.random() < self.error_rate:
+                        fault = 500
+
+            self.counts[fault or 'none'] += 1
+            return fault, self._get_delay()
+
+    def _get_delay(self):
+        if not self.latency:
+            return 0.0
+
+        dist = self.latency['distribution']
+        if dist == 'fixed':
+            return self.latency['seconds']
+        if dist == 'uniform':
+            return self.random.uniform(self.latency['min'], self.latency['max'])
+        if dist == 'lognormal':
+            return self.random.lognormvariate(math.log(self.latency['median']), self.latency['sigma'])
+        raise ValueError(f"Unknown latency distribution {dist!r}.")
+
+
+def process_event(data):
+    """Processes a single stamp event and returns the reply."""
+    # Instead of actually booking the event, just echo the received data.
+    reply = dict(data)
+    reply['echo_server_note'] = "This reply is an echo of the received data, plus this message."
+    return reply
+
+
+SUBMIT_PATHS = ("/stempeluhr/event/submit/", "/stempeluhr/event/submit-batch/")
+EVENTS_PATH = "/stempeluhr/events/"
 
 
 class LoriRequestHandler(BaseHTTPRequestHandler):
 
+    # Keep the connections alive, as the `SessionPool` of the clients expects.
+    # This requires that each reply has a "Content-Length" header.
+    protocol_version = "HTTP/1.1"
+    # The headers and the body of a reply are sent separately. Without this, on a kept-alive
+    # connection, the body waits for the client's delayed ACK of the headers, about 40 ms.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Overrides the method in the parent class.
+        super().setup()
+        with self.server.stats_lock:
+            self.server.num_connections += 1
+
     def log_request(self, code='-', size='-'):
         # This method overrides the method in the base class in order to silence it:
         # As we're using this server mainly for the test cases, the output would just
@@ -19,6 +167,24 @@ class LoriRequestHandler(BaseHTTPRequestHandler):
         # `log_request()`.
         pass
 
+    def process_event_once(self, data):
+        """Like `process_event()`, but doesn't process events with a known event ID again."""
+        event_id = data.get('event_id')
+        if not event_id:
+            # Clients of earlier versions don't send event IDs.
+            return process_event(data)
+
+        return self.server.event_index.get_or_add(event_id, lambda: process_event(data))
+
+    def store_events(self, events):
+        """Persists the events, if the server has an `EventStore`, before they are replied to."""
+        if self.server.event_store is not None:
+            self.server.event_store.add_many(events)
+
+    def read_body(self):
+        l = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(l)
+
     def send_json(self, content):
         body = json.dumps(content).encode('utf-8')
         self.send_response(200)
@@ -28,23 +194,66 @@ class LoriRequestHandler(BaseHTTPRequestHandler):
         self.wfile.write(body)
 
     def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == EVENTS_PATH:
+            self.query_events(parse_qs(url.query))
+            return
+
         print(f"{self.command = },\n{self.path = },\n{self.headers.items() = }")
 
+        body = b"<h1>Hello!</h1>"
+        body += bytes("<p>This is a test server for the LoST application.<br>", "utf8")
+        body += bytes("It replies to POST requests that LoST normally directs to a live Lori server.</p>", "utf8")
+        body += bytes(f"<p>This was a GET request to {self.path}</p>", "utf8")
+
         self.send_response(200)
         self.send_header("Content-type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(b"<h1>Hello!</h1>")
-        self.wfile.write(bytes("<p>This is a test server for the LoST application.<br>", "utf8"))
-        self.wfile.write(bytes("It replies to POST requests that LoST normally directs to a live Lori server.</p>", "utf8"))
-        self.wfile.write(bytes(f"<p>This was a GET request to {self.path}</p>", "utf8"))
+        self.wfile.write(body)
+
+    def query_events(self, query):
+        """
+        Replies with a page of the stored events, e.g. for a GET request to
+
+            /stempeluhr/events/?smartcard_id=...&since=2022-04-02&until=2022-04-03&limit=100
+
+        The reply is `{"events": [...], "next": after}`, where the events of the next page
+        are requested by adding `&after=...` to the query, until `next` is `null`.
+        """
+        if self.server.event_store is None:
+            self.send_error(404)
+            return
+
+        params = {key: value[0] for key, value in query.items()}
+        try:
+            after = int(params.get('after', 0))
+            limit = int(params.get('limit', 100))
+        except ValueError:
+            self.send_error(400)
+            return
+
+        events, next_after = self.server.event_store.query(
+            smartcard_id=params.get('smartcard_id'),
+            since=params.get('since'),
+            until=params.get('until'),
+            after=after,
+            limit=limit,
+        )
+        self.send_json({'events': events, 'next': next_after})
 
     def do_POST(self):
         # print(f"{self.command = },\n{self.path = },\n{self.headers.items() = }")
 
+        if self.path not in SUBMIT_PATHS:
+            # The body is not needed, but it must be read in order to keep the connection alive.
+            self.read_body()
+
         if self.path == "/old/path/now/redirected/":
             # Clients can call this in order to test redirection.
             self.send_response(301)
             self.send_header('Location', f'http://{self.server.server_name}:{self.server.server_port}/redirect-goal/')
+            self.send_header("Content-Length", "0")
             self.end_headers()
             return
 
@@ -58,36 +267,86 @@ class LoriRequestHandler(BaseHTTPRequestHandler):
             sleep(0.1)
             # The client is no longer listening. Sending something now would yield a `BrokenPipeError`.
             # self.send_json({'error': "The client should timeout before it gets this!"})
+            self.close_connection = True
             return
 
         if self.path == "/non-json-reply/":
             # An improperly configured client might call a URL at which it gets a reply that is not JSON.
+            body = b'<h1>Hello, world!</h1><p>This is HTML, not JSON.</p>'
             self.send_response(200)
             self.send_header("Content-type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(b'<h1>Hello, world!</h1><p>This is HTML, not JSON.</p>')
+            self.wfile.write(body)
             return
 
-        if self.path != "/stempeluhr/event/submit/":
+        if self.path not in SUBMIT_PATHS:
             # An improperly configured client might call a URL that does not exist.
             self.send_error(404)
             return
 
+        fault, delay = self.server.fault_profile.get_fault() if self.server.fault_profile else (None, 0.0)
+
+        if fault == 'outage':
+            # Pretend that the server cannot be reached: Close the connection without a reply.
+            self.close_connection = True
+            return
+
         # Technically, all is well: the client got through to the Lori server.
-        l = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(l)
-        rawd = parse_qs(body.decode())
-        data = {key: value[0] for key, value in rawd.items()}
-        # print(data)
+        body = self.read_body()
+        sleep(delay)
 
-        # self.send_json({'success': "Hello from Lori!"})
-        data['echo_server_note'] = "This reply is an echo of the received data, plus this message."
-        self.send_json(data)    # reply with echo
-        return
+        if fault not in (None, 'drop'):
+            self.send_error(fault)
+            return
+
+        if self.path == "/stempeluhr/event/submit-batch/":
+            # The client submits several events at once, e.g. when catching up with its backlog.
+            try:
+                batch = json.loads(body)
+                events = batch['events']
+                common = {'terminal_name': batch['terminal_name'], 'terminal_pwd': batch['terminal_pwd']}
+                if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+                    raise TypeError("The events must be a list of objects.")
+                events = [dict(event, **common) for event in events]
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400)
+                return
 
+            # All events of the batch are stored in a single transaction.
+            self.store_events(events)
+            reply = {'results': [self.process_event_once(event) for event in events]}
+        else:
+            rawd = parse_qs(body.decode())
+            data = {key: value[0] for key, value in rawd.items()}
+            self.store_events([data])
+            reply = self.process_event_once(data)   # reply with echo
+
+        if fault == 'drop':
+            # The event was processed, but the reply is lost, e.g. in a flaky network.
+            self.close_connection = True
+            return
 
-def start_testserver(port=8000):
-    httpd = HTTPServer(('localhost', port), LoriRequestHandler)
+        self.send_json(reply)
+
+
+def start_testserver(port=8000, fault_profile=None, event_store=None):
+    """
+    Starts the built-in server in a background thread and returns it.
+
+    Each connection is handled in a thread of its own, so that slow requests, e.g. with
+    the latencies of a `fault_profile`, don't hold up the others. If an `event_store` is
+    given, the received events are kept in it and can be queried.
+    """
+    httpd = ThreadingHTTPServer(('localhost', port), LoriRequestHandler)
+    httpd.event_index = EventIndex()
+    httpd.fault_profile = fault_profile
+    httpd.event_store = event_store
+    httpd.num_connections = 0
+    httpd.stats_lock = threading.Lock()
+
+    if fault_profile:
+        fault_profile.start()
 
     thread = threading.Thread(target=httpd.serve_forever)
     thread.start()
@@ -96,7 +355,19 @@ def start_testserver(port=8000):
 
 
 if __name__ == '__main__':
-    httpd = start_testserver()
+    parser = argparse.ArgumentParser(description="Runs the built-in server, a stand-in for the Lori server.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--faults', default=None, help="a JSON file with the fault profile, see `FaultProfile`")
+    parser.add_argument('--store', default=None, help="the SQLite file in which the received events are kept")
+    args = parser.parse_args()
+
+    fault_profile = None
+    if args.faults:
+        with open(args.faults) as f:
+            fault_profile = FaultProfile.from_dict(json.load(f))
+
+    event_store = EventStore(args.store) if args.store else None
+    httpd = start_testserver(args.port, fault_profile, event_store)
     print('Server started.')
 
     try:
@@ -107,4 +378,9 @@ if __name__ == '__main__':
 
     httpd.shutdown()
     httpd.server_close()
+    if event_store:
+        event_store.close()
     print("\nServer stopped.")
+
+    if fault_profile:
+        print(f"Faults: {dict(fault_profile.counts)}")
@@ -3,7 +3,9 @@ import logging
 from smartcard.CardMonitoring import CardMonitor, CardObserver
 from smartcard.util import toHexString
 
+from lost.metrics import metrics
 from lost.thread_tools import thread_queue
+from lost.tracing import tracer
 
 
 logger = logging.getLogger("lost.smartcard")
@@ -23,23 +25,70 @@ class SmartcardMonitor:
         self.cardobserver = None
         self.cardmonitor = None
 
-    def on_smartcard_input(self, response, success):
+    def get_terminal(self, reader):
+        """Returns the terminal that the smartcards read at `reader` belong to."""
+        return self.terminal
+
+    def on_smartcard_input(self, response, success, trace_id=None, reader=None):
         """
         This function is called when a smartcard has been read by the `LoSTCardObserver`.
         It is a callback that runs in the program's main thread.
+
+        `reader` is the name of the smartcard reader that the card was read at.
         """
+        tracer.mark(trace_id, 'card_queue')
+
         if not success:
             # Success or failure is already logged in the caller.
+            metrics.inc('lost_card_reads_total', {'result': 'failed'})
+            tracer.discard(trace_id)
             return
 
-        if not self.terminal.is_expecting_smartcard():
+        terminal = self.get_terminal(reader)
+        if not terminal.is_expecting_smartcard():
+            metrics.inc('lost_card_reads_total', {'result': 'ignored'})
+            tracer.discard(trace_id)
             return
 
+        metrics.inc('lost_card_reads_total', {'result': 'ok'})
+
         # Send the smartcard details in a POST request to the server.
         smartcard_id = toHexString(response)
 
-        self.network_handler.send_to_Lori(smartcard_id)
-        self.terminal.on_server_post_sent()
+        self.network_handler.send_to_Lori(smartcard_id, trace_id, terminal)
+        terminal.on_server_post_sent()
+
+
+class GatewayMonitor(SmartcardMonitor):
+    """
+    Monitors several smartcard readers that are connected to the same computer.
+
+    In gateway mode, e.g. at the loading docks, one computer serves several doors, each
+    with a smartcard reader of its own. Each reader gets a terminal of its own, so that
+    the readers don't interfere with each other, and the events are tagged with the name
+    of the reader (see `BaseTerminal.reader_name`). The terminals are made by calling
+    `make_terminal()` when a card is first read at a reader.
+
+    All terminals share the same network handler, and thus the same connections, backlog
+    and drain scheduler.
+    """
+
+    def __init__(self, make_terminal, network_handler):
+        self.make_terminal = make_terminal
+        self.terminals = {}
+        super().__init__(None, network_handler)
+
+    def get_terminal(self, reader):
+        # Overrides the method in the parent class.
+        terminal = self.terminals.get(reader)
+
+        if terminal is None:
+            logger.info(f"GatewayMonitor: Adding a terminal for reader {reader!r}.")
+            terminal = self.make_terminal()
+            terminal.reader_name = reader
+            self.terminals[reader] = terminal
+
+        return terminal
 
 
 # https://stackoverflow.com/questions/13051167/apdu-command-to-get-smart-card-uid
@@ -76,6 +125,9 @@ class LoSTCardObserver(CardObserver):
             if not card.atr:
                 continue
 
+            # Trace the time from here until the reply to this card is shown.
+            trace_id = tracer.start()
+
             # The ATR can be decoded at https://smartcard-atr.apdu.fr/
             logger.info(f'[💳] user inserted card "{toHexString(card.atr)}"')
 
@@ -83,6 +135,7 @@ class LoSTCardObserver(CardObserver):
             card.connection.connect()
             response, sw1, sw2 = card.connection.transmit(GET_UID)
             card.connection.disconnect()
+            tracer.mark(trace_id, 'apdu')
 
             success = sw1 in (0x90, 0x61)
             logger.log(
@@ -93,7 +146,7 @@ class LoSTCardObserver(CardObserver):
             # We are running in a worker thread of the `CardMonitor` here.
             # Thus, put the callback and the results into the queue, to be
             # picked up and processed in the main thread later.
-            thread_queue.put((self.callback, (response, success)))
+            thread_queue.put((self.callback, (response, success, trace_id, str(card.reader))))
 
         for card in removedCards:
             logger.info(f'[--] user removed card "{toHexString(card.atr)}"')
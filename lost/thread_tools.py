@@ -1,5 +1,8 @@
+import logging
+import os
 import queue
 import threading
+import time
 
 
 #
@@ -12,7 +15,86 @@ import threading
 #
 
 
-thread_queue = queue.Queue()
+logger = logging.getLogger("lost.threads")
+
+
+class WakeupQueue(queue.Queue):
+    """
+    A queue that, in addition to holding the items, signals a pipe whenever an item is put.
+
+    The main thread can register the read end of the pipe (see `fileno()`) with its event
+    loop, e.g. with Tk's `createfilehandler()`, and thus learn about new items right away
+    instead of polling the queue periodically.
+
+    For each item, the time between `put()` and `get()` is measured. As the main thread
+    dispatches the items immediately after it got them, this is the queue-to-dispatch
+    latency.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.wakeup_r = None
+        self.wakeup_w = None
+        self.latency_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        try:
+            r, w = os.pipe()
+            os.set_blocking(r, False)
+            os.set_blocking(w, False)
+            self.wakeup_r, self.wakeup_w = r, w
+        except OSError as e:
+            # Without the pipe, the queue must be polled.
+            logger.warning(f"WakeupQueue: Could not create the wakeup pipe: {e}")
+
+    def _put(self, item):
+        # Called by `put()` with the queue's mutex held.
+        self.queue.append((time.monotonic(), item))
+
+    def _get(self):
+        # Called by `get()` with the queue's mutex held.
+        time_put, item = self.queue.popleft()
+        latency = time.monotonic() - time_put
+        self.latency_count += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return item
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+
+        if self.wakeup_w is not None:
+            try:
+                os.write(self.wakeup_w, b'\0')
+            except BlockingIOError:
+                # The pipe is full, so the reader is going to wake up anyway.
+                pass
+
+    def fileno(self):
+        """Returns the file descriptor that becomes readable when items were put, or `None`."""
+        return self.wakeup_r
+
+    def clear_wakeup(self):
+        """Consumes all pending wakeup signals. To be called before the queue is emptied."""
+        if self.wakeup_r is None:
+            return
+
+        try:
+            while os.read(self.wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def get_latency_stats(self):
+        """Returns the number of dispatched items and their mean and max latency in seconds."""
+        with self.mutex:
+            count = self.latency_count
+            mean = self.latency_total / count if count else 0.0
+            return count, mean, self.latency_max
+
+
+thread_queue = WakeupQueue()
 
 
 def thread_wrapper(action, action_args, callback):
@@ -25,3 +107,170 @@ def thread_wrapper(action, action_args, callback):
 def start_thread(action, action_args, callback):
     thr = threading.Thread(target=thread_wrapper, args=(action, action_args, callback))
     thr.start()
+
+
+class WorkerPool:
+    """
+    A fixed number of worker threads that run actions submitted from the main thread.
+
+    This is the bounded alternative to `start_thread()`: Instead of starting a new thread
+    for each action, the actions are put into a queue of limited size from which the
+    workers pick them up. As with `start_thread()`, the result of each action is passed
+    to its callback by putting both into the `thread_queue`.
+
+    If the submission queue is full, the `rejection_policy` determines what happens:
+
+      - 'reject'       the new action is not queued and `submit()` returns `False`,
+      - 'drop_oldest'  the oldest queued action is discarded in favor of the new one.
+
+    If an action raises an exception or is dropped, its callback is still called, so that
+    the caller can clean up the state that it keeps for the pending action: `on_error` is
+    called with a message that describes the problem and must return the arguments for
+    the callback, just as the action would have. Without `on_error`, the problem is only
+    logged.
+
+    For each action, the time that it waited in the queue and the time that it took to
+    run is accumulated in `stats`.
+    """
+
+    def __init__(self, num_workers=2, max_queued=16, rejection_policy='reject', name="worker"):
+        assert rejection_policy in ('reject', 'drop_oldest')
+        self.rejection_policy = rejection_policy
+        self.tasks = queue.Queue(maxsize=max_queued)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'dropped': 0,
+            'completed': 0,
+            'failed': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'run_total': 0.0,
+            'run_max': 0.0,
+        }
+
+        self.workers = []
+        for nr in range(num_workers):
+            thr = threading.Thread(target=self._work, name=f"{name}-{nr}", daemon=True)
+            thr.start()
+            self.workers.append(thr)
+
+    def submit(self, action, action_args, callback, on_error=None):
+        """
+        Has `action(*action_args)` run in a worker thread and its result passed to
+        `callback` in the main thread. Returns `False` if the action was rejected.
+        """
+        task = (action, action_args, callback, on_error, time.monotonic())
+
+        try:
+            self.tasks.put(task, block=False)
+        except queue.Full:
+            if self.rejection_policy == 'reject':
+                self._count('rejected')
+                logger.warning(f"WorkerPool: The queue is full, rejecting {action.__name__}().")
+                return False
+
+            try:
+                dropped = self.tasks.get(block=False)
+                self._count('dropped')
+                logger.warning(f"WorkerPool: The queue is full, dropping the oldest {dropped[0].__name__}().")
+                self._report_error(dropped, f"WorkerPool: Dropped {dropped[0].__name__}(), the queue was full.")
+            except queue.Empty:
+                pass
+
+            try:
+                self.tasks.put(task, block=False)
+            except queue.Full:
+                self._count('rejected')
+                return False
+
+        self._count('submitted')
+        return True
+
+    def shutdown(self, wait=True):
+        """Lets the workers finish the queued actions, then stops them."""
+        for thr in self.workers:
+            self.tasks.put(None)
+
+        if wait:
+            for thr in self.workers:
+                thr.join()
+
+        self.workers = []
+
+    def get_stats(self):
+        with self.stats_lock:
+            return self.stats.copy()
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _report_error(self, task, message):
+        """Passes the error result of a task that failed or was dropped to its callback."""
+        action, action_args, callback, on_error, time_submitted = task
+        if on_error is None:
+            return
+
+        try:
+            thread_queue.put((callback, on_error(message)))
+        except Exception:
+            logger.exception(f"WorkerPool: The error handler of {action.__name__}() raised an exception.")
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+
+            action, action_args, callback, on_error, time_submitted = task
+            time_started = time.monotonic()
+
+            try:
+                result = action(*action_args)
+            except Exception as e:
+                # Unlike with `start_thread()`, an exception must not end the worker thread.
+                logger.exception(f"WorkerPool: {action.__name__}() raised an exception.")
+                self._count('failed')
+                self._report_error(task, f"WorkerPool: {action.__name__}() raised {e!r}")
+                continue
+
+            time_finished = time.monotonic()
+            thread_queue.put((callback, result))
+
+            wait = time_started - time_submitted
+            run = time_finished - time_started
+
+            with self.stats_lock:
+                self.stats['completed'] += 1
+                self.stats['wait_total'] += wait
+                self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+                self.stats['run_total'] += run
+                self.stats['run_max'] = max(self.stats['run_max'], run)
+
+
+class InlineWorkerPool:
+    """
+    A stand-in for the `WorkerPool` that runs each action right away in the calling thread.
+
+    As with the `WorkerPool`, the result of the action is passed to its callback by putting
+    both into the `thread_queue`, so the callback still runs later, when the main thread
+    handles the queue. Together with the `VirtualClock`, this makes tests deterministic:
+    No request is still underway in another thread while the virtual time advances.
+    """
+
+    def submit(self, action, action_args, callback, on_error=None):
+        try:
+            result = action(*action_args)
+        except Exception as e:
+            logger.exception(f"InlineWorkerPool: {action.__name__}() raised an exception.")
+            if on_error is not None:
+                thread_queue.put((callback, on_error(f"WorkerPool: {action.__name__}() raised {e!r}")))
+            return True
+
+        thread_queue.put((callback, result))
+        return True
+
+    def shutdown(self, wait=True):
+        pass
@@ -0,0 +1,223 @@
+from collections import deque, OrderedDict
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger("lost.tracing")
+
+# The upper bounds of the histogram buckets in milliseconds.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """A latency histogram with fixed buckets, see `BUCKET_BOUNDS_MS`."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000.0
+        nr = 0
+        while nr < len(BUCKET_BOUNDS_MS) and ms > BUCKET_BOUNDS_MS[nr]:
+            nr += 1
+        self.counts[nr] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        buckets = {f"<={bound}": count for bound, count in zip(BUCKET_BOUNDS_MS, self.counts)}
+        buckets[f">{BUCKET_BOUNDS_MS[-1]}"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000.0, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000.0, 3),
+            'buckets_ms': buckets,
+        }
+
+
+class Trace:
+    """The stages that a single tap of a smartcard has passed so far."""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.time_started = time.monotonic()
+        self.time_last_mark = self.time_started
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.monotonic()
+        self.stages.append((stage, now - self.time_last_mark))
+        self.time_last_mark = now
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'total_ms': round((self.time_last_mark - self.time_started) * 1000.0, 3),
+            'stages_ms': [(stage, round(duration * 1000.0, 3)) for stage, duration in self.stages],
+        }
+
+
+class Tracer:
+    """
+    Measures where the time goes between reading a smartcard and showing the reply.
+
+    Each tap is given a trace ID by `start()` that is passed along with the event:
+    from the card observer's thread through the `thread_queue` to the main thread, to
+    the network handler, into the worker thread and back. At each step, `mark()` records
+    the time since the previous step as the duration of the named stage, e.g. 'apdu' for
+    reading the UID from the card or 'network' for the round-trip to the Lori server.
+
+    Completed traces are kept in a ring buffer of the last `max_traces` traces and are
+    summarized in a latency histogram per stage, which `export()` writes to a JSON file.
+    Traces that never complete, e.g. because the terminal didn't expect a smartcard, are
+    discarded, and at most `max_active` incomplete traces are kept.
+
+    As the marks are made in several threads, access is protected by a lock. All methods
+    accept `None` as the trace ID and ignore it, so that callers need not check whether
+    an event is traced.
+    """
+
+    def __init__(self, max_traces=200, max_active=50):
+        self.max_active = max_active
+        self.lock = threading.Lock()
+        self.active = OrderedDict()
+        self.completed = deque(maxlen=max_traces)
+        self.histograms = {}
+        self.next_id = 1
+        self.num_exported = 0
+
+        # If set, `finish(..., wait_for_render=True)` calls `render_hook(func)` with a
+        # function that completes the trace. The GUI sets this to Tk's `after_idle()`.
+        self.render_hook = None
+
+        # If set, `on_clock_tick()` exports the histograms to this file periodically.
+        self.export_path = None
+        self.export_interval = 60.0
+        self.time_last_export = time.monotonic()
+
+    def start(self):
+        """Starts a new trace and returns its ID."""
+        with self.lock:
+            trace_id = self.next_id
+            self.next_id += 1
+            self.active[trace_id] = Trace(trace_id)
+
+            if len(self.active) > self.max_active:
+                self.active.popitem(last=False)
+
+            return trace_id
+
+    def mark(self, trace_id, stage):
+        """Records the time since the previous mark as the duration of `stage`."""
+        if trace_id is None:
+            return
+
+        with self.lock:
+            trace = self.active.get(trace_id)
+            if trace is not None:
+                trace.mark(stage)
+
+    def discard(self, trace_id):
+        if trace_id is None:
+            return
+
+        with self.lock:
+            self.active.pop(trace_id, None)
+
+    def finish(self, trace_id, wait_for_render=False):
+        """
+        Completes the trace. With `wait_for_render=True`, the trace is completed only
+        after the GUI has been redrawn, and the time until then is the 'render' stage.
+        """
+        if trace_id is None:
+            return
+
+        if wait_for_render and self.render_hook:
+            self.render_hook(lambda: self._complete(trace_id, 'render'))
+        else:
+            self._complete(trace_id)
+
+    def _complete(self, trace_id, stage=None):
+        with self.lock:
+            trace = self.active.pop(trace_id, None)
+            if trace is None:
+                return
+
+            if stage:
+                trace.mark(stage)
+
+            self.completed.append(trace)
+            for stage, duration in trace.stages:
+                self.histograms.setdefault(stage, Histogram()).add(duration)
+            self.histograms.setdefault('total', Histogram()).add(trace.time_last_mark - trace.time_started)
+
+    def get_report(self):
+        """Returns the histograms and the recent traces as a dict that can be dumped as JSON."""
+        with self.lock:
+            return {
+                'bucket_bounds_ms': list(BUCKET_BOUNDS_MS),
+                'stages': {stage: hist.as_dict() for stage, hist in self.histograms.items()},
+                'recent_traces': [trace.as_dict() for trace in self.completed],
+            }
+
+    def export(self, path):
+        """Writes the report to the JSON file at `path`."""
+        report = self.get_report()
+        tmp_path = f"{path}.tmp"
+
+        # Write to a temporary file first, so that readers never see a partial file.
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+
+        self.num_exported = report['stages'].get('total', {}).get('count', 0)
+
+    def on_clock_tick(self):
+        """Called periodically in the main thread."""
+        if not self.export_path:
+            return
+
+        now = time.monotonic()
+        if now - self.time_last_export < self.export_interval:
+            return
+        self.time_last_export = now
+
+        with self.lock:
+            num_completed = self.histograms['total'].count if 'total' in self.histograms else 0
+
+        if num_completed == self.num_exported:
+            return
+
+        try:
+            self.export(self.export_path)
+        except OSError as e:
+            logger.warning(f"Tracer: Could not export the traces to {self.export_path}: {e}")
+
+
+def traced(trace_id, action):
+    """
+    Wraps `action` for running in a worker thread: The time until the worker picks it
+    up is recorded as the 'worker_wait' stage and the time for running it as 'network'.
+    """
+    if trace_id is None:
+        return action
+
+    @functools.wraps(action)
+    def wrapper(*args):
+        tracer.mark(trace_id, 'worker_wait')
+        result = action(*args)
+        tracer.mark(trace_id, 'network')
+        return result
+
+    return wrapper
+
+
+tracer = Tracer()
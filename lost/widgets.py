@@ -9,6 +9,7 @@ from tkinter import font as tkfont
 # from tkinter import ttk
 
 from lost import settings
+from lost.thread_tools import thread_queue
 
 
 logger = logging.getLogger("lost.gui")
@@ -79,6 +80,14 @@ def adjust_wraplength(event):
     event.widget.config(wraplength=event.widget.winfo_width())
 
 
+def is_changed(changed, *fields):
+    """
+    Returns whether any of the given fields is in the set of `changed` fields that an
+    observer got from the terminal. If `changed` is `None`, everything must be updated.
+    """
+    return changed is None or any(field in changed for field in fields)
+
+
 class TouchButton(Button):
 
     def __init__(self, parent, font_size=100, *args, **kwargs):
@@ -126,14 +135,14 @@ class TitleBar(Frame):
         self.bind('<Button-1>', self.on_LMB_click)
 
         if show_clock:
-            self.update_clock()
+            # The title bar is shown and hidden along with its parent frame.
+            self.winfo_toplevel().scheduler.add_periodic("TitleBar.update_clock", 1.0, self.update_clock, group=parent)
 
     def on_LMB_click(self, event):
         self.winfo_toplevel().terminal.set_state_welcome()
 
     def update_clock(self):
         self.clock.config(text=datetime.now().strftime("%H:%M"))
-        self.after(1000, self.update_clock)
 
 
 class PauseButtonsRow(Frame):
@@ -154,7 +163,10 @@ class PauseButtonsRow(Frame):
             btn.grid(row=0, column=nr, sticky="NESW")
             btn.bind('<Button-1>', self.on_LMB_click)
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
+        if not is_changed(changed, 'pause'):
+            return
+
         p_str = ''
         if terminal.pause is not None:
             p_str = f"{terminal.pause // 60}:{terminal.pause % 60:02}"
@@ -192,18 +204,18 @@ class WaitForServerFrame(Frame):
         self.rowconfigure(0, weight=1)
         self.msg_label = Label(self, text="", background='black', foreground='white')
         self.msg_label.grid(row=0, column=0)
-        self.timer_id = None
+        self.timer_task = None
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
         self.msg_label.config(text="")
-        if self.timer_id:
+        if self.timer_task:
             # The timer is always expected to expire before this function is called again.
             # Still, check if a timer is pending and cancel it explicitly, just in case.
-            self.after_cancel(self.timer_id)
-        self.timer_id = self.after(2000, self.update_message)
+            self.winfo_toplevel().scheduler.cancel(self.timer_task)
+        self.timer_task = self.winfo_toplevel().scheduler.add_oneshot("WaitForServerFrame.update_message", 2.0, self.update_message, group=self)
 
     def update_message(self):
-        self.timer_id = None
+        self.timer_task = None
         self.msg_label.config(text="Warte auf Antwort vom Lori-Server …")
 
 
@@ -348,7 +360,10 @@ class DisplayServerReplyFrame(Frame):
         ok_button = TouchButton(buttons_row, text="OK", command=self.on_click_OK)
         ok_button.grid(row=0, column=1, sticky="NESW")
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
+        if not is_changed(changed, 'last_server_reply'):
+            return
+
         lsr = terminal.last_server_reply
 
         self.body_grid.grid_remove()
@@ -435,9 +450,9 @@ class SystemPanelFrame(Frame):
         self.sysinfo_label.grid(row=2, rowspan=6, column=1, sticky="NESW", padx=(0, 10))
 
         self.time_updated = None
-        self.update_system_info()
+        self.winfo_toplevel().scheduler.add_periodic("SystemPanelFrame.update_system_info", 1.0, self.update_system_info, group=self)
 
-    def update_to_model(self, terminal):
+    def update_to_model(self, terminal, changed=None):
         self.time_updated = time.time()
 
     def on_test_network_connection(self):
@@ -459,8 +474,6 @@ class SystemPanelFrame(Frame):
         self.winfo_toplevel().terminal.set_state_welcome()
 
     def update_system_info(self):
-        self.after(1000, self.update_system_info)
-
         if self.time_updated is None:
             return
 
@@ -487,4 +500,12 @@ class SystemPanelFrame(Frame):
         sysinfo += f"\nCPU core temperature:\n{float(cpu_temp)/1000} °C\n"
         sysinfo += f"\nGPU core temperature:\nunavailable\n"
 
+        tq_count, tq_mean, tq_max = thread_queue.get_latency_stats()
+        sysinfo += f"\nThread queue latency:\n{tq_mean*1000:.1f} ms mean, {tq_max*1000:.1f} ms max ({tq_count} events)\n"
+
+        wakeups, runs = self.winfo_toplevel().scheduler.get_wakeups_per_minute()
+        sysinfo += f"\nTimer wakeups per minute: {wakeups}\n"
+        for name, count in sorted(runs.items()):
+            sysinfo += f"{name}: {count}\n"
+
         self.sysinfo_label.config(text=sysinfo)
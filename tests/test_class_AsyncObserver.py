@@ -0,0 +1,73 @@
+from unittest import TestCase
+import threading
+
+from lost.modes.office_terminal import State, Terminal
+from lost.observers import AsyncObserver
+
+
+class SlowObserver:
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.updates = []
+
+    def update_to_model(self, terminal, changed):
+        self.release.wait()
+        self.updates.append((terminal.state, terminal.pause, changed))
+
+
+class Test_AsyncObserver(TestCase):
+
+    def test_latest_state_only(self):
+        terminal = Terminal()
+        slow = SlowObserver()
+        async_obs = AsyncObserver(slow, budget=None)
+        terminal.add_observer(async_obs)
+
+        # The first update occupies the worker, the others replace each other.
+        terminal.notify_observers()
+        while async_obs.pending is not None:
+            pass
+        terminal.set_state_system_panel()
+        terminal.set_pause(30)
+        terminal.set_pause(45)
+        terminal.set_state_welcome()
+
+        # The main thread is not blocked by the slow observer.
+        self.assertEqual(slow.updates, [])
+        self.assertEqual(async_obs.num_coalesced, 3)
+
+        slow.release.set()
+        async_obs.stop()
+
+        self.assertEqual(slow.updates, [
+            (State.WELCOME, None, {'state', 'pause', 'last_server_reply'}),
+            (State.WELCOME, None, {'state', 'pause'}),
+        ])
+
+    def test_budget_overrun(self):
+        terminal = Terminal()
+        slow = SlowObserver()
+        async_obs = AsyncObserver(slow, budget=0.01, name="Door")
+        terminal.add_observer(async_obs)
+
+        with self.assertLogs(logger="lost", level="WARNING") as cm:
+            terminal.set_pause(30)
+            threading.Timer(0.05, slow.release.set).start()
+            async_obs.stop()
+
+        self.assertEqual(len(cm.output), 1)
+        self.assertTrue(cm.output[0].startswith("WARNING:lost.observers:Observer Door took "))
+        self.assertTrue(cm.output[0].endswith(" ms, exceeding its budget of 10.0 ms."))
+
+    def test_sync_budget_overrun(self):
+        terminal = Terminal()
+        slow = SlowObserver()
+        slow.name = "GUI"
+        terminal.add_observer(slow, budget=0.0)
+        terminal._changed.clear()
+
+        slow.release.set()
+        with self.assertLogs(logger="lost", level="WARNING"):
+            terminal.set_pause(30)
+        self.assertEqual(slow.updates, [(State.WELCOME, 30, {'pause'})])
@@ -0,0 +1,141 @@
+from pathlib import Path
+from unittest import TestCase, skipUnless
+import tempfile
+
+from lost import common
+from lost.backlog import Backlog
+
+try:
+    import dbm.gnu
+    HAVE_DBM_GNU = True
+except ImportError:
+    HAVE_DBM_GNU = False
+
+
+class Test_Backlog(TestCase):
+
+    def setUp(self):
+        common.FAKE_TIMETIME_FOR_TESTS = 1000
+
+        self.backlog_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_Backlog.sqlite3"
+        self.backlog_path.unlink(missing_ok=True)
+        self.backlog = Backlog(str(self.backlog_path))
+
+    def tearDown(self):
+        self.backlog.close()
+        common.FAKE_TIMETIME_FOR_TESTS = None
+
+    def test_empty(self):
+        self.assertEqual(len(self.backlog), 0)
+        self.assertIsNone(self.backlog.first())
+        self.assertIsNone(self.backlog.last())
+        self.assertEqual(self.backlog.get_oldest_age(), 0.0)
+
+    def test_order(self):
+        # All entries are added at the same time, but still keep their order.
+        for nr in range(5):
+            self.assertEqual(self.backlog.append(f"entry {nr}"), nr + 1)
+        self.backlog.sync()
+
+        self.assertEqual(len(self.backlog), 5)
+        self.assertEqual(self.backlog.first(), (1, 1000, "entry 0"))
+        self.assertEqual(self.backlog.last(), (5, 1000, "entry 4"))
+
+        self.backlog.remove(1)
+        self.backlog.remove(3)
+        self.assertEqual(len(self.backlog), 3)
+        self.assertEqual(self.backlog.first(), (2, 1000, "entry 1"))
+
+        # Sequence numbers are never re-used.
+        self.backlog.remove(5)
+        self.assertEqual(self.backlog.append("entry 5"), 6)
+
+    def test_leases(self):
+        for nr in range(4):
+            self.backlog.append(f"entry {nr}")
+
+        entries = self.backlog.get_available(2)
+        self.assertEqual([e[0] for e in entries], [1, 2])
+        self.backlog.lease([1, 2], 1060)
+
+        # Leased entries are not returned again.
+        self.assertEqual(self.backlog.num_available(), 2)
+        self.assertEqual([e[0] for e in self.backlog.get_available(10)], [3, 4])
+
+        # An acknowledged entry is removed, a released one is available again.
+        self.backlog.ack(1)
+        self.backlog.release(2, "entry 1, updated")
+        self.assertEqual(len(self.backlog), 3)
+        self.assertEqual(self.backlog.get_available(1), [(2, 1000, "entry 1, updated")])
+
+        # Leases expire.
+        self.backlog.lease([2, 3], 1060)
+        self.assertEqual(self.backlog.num_available(now=1059), 1)
+        with self.assertLogs(logger="lost", level="WARNING"):
+            self.assertEqual(self.backlog.num_available(now=1060), 3)
+
+    def test_oldest_age(self):
+        self.backlog.append("old entry", 400)
+        self.backlog.append("new entry", 900)
+        self.assertEqual(self.backlog.get_oldest_age(), 600)
+        self.assertEqual(self.backlog.get_oldest_age(now=1200), 800)
+
+    def test_persistency(self):
+        self.backlog.append("entry")
+        self.backlog.sync()
+        self.backlog.close()
+
+        self.backlog = Backlog(str(self.backlog_path))
+        self.assertEqual(len(self.backlog), 1)
+        self.assertEqual(self.backlog.first(), (1, 1000, "entry"))
+
+    def test_grouped_durability(self):
+        self.backlog.close()
+        self.backlog = Backlog(str(self.backlog_path), durability='grouped', max_loss_window=5.0, max_unflushed=3)
+
+        # Commits are only flushed to disk after `max_unflushed` of them ...
+        self.backlog.append("entry 1")
+        self.backlog.sync()
+        self.backlog.append("entry 2")
+        self.backlog.sync()
+        self.assertEqual(self.backlog.num_unflushed, 2)
+        self.backlog.append("entry 3")
+        self.backlog.sync()
+        self.assertEqual(self.backlog.num_unflushed, 0)
+
+        # ... or when the loss window is about to be exceeded.
+        self.backlog.append("entry 4")
+        self.backlog.sync()
+        common.FAKE_TIMETIME_FOR_TESTS += 4.9
+        self.backlog.on_clock_tick()
+        self.assertEqual(self.backlog.num_unflushed, 1)
+        common.FAKE_TIMETIME_FOR_TESTS += 0.1
+        self.backlog.on_clock_tick()
+        self.assertEqual(self.backlog.num_unflushed, 0)
+
+        # Committed but unflushed changes are seen when the backlog is re-opened.
+        self.backlog.append("entry 5")
+        self.backlog.sync()
+        other = Backlog(str(self.backlog_path), durability='grouped')
+        self.assertEqual(len(other), 5)
+        other.close()
+
+    @skipUnless(HAVE_DBM_GNU, "requires the dbm.gnu module")
+    def test_import_dbm(self):
+        dbm_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_Backlog.db"
+        dbm_path.unlink(missing_ok=True)
+        Path(f"{dbm_path}.migrated").unlink(missing_ok=True)
+
+        old_backlog = dbm.gnu.open(str(dbm_path), 'cs')
+        old_backlog['500.25'] = "second"
+        old_backlog['300.5'] = "first"
+        old_backlog['700.0'] = "third"
+        old_backlog.close()
+
+        self.assertEqual(self.backlog.import_dbm(str(dbm_path)), 3)
+        self.assertFalse(dbm_path.exists())
+        self.assertTrue(Path(f"{dbm_path}.migrated").exists())
+
+        self.assertEqual(len(self.backlog), 3)
+        self.assertEqual(self.backlog.first(), (1, 300.5, "first"))
+        self.assertEqual(self.backlog.last(), (3, 700.0, "third"))
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from benchmarks.runner import compare, result
+
+
+class Test_compare(TestCase):
+
+    def test_regressions(self):
+        baseline = {'results': {
+            'latency_ms': result(10.0, "ms", "lower"),
+            'throughput': result(1000.0, "1/s", "higher"),
+            'removed': result(1.0, "ms", "lower"),
+        }}
+        report = {'results': {
+            'latency_ms': result(11.0, "ms", "lower"),
+            'throughput': result(700.0, "1/s", "higher"),
+            'added': result(1.0, "ms", "lower"),
+        }}
+
+        # A 10% slower latency is within the tolerance, 30% less throughput is not.
+        self.assertEqual(compare(report, baseline, tolerance=0.2), [('throughput', 1000.0, 700.0, 0.3)])
+        self.assertEqual(len(compare(report, baseline, tolerance=0.05)), 2)
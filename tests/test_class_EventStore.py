@@ -0,0 +1,76 @@
+from pathlib import Path
+from unittest import TestCase
+import requests, tempfile
+
+from lost.event_store import EventStore
+from lost.server import start_testserver
+
+
+def make_event(nr, smartcard_id="card-A"):
+    return {
+        'smartcard_id': smartcard_id,
+        'terminal_ts': f"2022-04-02 18:{nr:02}:00",
+        'event_id': f"event-{nr}",
+        'terminal_name': "entrance",
+        'terminal_pwd': "secret",
+    }
+
+
+class Test_EventStore(TestCase):
+
+    def setUp(self):
+        self.path = Path(tempfile.gettempdir()) / "tmp_LoST_test_events.sqlite3"
+        self.path.unlink(missing_ok=True)
+        self.store = EventStore(str(self.path))
+
+    def tearDown(self):
+        self.store.close()
+        self.path.unlink(missing_ok=True)
+
+    def test_add_many(self):
+        self.assertEqual(self.store.add_many([make_event(nr) for nr in range(3)]), 3)
+
+        # Events that are re-sent are stored only once.
+        self.assertEqual(self.store.add_many([make_event(2), make_event(3)]), 1)
+        self.assertEqual(len(self.store), 4)
+
+        events, next_after = self.store.query()
+        self.assertEqual([event['event_id'] for event in events], ["event-0", "event-1", "event-2", "event-3"])
+        self.assertNotIn('terminal_pwd', events[0])
+        self.assertIsNone(next_after)
+
+    def test_query_pages(self):
+        self.store.add_many([make_event(nr, "card-A" if nr % 2 else "card-B") for nr in range(10)])
+
+        events, next_after = self.store.query(smartcard_id="card-A", limit=3)
+        self.assertEqual([event['event_id'] for event in events], ["event-1", "event-3", "event-5"])
+
+        events, next_after = self.store.query(smartcard_id="card-A", after=next_after, limit=3)
+        self.assertEqual([event['event_id'] for event in events], ["event-7", "event-9"])
+        self.assertIsNone(next_after)
+
+        events, next_after = self.store.query(since="2022-04-02 18:04", until="2022-04-02 18:06")
+        self.assertEqual([event['event_id'] for event in events], ["event-4", "event-5"])
+
+    def test_server(self):
+        httpd = start_testserver(38006, event_store=self.store)
+        base_url = "http://localhost:38006/stempeluhr"
+
+        try:
+            r = requests.post(f"{base_url}/event/submit/", data=make_event(0), timeout=2.0)
+            self.assertEqual(r.status_code, 200)
+
+            batch = {'terminal_name': "entrance", 'terminal_pwd': "secret", 'events': [make_event(nr) for nr in range(1, 4)]}
+            r = requests.post(f"{base_url}/event/submit-batch/", json=batch, timeout=2.0)
+            self.assertEqual(len(r.json()['results']), 3)
+
+            r = requests.get(f"{base_url}/events/?smartcard_id=card-A&limit=3", timeout=2.0)
+            page = r.json()
+            self.assertEqual([event['event_id'] for event in page['events']], ["event-0", "event-1", "event-2"])
+
+            r = requests.get(f"{base_url}/events/?smartcard_id=card-A&limit=3&after={page['next']}", timeout=2.0)
+            self.assertEqual([event['event_id'] for event in r.json()['events']], ["event-3"])
+            self.assertIsNone(r.json()['next'])
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
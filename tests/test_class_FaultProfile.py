@@ -0,0 +1,78 @@
+from unittest import TestCase
+import requests
+
+from lost.server import FaultProfile, start_testserver
+
+
+class Test_FaultProfile(TestCase):
+
+    def test_scripted_faults(self):
+        self.now = 0.0
+        profile = FaultProfile(
+            latency={'distribution': 'uniform', 'min': 0.1, 'max': 0.2},
+            outages=[[10.0, 20.0]],
+            error_bursts=[[30.0, 40.0, 503]],
+            clock=lambda: self.now,
+        )
+        profile.start()
+
+        fault, delay = profile.get_fault()
+        self.assertIsNone(fault)
+        self.assertTrue(0.1 <= delay <= 0.2)
+
+        self.now = 15.0
+        self.assertEqual(profile.get_fault()[0], 'outage')
+        self.now = 35.0
+        self.assertEqual(profile.get_fault()[0], 503)
+        self.now = 40.0
+        self.assertIsNone(profile.get_fault()[0])
+
+        self.assertEqual(profile.counts, {'none': 2, 'outage': 1, 503: 1})
+
+    def test_drop_and_error_rates(self):
+        profile = FaultProfile(drop_rate=1.0)
+        self.assertEqual(profile.get_fault(), ('drop', 0.0))
+
+        profile = FaultProfile(error_rate=1.0)
+        self.assertEqual(profile.get_fault(), (500, 0.0))
+
+
+class Test_FaultyServer(TestCase):
+
+    URL = "http://localhost:38005/stempeluhr/event/submit/"
+
+    def setUp(self):
+        self.profile = FaultProfile()
+        self.httpd = start_testserver(38005, self.profile)
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_keep_alive(self):
+        for nr in range(3):
+            r = self.session.post(self.URL, data={'smartcard_id': f"card-{nr}"}, timeout=2.0)
+            self.assertEqual(r.json()['smartcard_id'], f"card-{nr}")
+
+        # All requests went over the same connection.
+        self.assertEqual(self.httpd.num_connections, 1)
+
+    def test_faults(self):
+        self.profile.error_rate = 1.0
+        r = self.session.post(self.URL, data={'smartcard_id': "card"}, timeout=2.0)
+        self.assertEqual(r.status_code, 500)
+
+        # The event is processed, but the reply is lost.
+        self.profile.error_rate = 0.0
+        self.profile.drop_rate = 1.0
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.session.post(self.URL, data={'smartcard_id': "card", 'event_id': "dropped"}, timeout=2.0)
+        self.assertIn("dropped", self.httpd.event_index.replies)
+
+        self.profile.drop_rate = 0.0
+        self.profile.outages = [[0.0, 3600.0]]
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.session.post(self.URL, data={'smartcard_id': "card", 'event_id': "unreachable"}, timeout=2.0)
+        self.assertNotIn("unreachable", self.httpd.event_index.replies)
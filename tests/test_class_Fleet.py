@@ -0,0 +1,42 @@
+from pathlib import Path
+import tempfile
+
+from lost.headless import Fleet
+from lost.modes.office_terminal import State, Terminal
+from lost.scheduler import Scheduler
+from lost.thread_tools import thread_queue
+from tests.cases import BuiltinServerTestCase
+
+
+class Test_Fleet(BuiltinServerTestCase):
+
+    def setUp(self):
+        self.backlog_dir = Path(tempfile.gettempdir()) / "tmp_LoST_test_fleet"
+        for path in self.backlog_dir.glob("backlog-*"):
+            path.unlink()
+        assert thread_queue.empty()
+
+    def test_round_trips(self):
+        fleet = Fleet(Terminal, 3, self.backlog_dir, num_workers=2, scheduler=Scheduler())
+
+        for nr, vt in enumerate(fleet.terminals):
+            self.assertTrue(vt.tap(f"card-{nr}"))
+
+        def stop_when_done():
+            if all(vt.terminal.state == State.DISPLAY_SERVER_REPLY for vt in fleet.terminals):
+                fleet.loop.stop()
+
+        fleet.scheduler.add_periodic("stop_when_done", 0.01, stop_when_done)
+        fleet.loop.run(duration=10.0)
+        fleet.shutdown()
+
+        for nr, vt in enumerate(fleet.terminals):
+            self.assertEqual(vt.terminal.state, State.DISPLAY_SERVER_REPLY)
+            self.assertEqual(vt.terminal.last_server_reply['smartcard_id'], f"card-{nr}")
+
+        # A terminal that displays the reply doesn't expect another smartcard.
+        self.assertFalse(fleet.terminals[0].tap("card-0"))
+        self.assertEqual(fleet.terminals[0].num_ignored, 1)
+
+        self.assertEqual(fleet.get_backlog_size(), 0)
+        self.assertEqual(len(list(self.backlog_dir.glob("backlog-*.sqlite3"))), 3)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from lost.common import get_percentile
+from lost.loadgen import get_error_class, LoadGenerator, LoadProfile
+from lost.thread_tools import thread_queue
+from tests.cases import BuiltinServerTestCase
+
+
+class Test_LoadProfile(TestCase):
+
+    def test_arrivals(self):
+        profile = LoadProfile(num_terminals=3, duration=600.0, base_rate=0.0, bursts=(100.0,), burst_taps=10, burst_width=60.0, seed=1)
+        arrivals = profile.get_arrivals()
+
+        self.assertEqual(len(arrivals), 30)
+        self.assertEqual(arrivals, sorted(arrivals))
+        self.assertTrue(all(100.0 <= offset <= 160.0 for offset, terminal_nr in arrivals))
+        self.assertEqual(sorted(set(terminal_nr for offset, terminal_nr in arrivals)), [0, 1, 2])
+
+        # The same seed gives the same taps.
+        self.assertEqual(profile.get_arrivals(), arrivals)
+
+    def test_percentile_and_error_class(self):
+        self.assertEqual(get_percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(get_percentile([1, 2, 3, 4], 99), 4)
+        self.assertIsNone(get_percentile([], 50))
+
+        self.assertEqual(get_error_class("ConnectionError: HTTPConnectionPool(...)"), "ConnectionError")
+        self.assertEqual(get_error_class("Timeout: HTTPConnectionPool(...)"), "Timeout")
+        self.assertEqual(get_error_class("JSONDecodeError: Expecting value"), "JSONDecodeError")
+        self.assertEqual(get_error_class("The HTTP status response code was 503, expected 200 (OK)."), "HTTP 503")
+
+
+class Test_LoadGenerator(BuiltinServerTestCase):
+
+    def setUp(self):
+        assert thread_queue.empty()
+
+    def test_run(self):
+        profile = LoadProfile(num_terminals=2, duration=1.0, base_rate=0.0, bursts=(0.0,), burst_taps=5, burst_width=0.2, seed=1)
+        report = LoadGenerator(profile, concurrency=2).run().as_dict()
+
+        self.assertEqual(report['scheduled'], 10)
+        self.assertEqual(report['ok'], 10)
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(report['backlog'], {'entries': 0, 'terminals': 0, 'max_per_terminal': 0})
+        self.assertGreater(report['round_trip_ms']['p50'], 0.0)
+        self.assertGreaterEqual(report['response_time_ms']['p99'], report['round_trip_ms']['p50'])
+        self.assertTrue(thread_queue.empty())
@@ -0,0 +1,119 @@
+import logging
+import os
+import requests
+import tempfile
+from unittest import TestCase
+
+from lost import settings
+from lost.clock import VirtualClock
+from lost.main_connector import MainConnector
+from lost.metrics import metrics, Metrics, start_metrics_server
+from lost.modes.office_terminal import Terminal
+from lost.network_handler import NetworkHandler
+from lost.scheduler import Scheduler
+from lost.thread_tools import InlineWorkerPool, thread_queue
+
+
+class Test_Metrics(TestCase):
+
+    def test_render(self):
+        registry = Metrics()
+        registry.inc('lost_card_reads_total', {'result': 'ok'})
+        registry.inc('lost_card_reads_total', {'result': 'ok'})
+        registry.inc('lost_network_errors_total', {'type': 'HTTP "500"'})
+        registry.set_gauge('lost_backlog_entries', 7)
+        registry.observe('lost_live_send_seconds', 0.004, {'outcome': 'ok'})
+        registry.observe('lost_live_send_seconds', 0.3, {'outcome': 'ok'})
+
+        self.assertEqual(registry.get('lost_card_reads_total', {'result': 'ok'}), 2)
+        self.assertEqual(registry.get('lost_card_reads_total', {'result': 'ignored'}), 0)
+        self.assertEqual(registry.get('lost_live_send_seconds', {'outcome': 'ok'}), 2)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE lost_card_reads_total counter", lines)
+        self.assertIn('lost_card_reads_total{result="ok"} 2', lines)
+        self.assertIn('lost_network_errors_total{type="HTTP \\"500\\""} 1', lines)
+        self.assertIn("lost_backlog_entries 7", lines)
+        # The buckets are cumulative.
+        self.assertIn('lost_live_send_seconds_bucket{outcome="ok",le="0.002"} 0', lines)
+        self.assertIn('lost_live_send_seconds_bucket{outcome="ok",le="0.005"} 1', lines)
+        self.assertIn('lost_live_send_seconds_bucket{outcome="ok",le="0.5"} 2', lines)
+        self.assertIn('lost_live_send_seconds_bucket{outcome="ok",le="+Inf"} 2', lines)
+        self.assertIn('lost_live_send_seconds_count{outcome="ok"} 2', lines)
+
+    def test_endpoint(self):
+        registry = Metrics()
+        registry.inc('lost_throttled_drops_total')
+        sched = Scheduler(clock=lambda: 10.5)
+        sched.add_oneshot("late", -0.5, lambda: None)
+
+        httpd = start_metrics_server(38008, scheduler=sched, registry=registry)
+        try:
+            # The scheduler reports how late it runs the due tasks.
+            sched.run_due()
+            self.assertEqual(registry.get('lost_main_loop_lag_seconds'), 1)
+
+            r = requests.get("http://localhost:38008/metrics")
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.headers['Content-Type'].startswith("text/plain; version=0.0.4"))
+            self.assertIn("lost_throttled_drops_total 1\n", r.text)
+            self.assertIn('lost_main_loop_lag_seconds_bucket{le="1.0"} 1\n', r.text)
+
+            r = requests.get("http://localhost:38008/other")
+            self.assertEqual(r.status_code, 404)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+class Test_Metrics_NetworkHandler(TestCase):
+
+    def setUp(self):
+        self.backlog_path = os.path.join(tempfile.gettempdir(), "tmp_LoST_test_metrics.sqlite3")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.backlog_path + suffix):
+                os.remove(self.backlog_path + suffix)
+        assert thread_queue.empty()
+
+        self.clock = VirtualClock()
+        self.network_handler = NetworkHandler(
+            Terminal(self.clock.scheduler),
+            backlog_path=self.backlog_path,
+            worker_pool=InlineWorkerPool(),
+            old_backlog_path=None,
+            clock=self.clock,
+        )
+        self.main_con = MainConnector()
+        self.main_con.network_handlers.append(self.network_handler)
+
+    def tearDown(self):
+        self.network_handler.shutdown()
+
+    def test_failed_send(self):
+        num_errors = metrics.get('lost_network_errors_total', {'type': 'ConnectionError'})
+        num_sends = metrics.get('lost_live_send_seconds', {'outcome': 'error'})
+        num_drops = metrics.get('lost_throttled_drops_total')
+
+        old_address = settings.SERVER_ADDRESS
+        settings.SERVER_ADDRESS = ('localhost', 9999)
+        try:
+            with self.assertLogs('lost', level=logging.INFO):
+                self.network_handler.send_to_Lori("card-1")
+                self.network_handler.send_to_Lori("card-2")
+                self.main_con.on_thread_queue_wakeup()
+                self.clock.advance(60.0)
+                self.main_con.on_clock_tick()
+                # The entry was re-sent from the backlog at the clock tick, and failed again.
+                self.main_con.on_thread_queue_wakeup()
+        finally:
+            settings.SERVER_ADDRESS = old_address
+
+        self.assertEqual(metrics.get('lost_throttled_drops_total'), num_drops + 1)
+        self.assertGreaterEqual(metrics.get('lost_network_errors_total', {'type': 'ConnectionError'}), num_errors + 1)
+        self.assertEqual(metrics.get('lost_live_send_seconds', {'outcome': 'error'}), num_sends + 1)
+        self.assertEqual(self.network_handler.live_in_flight, {})
+
+        # The gauges are updated at the clock ticks.
+        self.assertEqual(metrics.get('lost_backlog_entries'), 1)
+        self.assertEqual(metrics.get('lost_backlog_oldest_age_seconds'), 60.0)
+        self.assertEqual(metrics.get('lost_thread_queue_depth'), 0)
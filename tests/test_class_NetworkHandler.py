@@ -1,26 +1,27 @@
 from datetime import datetime, timedelta
 from pathlib import Path
 from unittest import TestCase
-import json, logging, tempfile
+import itertools, json, logging, requests, tempfile
 
 from lost import common, network_handler, settings
-from lost.network_handler import post_stamp_event, NetworkHandler
+from lost.network_handler import post_stamp_event, CircuitBreaker, LatencyTracker, NetworkHandler, SessionPool
 from lost.modes.base_terminal import BaseTerminal
 from lost.thread_tools import thread_queue
+from lost.tracing import tracer
 from tests.cases import BuiltinServerTestCase
 
 
 class Test_post_stamp_event(BuiltinServerTestCase):
     """A test case for the `post_stamp_event()` function."""
 
-    def send_post(self):
+    def send_post(self, session_pool=None):
         user_in={
             'smartcard_id': 'brand-new smartcard',
             'terminal_ts': '2022-03-30 16:56:37.157814',
             'pause': None,
         }
 
-        user_out, result, network_error = post_stamp_event(user_input=user_in)
+        user_out, result, network_error = post_stamp_event(user_input=user_in, session_pool=session_pool)
 
         # The `post_stamp_event()` function always returns the user input that it got
         # in the first place. This is necessary because it usually runs within a thread
@@ -127,6 +128,176 @@ class Test_post_stamp_event(BuiltinServerTestCase):
         self.assertEqual(result, expected)
         self.assertIsNone(network_error)
 
+    def test_duplicate_event(self):
+        """The server processes each event only once, even if it is sent several times."""
+        user_in = {'smartcard_id': 'first attempt', 'event_id': 'test-duplicate-event'}
+        user_out, result_1, network_error = post_stamp_event(user_input=user_in)
+        self.assertIsNone(network_error)
+
+        user_in = {'smartcard_id': 'second attempt', 'event_id': 'test-duplicate-event'}
+        user_out, result_2, network_error = post_stamp_event(user_input=user_in)
+        self.assertIsNone(network_error)
+
+        # The second attempt got the reply to the first one.
+        self.assertEqual(result_2, result_1)
+        self.assertEqual(result_2['smartcard_id'], 'first attempt')
+        self.assertEqual(self._httpd.event_index.num_duplicates, 1)
+
+    def test_all_OK_pooled(self):
+        """The round-trip works just the same when the connection is taken from a pool."""
+        pool = SessionPool()
+
+        for i in range(3):
+            user_out, result, network_error = self.send_post(session_pool=pool)
+            self.assertEqual(result['smartcard_id'], 'brand-new smartcard')
+            self.assertIsNone(network_error)
+
+        pool.close()
+        self.assertIsNone(pool.session)
+
+    def test_latency_tracking(self):
+        lt = LatencyTracker()
+        user_out, result, network_error = post_stamp_event({'smartcard_id': "card"}, timeout=lt.get_timeouts(), latency_tracker=lt)
+
+        self.assertIsNone(network_error)
+        self.assertEqual(len(lt.latencies), 1)
+
+        # Failed requests are not recorded.
+        old_url = settings.SERVER_URL
+        settings.SERVER_URL = '/wrong/path/'
+        post_stamp_event({'smartcard_id': "card"}, latency_tracker=lt)
+        settings.SERVER_URL = old_url
+        self.assertEqual(len(lt.latencies), 1)
+
+    def test_malformed_batch(self):
+        """The server rejects batches whose events are not all objects."""
+        url = network_handler.get_server_url(network_handler.get_batch_path())
+
+        for events in (["a string"], [{'smartcard_id': "card"}, 17], [None], "no list"):
+            batch = {'terminal_name': "Buchhaltung", 'terminal_pwd': "pwd", 'events': events}
+            r = requests.post(url, json=batch, timeout=2.0)
+            self.assertEqual(r.status_code, 400)
+
+    def test_redirect_pooled(self):
+        old_url = settings.SERVER_URL
+        settings.SERVER_URL = '/old/path/now/redirected/'
+
+        pool = SessionPool()
+        user_out, result, network_error = self.send_post(session_pool=pool)
+        pool.close()
+        settings.SERVER_URL = old_url
+
+        self.assertEqual(result, {'success': 'The redirect went well!'})
+        self.assertIsNone(network_error)
+
+
+class Test_SessionPool(TestCase):
+    """A test case for the `SessionPool` class."""
+
+    def setUp(self):
+        common.FAKE_TIMETIME_FOR_TESTS = 3
+
+    def tearDown(self):
+        common.FAKE_TIMETIME_FOR_TESTS = None
+
+    def test_session_is_reused(self):
+        pool = SessionPool(idle_timeout=60.0)
+        s1 = pool.get_session()
+        common.FAKE_TIMETIME_FOR_TESTS += 59.0
+        s2 = pool.get_session()
+        self.assertIs(s1, s2)
+        pool.close()
+
+    def test_idle_session_expires(self):
+        pool = SessionPool(idle_timeout=60.0)
+        s1 = pool.get_session()
+        common.FAKE_TIMETIME_FOR_TESTS += 61.0
+        s2 = pool.get_session()
+        self.assertIsNot(s1, s2)
+        pool.close()
+
+
+class Test_CircuitBreaker(TestCase):
+    """A test case for the `CircuitBreaker` class."""
+
+    def test_backoff(self):
+        cb = CircuitBreaker(failure_threshold=2, base_backoff=10.0, max_backoff=300.0, jitter=0.0)
+        self.assertTrue(cb.allow_request(100))
+
+        # The first failure doesn't open the breaker yet.
+        cb.record_failure(100)
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+        self.assertTrue(cb.allow_request(100))
+
+        with self.assertLogs(logger="lost", level=logging.WARNING):
+            cb.record_failure(100)
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+        self.assertEqual(cb.time_next_attempt, 100 + 20)
+        self.assertFalse(cb.allow_request(119))
+
+        # After the backoff time, a single probe is let through.
+        self.assertTrue(cb.allow_request(120))
+        self.assertEqual(cb.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(cb.allow_request(120))
+
+        # The probe failed, so the backoff time doubles.
+        with self.assertLogs(logger="lost", level=logging.WARNING):
+            cb.record_failure(125)
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+        self.assertEqual(cb.time_next_attempt, 125 + 40)
+
+        # ... up to the maximum.
+        cb.num_failures = 10
+        cb.record_failure(200)
+        self.assertEqual(cb.time_next_attempt, 200 + 300)
+
+        self.assertTrue(cb.allow_request(500))
+        with self.assertLogs(logger="lost", level=logging.INFO):
+            cb.record_success()
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+        self.assertEqual(cb.num_failures, 0)
+        self.assertTrue(cb.allow_request(500))
+        self.assertTrue(cb.allow_request(500))
+
+    def test_jitter(self):
+        cb = CircuitBreaker(failure_threshold=1, base_backoff=10.0, jitter=0.2)
+        for i in range(20):
+            cb.num_failures = 1
+            self.assertGreaterEqual(cb.get_backoff(), 8.0)
+            self.assertLessEqual(cb.get_backoff(), 12.0)
+
+
+class Test_LatencyTracker(TestCase):
+    """A test case for the `LatencyTracker` class."""
+
+    def test_timeouts(self):
+        lt = LatencyTracker(window=100, margin=1.0, min_timeout=2.0, max_timeout=8.0, min_samples=10)
+        self.assertIsNone(lt.get_percentile(99))
+
+        # Without enough samples, the maximum timeout is used.
+        for i in range(9):
+            lt.record(0.1)
+        self.assertEqual(lt.get_timeouts(), (3.0, 8.0))
+
+        # A fast server gets the minimum timeout.
+        lt.record(0.1)
+        self.assertEqual(lt.get_timeouts(), (2.0, 2.0))
+
+        # Otherwise, it depends on the slowest of the recent requests.
+        for i in range(89):
+            lt.record(0.5)
+        lt.record(3.0)
+        self.assertEqual(lt.get_percentile(50), 0.5)
+        self.assertEqual(lt.get_percentile(99), 0.5)
+        lt.record(3.0)
+        self.assertEqual(lt.get_percentile(99), 3.0)
+        self.assertEqual(lt.get_timeouts(), (3.0, 4.0))
+
+        # Old samples drop out of the window, and the timeout is capped.
+        for i in range(100):
+            lt.record(10.0)
+        self.assertEqual(lt.get_timeouts(), (3.0, 8.0))
+
 
 class TestTerminal(BaseTerminal):
     """A minimal implementation of the `BaseTerminal`, just as required for tests."""
@@ -155,18 +326,22 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
     def setUp(self):
         common.FAKE_DATETIME_FOR_TESTS = datetime(2022, 4, 2, 18, 12, 00)
         common.FAKE_TIMETIME_FOR_TESTS = 3
+        common.FAKE_EVENT_IDS_FOR_TESTS = (f"event-{nr}" for nr in itertools.count(1))
+        # The fake event IDs are the same in each test, so the server must forget them.
+        self._httpd.event_index.clear()
 
-        backlog_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_backlog.db"
+        backlog_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_backlog.sqlite3"
         backlog_path.unlink(missing_ok=True)
 
         self.trm = TestTerminal()
-        self.nwh = NetworkHandler(self.trm, backlog_path=str(backlog_path))
+        self.nwh = NetworkHandler(self.trm, backlog_path=str(backlog_path), old_backlog_path=None)
         assert thread_queue.empty()
 
     def tearDown(self):
         self.nwh.shutdown()
         common.FAKE_DATETIME_FOR_TESTS = None
         common.FAKE_TIMETIME_FOR_TESTS = None
+        common.FAKE_EVENT_IDS_FOR_TESTS = None
 
     def test_simple_round_trip(self):
         with self.assertLogs(logger='lost', level=logging.DEBUG) as cm:
@@ -176,7 +351,7 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             cm.output,
             [
                 "INFO:lost.network:send_to_Lori():",
-                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00', 'backlog_count': 0, 'department': 'Test Labs', 'pause': 30}",
+                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00', 'backlog_count': 0, 'event_id': 'event-1', 'department': 'Test Labs', 'pause': 30}",
             ],
         )
 
@@ -193,6 +368,7 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
                 'smartcard_id': "brand-new smartcard",
                 'terminal_ts': "2022-04-02 18:12:00",
                 'backlog_count': 0,
+                'event_id': "event-1",
                 # These were added by the terminal's `get_user_input()`.
                 'department': "Test Labs",
                 'pause': 30,
@@ -208,6 +384,7 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
                 'smartcard_id': "brand-new smartcard",
                 'terminal_ts': "2022-04-02 18:12:00",
                 'backlog_count': "0",
+                'event_id': "event-1",
                 # These were added by the terminal's `get_user_input()`.
                 'department': "Test Labs",
                 'pause': '30',
@@ -240,14 +417,36 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             cm.output,
             [
                 "INFO:lost.network:send_to_Lori():",
-                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00', 'backlog_count': 0, 'department': 'Test Labs', 'pause': 30}",
+                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00', 'backlog_count': 0, 'event_id': 'event-1', 'department': 'Test Labs', 'pause': 30}",
                 "ERROR:lost.network:send_to_Lori(): Throttling network transmissions, dropping smartcard_id = 'brand-new smartcard'!",
-                "ERROR:lost.network:    self.time_last_sending = 3, now = 3.4",
+                "ERROR:lost.network:    time_last_sending = 3, now = 3.4",
                 "INFO:lost.network:send_to_Lori():",
-                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00.600000', 'backlog_count': 0, 'department': 'Test Labs', 'pause': 30}",
+                "INFO:lost.network:    user_input = {'smartcard_id': 'brand-new smartcard', 'terminal_ts': '2022-04-02 18:12:00.600000', 'backlog_count': 0, 'event_id': 'event-2', 'department': 'Test Labs', 'pause': 30}",
             ],
         )
 
+    def test_terminals_sharing_the_handler(self):
+        # In gateway mode, each reader has a terminal of its own, but they share the handler.
+        door_1 = TestTerminal()
+        door_1.reader_name = "Door 1"
+        door_2 = TestTerminal()
+        door_2.reader_name = "Door 2"
+
+        with self.assertLogs(logger='lost', level=logging.DEBUG):
+            # The throttling applies to each terminal separately.
+            self.nwh.send_to_Lori("first smartcard", terminal=door_1)
+            self.nwh.send_to_Lori("second smartcard", terminal=door_2)
+
+            for nr in range(2):
+                callback, args = thread_queue.get(block=True)
+                callback(*args)
+
+        self.assertEqual(door_1.last_server_reply['smartcard_id'], "first smartcard")
+        self.assertEqual(door_1.last_server_reply['reader'], "Door 1")
+        self.assertEqual(door_2.last_server_reply['smartcard_id'], "second smartcard")
+        self.assertEqual(door_2.last_server_reply['reader'], "Door 2")
+        self.assertIsNone(self.trm.last_server_reply)
+
     def test_too_early_for_backlog(self):
         tnb = common.FAKE_TIMETIME_FOR_TESTS + 1.0
         self.nwh.time_next_backlog = tnb
@@ -268,7 +467,7 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
         self.assertEqual(self.nwh.time_next_backlog, 86403)
 
     def test_backlog_has_invalid_item(self):
-        self.nwh.backlog['some_unique_id'] = ">>> invalid JSON <<<"
+        self.nwh.backlog.append(">>> invalid JSON <<<")
 
         with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
             self.nwh.catch_up_backlog()
@@ -277,7 +476,7 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             cm.output,
             [
                 "ERROR:lost.network:catch_up_backlog(): Invalid JSON in backlog: Expecting value: line 1 column 1 (char 0)",
-                "ERROR:lost.network:    backlog['some_unique_id'] = '>>> invalid JSON <<<'",
+                "ERROR:lost.network:    backlog[1] = '>>> invalid JSON <<<'",
             ],
         )
         self.assertEqual(len(self.nwh.backlog), 0)
@@ -289,8 +488,10 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             'int_value': 1234,
             'bool_value': True,
             'float_value': 3.1415926,
+            'backlog_count': 1,
+            'event_id': "backlogged-event",
         }
-        self.nwh.backlog['some_unique_id'] = json.dumps(backlogged_user_input)
+        self.nwh.backlog.append(json.dumps(backlogged_user_input))
 
         with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
             self.nwh.catch_up_backlog()
@@ -300,11 +501,16 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             cm.output,
             [
                 "INFO:lost.network:catch_up_backlog():",
-                "INFO:lost.network:    user_input = {'str_value': 'a string value', 'int_value': 1234, 'bool_value': True, 'float_value': 3.1415926}",
+                "INFO:lost.network:    user_input = {'str_value': 'a string value', 'int_value': 1234, 'bool_value': True, 'float_value': 3.1415926, 'backlog_count': 1, 'event_id': 'backlogged-event'}",
             ],
         )
-        self.assertEqual(len(self.nwh.backlog), 0)
-        self.assertEqual(self.nwh.time_next_backlog, 3 + 16)
+
+        # The entry stays in the backlog until the server has acknowledged it,
+        # but it is not available for being re-sent once more.
+        self.assertEqual(len(self.nwh.backlog), 1)
+        self.assertEqual(self.nwh.backlog.num_available(), 0)
+        self.assertFalse(self.nwh.catch_up_backlog())
+        self.assertEqual(self.nwh.drainer.num_in_flight, 1)
 
         callback, args = thread_queue.get(block=True)
         (user_input, result, network_error) = args
@@ -322,6 +528,8 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
                 'int_value': '1234',
                 'bool_value': 'True',
                 'float_value': '3.1415926',
+                'backlog_count': '1',
+                'event_id': "backlogged-event",
                 # These were added by the `post_stamp_event()` function.
                 'terminal_name': "Buchhaltung",
                 'terminal_pwd': "vf6r4cnf3 password for testing only, don't use!",
@@ -330,9 +538,156 @@ class Test_NetworkHandler_sending(BuiltinServerTestCase):
             }
         )
 
-        self.assertEqual(callback, self.nwh.on_server_reply)
+        self.assertEqual(callback.func, self.nwh.on_server_reply)
+        self.assertEqual(callback.keywords, {'backlog_seq': 1})
         self.assertIsNone(network_error)
 
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            callback(*args)
+
+        self.assertEqual(len(self.nwh.backlog), 0)
+        self.assertEqual(self.nwh.drainer.num_in_flight, 0)
+
+    def test_backlog_replay_fails(self):
+        self.nwh.backlog.append(json.dumps({'smartcard_id': "card 1", 'backlog_count': 1}))
+        self.nwh.backlog.append(json.dumps({'smartcard_id': "card 2", 'backlog_count': 1}))
+
+        old_address = settings.SERVER_ADDRESS
+        settings.SERVER_ADDRESS = ('localhost', 9999)
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.assertTrue(self.nwh.catch_up_backlog())
+            callback, args = thread_queue.get(block=True)
+            callback(*args)
+
+        settings.SERVER_ADDRESS = old_address
+
+        # The entry kept its place at the head of the backlog. As it was added by an
+        # earlier version of this program, it was given an event ID on the first attempt.
+        self.assertIn("INFO:lost.network:    --> backlog[1] = '{\"smartcard_id\": \"card 1\", \"backlog_count\": 2, \"event_id\": \"event-1\"}'", cm.output)
+        self.assertEqual(len(self.nwh.backlog), 2)
+        self.assertEqual(self.nwh.backlog.num_available(), 2)
+        self.assertEqual(self.nwh.backlog.first()[0], 1)
+
+    def test_drain_in_bursts(self):
+        self.nwh.batch_supported = False
+        for nr in range(5):
+            self.nwh.backlog.append(json.dumps({'smartcard_id': f"card {nr}", 'backlog_count': 1}))
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.on_clock_tick()
+
+            # Two entries were sent concurrently.
+            self.assertEqual(self.nwh.drainer.num_in_flight, 2)
+            self.assertEqual(len(self.nwh.backlog), 5)
+            self.assertEqual(self.nwh.backlog.num_available(), 3)
+
+            # Each successful reply makes room for the next entry.
+            sent_ids = []
+            while self.nwh.drainer.num_in_flight > 0:
+                callback, args = thread_queue.get(block=True)
+                sent_ids.append(args[0]['smartcard_id'])
+                callback(*args)
+                self.assertLessEqual(self.nwh.drainer.num_in_flight, 2)
+
+        self.assertEqual(sorted(sent_ids), [f"card {nr}" for nr in range(5)])
+        self.assertEqual(len(self.nwh.backlog), 0)
+        self.assertEqual(self.nwh.drainer.num_total_drained, 5)
+        self.assertIn(
+            "INFO:lost.network:DrainScheduler: Re-sent 5 backlog entries in 0.0 s (5.00 entries/s), 0 entries remaining.",
+            cm.output,
+        )
+
+    def test_drain_in_batches(self):
+        for nr in range(7):
+            self.nwh.backlog.append(json.dumps({'smartcard_id': f"card {nr}", 'backlog_count': 1}))
+
+        self.nwh.drainer.batch_size = 5
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.on_clock_tick()
+
+            # Two batches were sent concurrently.
+            self.assertEqual(self.nwh.drainer.num_in_flight, 2)
+            self.assertEqual(len(self.nwh.backlog), 7)
+            self.assertEqual(self.nwh.backlog.num_available(), 0)
+
+            for i in range(2):
+                callback, args = thread_queue.get(block=True)
+                self.assertEqual(callback.func, self.nwh.on_batch_reply)
+                (user_inputs, results, network_error, batch_unsupported) = args
+                self.assertIsNone(network_error)
+                self.assertEqual(len(results), len(user_inputs))
+                self.assertEqual(results[0]['smartcard_id'], user_inputs[0]['smartcard_id'])
+                self.assertEqual(results[0]['backlog_count'], 1)
+                callback(*args)
+
+        self.assertTrue(self.nwh.batch_supported)
+        self.assertEqual(len(self.nwh.backlog), 0)
+        self.assertEqual(self.nwh.drainer.num_total_drained, 7)
+
+    def test_batch_fallback_to_single(self):
+        old_url = settings.SERVER_URL
+        settings.SERVER_URL = '/redirect-goal/'
+
+        for nr in range(3):
+            self.nwh.backlog.append(json.dumps({'smartcard_id': f"card {nr}", 'backlog_count': 1}))
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.on_clock_tick()
+            self.assertEqual(self.nwh.drainer.num_in_flight, 1)
+
+            callback, args = thread_queue.get(block=True)
+            self.assertEqual(callback.func, self.nwh.on_batch_reply)
+            self.assertTrue(args[3])
+            callback(*args)
+
+            # The entries went back into the backlog and are re-sent one by one.
+            self.assertFalse(self.nwh.batch_supported)
+            while self.nwh.drainer.num_in_flight > 0:
+                callback, args = thread_queue.get(block=True)
+                self.assertEqual(callback.func, self.nwh.on_server_reply)
+                callback(*args)
+
+        settings.SERVER_URL = old_url
+        self.assertEqual(len(self.nwh.backlog), 0)
+        self.assertEqual(self.nwh.drainer.num_total_drained, 3)
+
+    def test_drain_pauses_for_live_input(self):
+        self.nwh.backlog.append(json.dumps({'smartcard_id': "old card", 'backlog_count': 1}))
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.send_to_Lori("brand-new smartcard")
+            self.nwh.on_clock_tick()
+            self.assertEqual(self.nwh.drainer.num_in_flight, 0)
+
+            # When the reply to the live input has arrived, draining starts right away.
+            callback, args = thread_queue.get(block=True)
+            callback(*args)
+            self.assertEqual(self.trm.last_server_reply['smartcard_id'], "brand-new smartcard")
+            self.assertEqual(self.nwh.drainer.num_in_flight, 1)
+
+            callback, args = thread_queue.get(block=True)
+            callback(*args)
+
+        self.assertEqual(len(self.nwh.backlog), 0)
+
+    def test_traced_round_trip(self):
+        trace_id = tracer.start()
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.send_to_Lori("brand-new smartcard", trace_id)
+            callback, args = thread_queue.get(block=True)
+            callback(*args)
+
+        self.assertEqual(self.trm.last_server_reply['smartcard_id'], "brand-new smartcard")
+        trace = tracer.completed[-1]
+        self.assertEqual(trace.trace_id, trace_id)
+        self.assertEqual(
+            [stage for stage, duration in trace.stages],
+            ['submit', 'worker_wait', 'network', 'reply_queue', 'terminal'],
+        )
+
 
 class Test_NetworkHandler_other(TestCase):
     """
@@ -346,11 +701,12 @@ class Test_NetworkHandler_other(TestCase):
         common.FAKE_DATETIME_FOR_TESTS = datetime(2022, 4, 2, 18, 12, 00)
         common.FAKE_TIMETIME_FOR_TESTS = 3
 
-        self.backlog_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_backlog.db"
+        self.backlog_path = Path(tempfile.gettempdir()) / "tmp_LoST_test_backlog.sqlite3"
         self.backlog_path.unlink(missing_ok=True)
 
         self.trm = TestTerminal()
-        self.nwh = NetworkHandler(self.trm, backlog_path=str(self.backlog_path))
+        self.nwh = NetworkHandler(self.trm, backlog_path=str(self.backlog_path), old_backlog_path=None)
+        self.nwh.breaker = CircuitBreaker(jitter=0.0)
 
     def tearDown(self):
         self.nwh.shutdown()
@@ -359,13 +715,15 @@ class Test_NetworkHandler_other(TestCase):
 
     def test_backlog_persistency(self):
         s = "This must still be there in a new `NetworkHandler` instance!"
-        self.nwh.backlog['is persistent'] = s
+        self.nwh.backlog.append(s)
+        self.nwh.backlog.sync()
         self.nwh.shutdown()
-        self.nwh = NetworkHandler(self.trm, backlog_path=str(self.backlog_path))
+        self.nwh = NetworkHandler(self.trm, backlog_path=str(self.backlog_path), old_backlog_path=None)
 
+        self.assertEqual(len(self.nwh.backlog), 1)
         self.assertEqual(
-            self.nwh.backlog['is persistent'],
-            b"This must still be there in a new `NetworkHandler` instance!",
+            self.nwh.backlog.first(),
+            (1, 3, "This must still be there in a new `NetworkHandler` instance!"),
         )
 
     def test_successful_server_reply(self):
@@ -402,10 +760,10 @@ class Test_NetworkHandler_other(TestCase):
                 "INFO:lost.network:    user_input = {'backlog_count': 0}",
                 "INFO:lost.network:    network_error = 'some error message'",
                 "INFO:lost.network:    result = {}",
-                "INFO:lost.network:    --> backlog['3'] = '{\"backlog_count\": 1}'",
+                "INFO:lost.network:    --> backlog[1] = '{\"backlog_count\": 1}'",
             ],
         )
-        self.assertEqual(self.nwh.time_next_backlog, 3 + 300)
+        self.assertEqual(self.nwh.time_next_backlog, 3 + 10)
         self.assertEqual(
             self.trm.last_server_reply,
             {
@@ -418,6 +776,68 @@ class Test_NetworkHandler_other(TestCase):
             }
         )
 
+    def test_open_breaker_backlogs_right_away(self):
+        self.nwh.breaker.record_failure(3)
+        with self.assertLogs(logger="lost", level=logging.WARNING):
+            self.nwh.breaker.record_failure(3)
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG) as cm:
+            self.nwh.send_to_Lori("brand-new smartcard")
+
+        # Nothing was sent, but the reply is still passed through the `thread_queue`.
+        callback, args = thread_queue.get(block=False)
+        self.assertEqual(callback, self.nwh.on_server_reply)
+        (user_input, result, network_error, was_sent) = args
+        self.assertEqual(user_input['smartcard_id'], "brand-new smartcard")
+        self.assertEqual(network_error, "CircuitBreaker: Not sending, the last 2 attempts failed.")
+        self.assertFalse(was_sent)
+
+        callback(*args)
+        self.assertEqual(len(self.nwh.backlog), 1)
+        self.assertEqual(self.trm.last_server_reply['detail_info'], network_error)
+
+        # The unsent user input didn't count as another failure.
+        self.assertEqual(self.nwh.breaker.num_failures, 2)
+
+        # Catching up with the backlog must wait for the backoff time as well.
+        self.nwh.time_next_backlog = 0
+        self.nwh.catch_up_backlog()
+        self.assertEqual(len(self.nwh.backlog), 1)
+        self.assertEqual(self.nwh.time_next_backlog, 3 + 20)
+
+    def test_full_worker_pool_is_not_a_server_failure(self):
+        class FullWorkerPool:
+            def submit(self, action, action_args, callback, on_error=None):
+                return False
+
+            def shutdown(self, wait=True):
+                pass
+
+        self.nwh.worker_pool.shutdown()
+        self.nwh.worker_pool = FullWorkerPool()
+        self.nwh.breaker.record_failure(3)
+        with self.assertLogs(logger="lost", level=logging.WARNING):
+            self.nwh.breaker.record_failure(3)
+
+        # After the backoff time, the live user input is let through as the probe.
+        common.FAKE_TIMETIME_FOR_TESTS = 30
+        with self.assertLogs(logger="lost", level=logging.DEBUG):
+            self.nwh.send_to_Lori("brand-new smartcard")
+        self.assertTrue(self.nwh.breaker.is_probing)
+
+        callback, args = thread_queue.get(block=False)
+        self.assertEqual(args[2], "WorkerPool: Too many pending requests.")
+        self.assertFalse(args[3])
+
+        with self.assertLogs(logger="lost", level=logging.DEBUG):
+            callback(*args)
+        self.assertEqual(len(self.nwh.backlog), 1)
+        self.assertEqual(self.nwh.num_live_in_flight, 0)
+
+        # The local overload didn't count as another failure, and the next request may probe.
+        self.assertEqual(self.nwh.breaker.num_failures, 2)
+        self.assertFalse(self.nwh.breaker.is_probing)
+
     def test_backlog_successfully_processed(self):
         user_input = {'backlog_count': 1}
         result = {'msg': 'success data from Lori'}
@@ -453,10 +873,10 @@ class Test_NetworkHandler_other(TestCase):
                 "INFO:lost.network:    user_input = {'backlog_count': 1}",
                 "INFO:lost.network:    network_error = 'some error message'",
                 "INFO:lost.network:    result = {}",
-                "INFO:lost.network:    --> backlog['3'] = '{\"backlog_count\": 2}'",
+                "INFO:lost.network:    --> backlog[1] = '{\"backlog_count\": 2}'",
                 "INFO:lost.network:    --> not updating the terminal",
             ],
         )
         self.assertIsNone(self.trm.last_server_reply)
-        self.assertEqual(self.nwh.time_next_backlog, 3 + 300)
+        self.assertEqual(self.nwh.time_next_backlog, 3 + 10)
         self.assertIsNone(self.trm.last_server_reply)
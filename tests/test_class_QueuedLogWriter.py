@@ -0,0 +1,93 @@
+from pathlib import Path
+from unittest import TestCase
+import gzip, logging, tempfile, time
+
+from lost.log_tools import QueuedLogWriter, RotatingGzipFileHandler
+
+
+class Test_QueuedLogWriter(TestCase):
+
+    def setUp(self):
+        self.log_path = Path(tempfile.gettempdir()) / "tmp_LoST_test.log"
+        for path in Path(tempfile.gettempdir()).glob("tmp_LoST_test.log*"):
+            path.unlink()
+
+        self.logger = logging.getLogger("lost.test_log_tools")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.handlers.clear()
+
+    def make_writer(self, **kwargs):
+        f_handler = RotatingGzipFileHandler(str(self.log_path), **kwargs)
+        f_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        log_writer = QueuedLogWriter([f_handler], flush_interval=60.0)
+        self.logger.addHandler(log_writer.get_queue_handler())
+        log_writer.start()
+        return log_writer
+
+    def test_records_are_written_on_stop(self):
+        log_writer = self.make_writer()
+        for nr in range(3):
+            self.logger.info(f"record {nr}")
+        log_writer.stop()
+
+        self.assertEqual(
+            self.log_path.read_text().splitlines(),
+            ["INFO: record 0", "INFO: record 1", "INFO: record 2"],
+        )
+
+    def test_rotation_by_size(self):
+        log_writer = self.make_writer(max_bytes=100, backup_count=2)
+        for nr in range(20):
+            self.logger.info(f"record {nr:02}")
+        log_writer.stop()
+
+        # Each segment holds 6 records of 16 bytes, older segments are dropped.
+        self.assertEqual(self.log_path.read_text().splitlines()[-1], "INFO: record 19")
+        with gzip.open(f"{self.log_path}.1.gz", 'rt') as f:
+            self.assertEqual(f.read().splitlines()[-1], "INFO: record 17")
+        self.assertTrue(Path(f"{self.log_path}.2.gz").exists())
+        self.assertFalse(Path(f"{self.log_path}.3.gz").exists())
+        self.assertEqual(list(Path(tempfile.gettempdir()).glob("tmp_LoST_test.log*.raw")), [])
+
+    def test_rotation_by_age(self):
+        log_writer = self.make_writer(max_age=3600.0)
+        self.logger.info("old record")
+        log_writer.stop()
+
+        log_writer = self.make_writer(max_age=3600.0)
+        log_writer.handlers[0].time_started -= 3600.0
+        self.logger.info("new record")
+        log_writer.stop()
+
+        self.assertEqual(self.log_path.read_text(), "INFO: new record\n")
+        with gzip.open(f"{self.log_path}.1.gz", 'rt') as f:
+            self.assertEqual(f.read(), "INFO: old record\n")
+
+    def test_rotation_by_age_after_restart(self):
+        log_writer = self.make_writer(max_age=3600.0)
+        time_started = log_writer.handlers[0].time_started
+        self.logger.info("old record")
+        log_writer.stop()
+
+        # The restarted program continues the segment with its original start time.
+        log_writer = self.make_writer(max_age=3600.0)
+        self.assertEqual(log_writer.handlers[0].time_started, time_started)
+        self.logger.info("recent record")
+        log_writer.stop()
+        self.assertFalse(Path(f"{self.log_path}.1.gz").exists())
+
+        # The segment was started long ago, but written to only recently, so that the
+        # modification time of the log file is recent as well.
+        Path(f"{self.log_path}.started").write_text(repr(time.time() - 3600.0))
+
+        log_writer = self.make_writer(max_age=3600.0)
+        self.logger.info("new record")
+        log_writer.stop()
+
+        self.assertEqual(self.log_path.read_text(), "INFO: new record\n")
+        with gzip.open(f"{self.log_path}.1.gz", 'rt') as f:
+            self.assertEqual(f.read(), "INFO: old record\nINFO: recent record\n")
+        self.assertGreater(float(Path(f"{self.log_path}.started").read_text()), time.time() - 60.0)
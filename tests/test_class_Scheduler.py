@@ -0,0 +1,79 @@
+from unittest import TestCase
+
+from lost.scheduler import Scheduler
+
+
+class Test_Scheduler(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.sched = Scheduler(clock=lambda: self.now)
+        self.runs = []
+
+    def advance_to(self, t):
+        self.now = t
+        self.sched.run_due()
+
+    def test_periodic_and_oneshot(self):
+        self.sched.add_periodic("clock", 1.0, lambda: self.runs.append("clock"))
+        self.sched.add_oneshot("message", 2.5, lambda: self.runs.append("message"))
+        self.assertEqual(self.sched.get_next_deadline(), 1000.0)
+
+        self.advance_to(1000.0)
+        self.assertEqual(self.runs, ["clock"])
+        self.assertEqual(self.sched.get_next_deadline(), 1001.0)
+
+        # Missed runs are not made up for, but the task keeps its phase.
+        self.advance_to(1002.5)
+        self.assertEqual(self.runs, ["clock", "clock", "message"])
+        self.assertEqual(self.sched.get_next_deadline(), 1003.0)
+
+        self.advance_to(1010.2)
+        self.assertEqual(self.runs.count("clock"), 3)
+        self.assertEqual(self.sched.get_next_deadline(), 1011.0)
+
+    def test_cancel(self):
+        task = self.sched.add_oneshot("message", 2.0, lambda: self.runs.append("message"))
+        self.sched.cancel(task)
+        self.assertIsNone(self.sched.get_next_deadline())
+
+        self.advance_to(1005.0)
+        self.assertEqual(self.runs, [])
+
+    def test_suspend_and_resume(self):
+        self.sched.add_periodic("clock", 1.0, lambda: self.runs.append("clock"), group="frame")
+        self.sched.suspend("frame")
+
+        self.advance_to(1000.0)
+        self.advance_to(1030.0)
+        self.assertEqual(self.runs, [])
+        self.assertIsNone(self.sched.get_next_deadline())
+
+        # When resumed, the task runs right away.
+        self.sched.resume("frame")
+        self.assertEqual(self.sched.get_next_deadline(), 1030.0)
+        self.advance_to(1030.0)
+        self.assertEqual(self.runs, ["clock"])
+
+    def test_wakeups_per_minute(self):
+        self.sched.add_periodic("fast", 0.5, lambda: None)
+        self.sched.add_periodic("slow", 1.0, lambda: None)
+
+        for i in range(121):
+            self.advance_to(1000.0 + i * 0.5)
+
+        # Tasks that are due at the same time share the wakeup.
+        wakeups, runs = self.sched.get_wakeups_per_minute()
+        self.assertEqual(wakeups, 120)
+        self.assertEqual(runs, {"fast": 120, "slow": 60})
+
+    def test_exception_cancels_task(self):
+        def fail():
+            self.runs.append("fail")
+            raise ValueError("broken")
+
+        self.sched.add_periodic("fail", 1.0, fail)
+        with self.assertLogs(logger="lost", level="ERROR"):
+            self.advance_to(1000.0)
+        self.advance_to(1001.0)
+        self.assertEqual(self.runs, ["fail"])
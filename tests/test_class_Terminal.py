@@ -1,5 +1,6 @@
 from unittest import TestCase
 from lost.modes.office_terminal import State, Terminal
+from lost.scheduler import Scheduler
 
 
 class TestOfficeTerminal(TestCase):
@@ -10,3 +11,70 @@ class TestOfficeTerminal(TestCase):
         self.assertEqual(terminal.state, State.WELCOME)
         self.assertIsNone(terminal.pause)
         self.assertIsNone(terminal.last_server_reply)
+
+    def test_changed_fields(self):
+        terminal = Terminal()
+        notifications = []
+
+        class Observer:
+            def update_to_model(self, terminal, changed):
+                notifications.append(changed)
+
+        terminal.add_observer(Observer())
+        terminal.notify_observers()
+        self.assertEqual(notifications, [{'state', 'pause', 'last_server_reply'}])
+
+        # Only the fields whose values have actually changed are passed.
+        terminal.set_pause(30)
+        terminal.set_pause(30)
+        terminal.set_state_welcome()
+        self.assertEqual(notifications[1:], [{'pause'}, {'pause'}])
+
+    def test_coalesced_notifications(self):
+        terminal = Terminal()
+        notifications = []
+        pending = []
+
+        class Observer:
+            def update_to_model(self, terminal, changed):
+                notifications.append(changed)
+
+        terminal.add_observer(Observer())
+        terminal.defer_hook = pending.append
+
+        terminal.set_pause(30)
+        terminal.on_server_reply_received({'messages': ["Hello!"]})
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(notifications, [])
+
+        # This is normally called by Tk when it is idle.
+        pending.pop()()
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual(notifications[0], {'state', 'pause', 'last_server_reply'})
+        self.assertEqual(terminal.state, State.DISPLAY_SERVER_REPLY)
+
+    def test_state_timeouts(self):
+        self.now = 1000.0
+        sched = Scheduler(clock=lambda: self.now)
+        terminal = Terminal(sched)
+
+        # Nothing is pending while the terminal is idle in the welcome screen.
+        self.assertIsNone(sched.get_next_deadline())
+
+        terminal.set_state_system_panel()
+        self.assertEqual(sched.get_next_deadline(), 1030.0)
+
+        # User actions re-arm the timeout.
+        self.now = 1020.0
+        terminal.set_pause(30)
+        self.assertEqual(sched.get_next_deadline(), 1050.0)
+
+        self.now = 1030.0
+        sched.run_due()
+        self.assertEqual(terminal.state, State.SYSTEM_PANEL)
+
+        self.now = 1050.0
+        sched.run_due()
+        self.assertEqual(terminal.state, State.WELCOME)
+        self.assertIsNone(terminal.pause)
+        self.assertIsNone(sched.get_next_deadline())
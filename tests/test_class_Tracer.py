@@ -0,0 +1,99 @@
+from pathlib import Path
+from unittest import TestCase
+import json, tempfile
+
+from lost.tracing import Histogram, traced, Tracer
+
+
+class Test_Histogram(TestCase):
+
+    def test_buckets(self):
+        hist = Histogram()
+        for seconds in (0.0005, 0.001, 0.0015, 0.3, 20.0):
+            hist.add(seconds)
+
+        d = hist.as_dict()
+        self.assertEqual(d['count'], 5)
+        self.assertEqual(d['max_ms'], 20000.0)
+        self.assertEqual(d['buckets_ms']['<=1'], 2)
+        self.assertEqual(d['buckets_ms']['<=2'], 1)
+        self.assertEqual(d['buckets_ms']['<=500'], 1)
+        self.assertEqual(d['buckets_ms']['>10000'], 1)
+
+
+class Test_Tracer(TestCase):
+
+    def test_complete_trace(self):
+        tracer = Tracer()
+        trace_id = tracer.start()
+        tracer.mark(trace_id, 'apdu')
+        tracer.mark(trace_id, 'network')
+        tracer.finish(trace_id)
+
+        self.assertEqual(len(tracer.active), 0)
+        self.assertEqual(len(tracer.completed), 1)
+        report = tracer.get_report()
+        self.assertEqual(sorted(report['stages']), ['apdu', 'network', 'total'])
+        self.assertEqual([stage for stage, ms in report['recent_traces'][0]['stages_ms']], ['apdu', 'network'])
+
+        # Marks of unknown or completed traces are ignored, as is `None`.
+        tracer.mark(trace_id, 'late')
+        tracer.mark(None, 'apdu')
+        tracer.finish(None)
+        self.assertEqual(report['stages']['apdu']['count'], 1)
+
+    def test_discard_and_limits(self):
+        tracer = Tracer(max_traces=2, max_active=3)
+
+        trace_id = tracer.start()
+        tracer.discard(trace_id)
+        self.assertEqual(len(tracer.active), 0)
+
+        trace_ids = [tracer.start() for i in range(5)]
+        self.assertEqual(list(tracer.active), trace_ids[2:])
+
+        for trace_id in trace_ids:
+            tracer.finish(trace_id)
+        self.assertEqual([trace.trace_id for trace in tracer.completed], trace_ids[3:])
+
+    def test_wait_for_render(self):
+        tracer = Tracer()
+        pending = []
+        tracer.render_hook = pending.append
+
+        trace_id = tracer.start()
+        tracer.finish(trace_id, wait_for_render=True)
+        self.assertEqual(len(tracer.completed), 0)
+
+        # This is normally called by Tk when it is idle.
+        pending[0]()
+        self.assertEqual(tracer.completed[0].stages[-1][0], 'render')
+
+    def test_traced(self):
+        import lost.tracing
+
+        trace_id = lost.tracing.tracer.start()
+        action = traced(trace_id, lambda x: x * 2)
+        self.assertEqual(action(21), 42)
+
+        trace = lost.tracing.tracer.active.pop(trace_id)
+        self.assertEqual([stage for stage, duration in trace.stages], ['worker_wait', 'network'])
+
+    def test_export(self):
+        path = Path(tempfile.gettempdir()) / "tmp_LoST_test_traces.json"
+        path.unlink(missing_ok=True)
+
+        tracer = Tracer()
+        trace_id = tracer.start()
+        tracer.mark(trace_id, 'apdu')
+        tracer.finish(trace_id)
+
+        tracer.export_path = str(path)
+        tracer.export_interval = 0.0
+        tracer.on_clock_tick()
+
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['stages']['apdu']['count'], 1)
+        self.assertEqual(len(report['recent_traces']), 1)
+        path.unlink()
@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta
+import os
+import tempfile
+from unittest import TestCase
+
+from lost import settings
+from lost.clock import VirtualClock
+from lost.headless import VirtualTerminal
+from lost.main_connector import MainConnector
+from lost.modes.gateway_terminal import GatewayTerminalMixin
+from lost.modes.office_terminal import State, Terminal
+from lost.network_handler import CircuitBreaker, NetworkHandler
+from lost.thread_tools import InlineWorkerPool, thread_queue
+from tests.cases import BuiltinServerTestCase
+
+
+class Test_VirtualClock(TestCase):
+
+    def test_advance(self):
+        clock = VirtualClock(datetime(2022, 4, 2, 8, 0, 0))
+        runs = []
+
+        clock.scheduler.add_periodic("periodic", 1.0, lambda: runs.append(clock.monotonic()))
+        clock.scheduler.add_oneshot("oneshot", 2.5, lambda: runs.append(-clock.monotonic()))
+
+        # The tasks run at their deadlines, not at the end of the advance.
+        clock.advance(3.7)
+        self.assertEqual(runs, [0.0, 1.0, 2.0, -2.5, 3.0])
+        self.assertEqual(clock.monotonic(), 3.7)
+        self.assertEqual(clock.now(), datetime(2022, 4, 2, 8, 0, 3, 700000))
+        self.assertAlmostEqual(clock.time(), datetime(2022, 4, 2, 8, 0, 0).timestamp() + 3.7)
+
+        # A whole day takes no time at all.
+        clock.advance(24 * 3600)
+        self.assertEqual(len(runs), 5 + 24 * 3600)
+        self.assertEqual(clock.now(), datetime(2022, 4, 3, 8, 0, 3, 700000))
+
+
+class Test_VirtualClock_NetworkHandler(BuiltinServerTestCase):
+
+    def setUp(self):
+        self.backlog_path = os.path.join(tempfile.gettempdir(), "tmp_LoST_test_virtual_clock.sqlite3")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.backlog_path + suffix):
+                os.remove(self.backlog_path + suffix)
+        assert thread_queue.empty()
+
+        self.clock = VirtualClock()
+        self.terminal = Terminal(self.clock.scheduler)
+        self.network_handler = NetworkHandler(
+            self.terminal,
+            backlog_path=self.backlog_path,
+            worker_pool=InlineWorkerPool(),
+            old_backlog_path=None,
+            clock=self.clock,
+        )
+
+        self.main_con = MainConnector()
+        self.main_con.network_handlers.append(self.network_handler)
+        self.clock.scheduler.add_periodic("MainConnector.on_clock_tick", 1.0, self.main_con.on_clock_tick)
+
+    def tearDown(self):
+        self.network_handler.shutdown()
+
+    def test_outage_and_drain(self):
+        vt = VirtualTerminal(self.terminal, self.network_handler)
+
+        old_address = settings.SERVER_ADDRESS
+        settings.SERVER_ADDRESS = ('localhost', 9999)
+        try:
+            with self.assertLogs('lost', level='INFO'):
+                # The server is down for four hours, while the smartcards are read every ten minutes.
+                for nr in range(24):
+                    self.assertTrue(vt.tap(f"card-{nr}"))
+                    self.clock.advance(600.0)
+                    # The terminal has returned to the welcome screen on its own.
+                    self.assertEqual(self.terminal.state, State.WELCOME)
+        finally:
+            settings.SERVER_ADDRESS = old_address
+
+        self.assertEqual(len(self.network_handler.backlog), 24)
+        self.assertEqual(self.network_handler.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertLogs('lost', level='INFO'):
+            # The circuit breaker backs off by at most five minutes, so within the next
+            # hour, the server is found to be reachable again and the backlog drained.
+            self.clock.advance(3600.0)
+
+        self.assertEqual(len(self.network_handler.backlog), 0)
+        self.assertEqual(self.clock.now() - self.clock.start, timedelta(hours=5))
+
+    def test_latency_of_live_requests_only(self):
+        vt = VirtualTerminal(self.terminal, self.network_handler)
+
+        old_address = settings.SERVER_ADDRESS
+        settings.SERVER_ADDRESS = ('localhost', 9999)
+        try:
+            with self.assertLogs('lost', level='INFO'):
+                self.assertTrue(vt.tap("card-1"))
+                self.clock.advance(1.0)
+        finally:
+            settings.SERVER_ADDRESS = old_address
+
+        self.assertEqual(len(self.network_handler.backlog), 1)
+
+        with self.assertLogs('lost', level='INFO'):
+            # The replay of the backlog doesn't count towards the live timeouts.
+            self.clock.advance(600.0)
+            self.assertEqual(len(self.network_handler.backlog), 0)
+            self.assertEqual(len(self.network_handler.latency.latencies), 0)
+
+            self.assertTrue(vt.tap("card-2"))
+            self.clock.advance(1.0)
+
+        self.assertEqual(len(self.network_handler.latency.latencies), 1)
+
+    def test_gateway_taps_in_quick_succession(self):
+        class GatewayTerminal(GatewayTerminalMixin, Terminal):
+            pass
+
+        terminal = GatewayTerminal(self.clock.scheduler)
+        self.network_handler.terminal = terminal
+        vt = VirtualTerminal(terminal, self.network_handler)
+
+        with self.assertLogs('lost', level='INFO'):
+            self.assertTrue(vt.tap("card-1"))
+            self.clock.advance(1.0)
+            self.assertEqual(terminal.state, State.DISPLAY_SERVER_REPLY)
+
+            # The next worker taps while the reply to the previous one is "displayed".
+            self.assertTrue(vt.tap("card-2"))
+            self.clock.advance(0.5)
+            self.assertTrue(vt.tap("card-3"))
+            self.clock.advance(1.0)
+
+        self.assertEqual(vt.num_ignored, 0)
+        self.assertEqual(terminal.last_server_reply['smartcard_id'], "card-3")
+
+        # Without anyone watching, the terminal returns to the welcome state soon.
+        self.clock.advance(2.0)
+        self.assertEqual(terminal.state, State.WELCOME)
+
+    def test_lost_replies(self):
+        class LosingWorkerPool:
+            """Accepts the requests, but the replies never come."""
+            def submit(self, action, action_args, callback, on_error=None):
+                return True
+
+        vt = VirtualTerminal(self.terminal, self.network_handler)
+        self.network_handler.worker_pool = LosingWorkerPool()
+
+        with self.assertLogs('lost', level='INFO') as cm:
+            self.assertTrue(vt.tap("card-1"))
+            self.clock.advance(30.0)
+            self.assertEqual(self.network_handler.num_live_in_flight, 1)
+
+            # The lost live reply is given up on, and the user input goes into the backlog.
+            self.clock.advance(60.0)
+            self.assertEqual(self.network_handler.num_live_in_flight, 0)
+            self.assertEqual(len(self.network_handler.backlog), 1)
+            self.assertEqual(self.network_handler.drainer.num_in_flight, 1)
+
+            # The reply to re-sending the backlog is lost as well.
+            self.clock.advance(60.0)
+            self.assertEqual(self.network_handler.drainer.num_in_flight, 1)
+
+            self.network_handler.worker_pool = InlineWorkerPool()
+            self.clock.advance(60.0)
+
+        self.assertIn("WARNING:lost.network:NetworkHandler: The reply to event", "\n".join(cm.output))
+        self.assertIn("WARNING:lost.network:DrainScheduler: Giving up on 1 overdue replies, their backlog entries will be re-sent.", cm.output)
+        self.assertEqual(self.network_handler.drainer.num_in_flight, 0)
+        self.assertEqual(len(self.network_handler.backlog), 0)
+
+    def test_late_reply(self):
+        class HoldingWorkerPool:
+            """Accepts the requests and keeps them, so that the replies can be delivered later."""
+            def __init__(self):
+                self.tasks = []
+            def submit(self, action, action_args, callback, on_error=None):
+                self.tasks.append((action_args, callback))
+                return True
+
+        vt = VirtualTerminal(self.terminal, self.network_handler)
+        holding_pool = HoldingWorkerPool()
+        self.network_handler.worker_pool = holding_pool
+
+        with self.assertLogs('lost', level='INFO') as cm:
+            self.assertTrue(vt.tap("card-1"))
+            (user_input, *_), callback = holding_pool.tasks[0]
+
+            # The reply is overdue, so the user input goes into the backlog.
+            self.clock.advance(61.0)
+            self.assertEqual(len(self.network_handler.backlog), 1)
+            num_failures = self.network_handler.breaker.num_failures
+            last_server_reply = self.terminal.last_server_reply
+
+            # The late reply neither adds a second backlog entry nor counts as a failure,
+            # nor does it show up at the terminal.
+            callback(user_input, {}, "ConnectionError: The reply came too late.")
+
+        self.assertIn("INFO:lost.network:    --> ignoring the late reply, event", "\n".join(cm.output))
+        self.assertEqual(len(self.network_handler.backlog), 1)
+        self.assertEqual(self.network_handler.breaker.num_failures, num_failures)
+        self.assertIs(self.terminal.last_server_reply, last_server_reply)
+        self.assertEqual(self.network_handler.expired_live, set())
+        self.assertTrue(thread_queue.empty())
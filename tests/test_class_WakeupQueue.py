@@ -0,0 +1,39 @@
+from unittest import TestCase
+import select
+
+from lost.thread_tools import WakeupQueue
+
+
+class Test_WakeupQueue(TestCase):
+
+    def is_readable(self, q):
+        readable, _, _ = select.select([q.fileno()], [], [], 0)
+        return bool(readable)
+
+    def test_put_signals_the_pipe(self):
+        q = WakeupQueue()
+        self.assertFalse(self.is_readable(q))
+
+        q.put(("callback", ("args",)))
+        q.put(("callback", ("more args",)))
+        self.assertTrue(self.is_readable(q))
+
+        q.clear_wakeup()
+        self.assertFalse(self.is_readable(q))
+
+        # Clearing the wakeup signals doesn't touch the items.
+        self.assertEqual(q.get(block=False), ("callback", ("args",)))
+        self.assertEqual(q.get(block=False), ("callback", ("more args",)))
+        self.assertTrue(q.empty())
+
+    def test_latency_stats(self):
+        q = WakeupQueue()
+        self.assertEqual(q.get_latency_stats(), (0, 0.0, 0.0))
+
+        q.put("item")
+        q.get()
+
+        count, mean, max_latency = q.get_latency_stats()
+        self.assertEqual(count, 1)
+        self.assertGreaterEqual(mean, 0.0)
+        self.assertEqual(mean, max_latency)
@@ -0,0 +1,120 @@
+from unittest import TestCase
+import threading
+
+from lost.thread_tools import thread_queue, WorkerPool
+
+
+def add(a, b):
+    return (a + b,)
+
+
+def wait_for(event):
+    event.wait()
+    return ("waited",)
+
+
+def on_result(*args):
+    pass
+
+
+class Test_WorkerPool(TestCase):
+
+    def setUp(self):
+        assert thread_queue.empty()
+
+    def test_results_go_into_thread_queue(self):
+        pool = WorkerPool(num_workers=2)
+        self.assertTrue(pool.submit(add, (2, 3), on_result))
+
+        callback, args = thread_queue.get(block=True)
+        self.assertEqual(callback, on_result)
+        self.assertEqual(args, (5,))
+
+        pool.shutdown()
+        stats = pool.get_stats()
+        self.assertEqual(stats['submitted'], 1)
+        self.assertEqual(stats['completed'], 1)
+
+    def test_reject_when_full(self):
+        release = threading.Event()
+        pool = WorkerPool(num_workers=1, max_queued=1, rejection_policy='reject')
+
+        # The first action occupies the only worker, the second one fills the queue.
+        # Wait until the worker has picked up the first one before submitting more.
+        self.assertTrue(pool.submit(wait_for, (release,), on_result))
+        while not pool.tasks.empty():
+            pass
+        self.assertTrue(pool.submit(wait_for, (release,), on_result))
+
+        with self.assertLogs(logger="lost", level="WARNING"):
+            self.assertFalse(pool.submit(add, (1, 1), on_result))
+
+        release.set()
+        pool.shutdown()
+
+        for i in range(2):
+            thread_queue.get(block=True)
+        self.assertTrue(thread_queue.empty())
+        self.assertEqual(pool.get_stats()['rejected'], 1)
+
+    def test_drop_oldest_when_full(self):
+        release = threading.Event()
+        pool = WorkerPool(num_workers=1, max_queued=1, rejection_policy='drop_oldest')
+
+        self.assertTrue(pool.submit(wait_for, (release,), on_result))
+        while not pool.tasks.empty():
+            pass
+        self.assertTrue(pool.submit(add, (1, 1), on_result))
+
+        with self.assertLogs(logger="lost", level="WARNING"):
+            self.assertTrue(pool.submit(add, (2, 2), on_result))
+
+        release.set()
+        pool.shutdown()
+
+        results = [thread_queue.get(block=True)[1] for i in range(2)]
+        self.assertEqual(results, [("waited",), (4,)])
+        self.assertTrue(thread_queue.empty())
+        self.assertEqual(pool.get_stats()['dropped'], 1)
+
+    def test_callback_on_error(self):
+        def fail():
+            raise ValueError("broken")
+
+        def on_error(message):
+            return ("error", message)
+
+        pool = WorkerPool(num_workers=1)
+
+        with self.assertLogs(logger="lost", level="ERROR"):
+            self.assertTrue(pool.submit(fail, (), on_result, on_error))
+            callback, args = thread_queue.get(block=True)
+
+        # The callback learns about the exception instead of waiting forever.
+        self.assertEqual(callback, on_result)
+        self.assertEqual(args, ("error", "WorkerPool: fail() raised ValueError('broken')"))
+
+        pool.shutdown()
+        self.assertEqual(pool.get_stats()['failed'], 1)
+
+    def test_callback_on_drop(self):
+        release = threading.Event()
+        pool = WorkerPool(num_workers=1, max_queued=1, rejection_policy='drop_oldest')
+
+        self.assertTrue(pool.submit(wait_for, (release,), on_result))
+        while not pool.tasks.empty():
+            pass
+        self.assertTrue(pool.submit(add, (1, 1), on_result, lambda message: ("dropped", message)))
+
+        with self.assertLogs(logger="lost", level="WARNING"):
+            self.assertTrue(pool.submit(add, (2, 2), on_result))
+
+        # The dropped action's callback is told right away.
+        self.assertEqual(thread_queue.get(block=False)[1], ("dropped", "WorkerPool: Dropped add(), the queue was full."))
+
+        release.set()
+        pool.shutdown()
+
+        results = [thread_queue.get(block=True)[1] for i in range(2)]
+        self.assertEqual(results, [("waited",), (4,)])
+        self.assertTrue(thread_queue.empty())